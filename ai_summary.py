@@ -9,10 +9,20 @@ import urllib.error
 from typing import Optional
 
 from psycopg2.extras import RealDictCursor
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 from config import ANTHROPIC_API_KEY
 from db_helpers import get_db
 
 
+# Event types that carry no information for a summary
+SYNC_NOISE_EVENTS = ('b2bwave_sync', 'auto_sync', 'status_check')
+
+
 def is_configured() -> bool:
     """Check if Anthropic API is configured"""
     return bool(ANTHROPIC_API_KEY)
@@ -33,7 +43,7 @@ def call_anthropic_api(prompt: str, max_tokens: int = 1024) -> str:
         ]
     }
 
-    data = json.dumps(payload).encode('utf-8')
+    data = orjson.dumps(payload) if ORJSON_AVAILABLE else json.dumps(payload).encode('utf-8')
 
     req = urllib.request.Request(url, data=data, method='POST')
     req.add_header("Content-Type", "application/json")
@@ -42,7 +52,8 @@ def call_anthropic_api(prompt: str, max_tokens: int = 1024) -> str:
 
     try:
         with urllib.request.urlopen(req, timeout=60) as response:
-            result = json.loads(response.read().decode())
+            body = response.read()
+            result = orjson.loads(body) if ORJSON_AVAILABLE else json.loads(body)
             if result.get('content') and len(result['content']) > 0:
                 return result['content'][0].get('text', '')
             return "No summary generated"
@@ -58,76 +69,108 @@ def call_anthropic_api(prompt: str, max_tokens: int = 1024) -> str:
 def generate_order_summary(order_id: str) -> str:
     """Generate AI summary for an order based on all available data - SHORT version for card display"""
 
-    # Gather all order data
+    # Gather all order data in one round trip: the order row plus its latest
+    # events (sync noise filtered out) and email snippets as JSON arrays, with
+    # the dates already formatted for the prompt
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get order details
-            cur.execute("SELECT * FROM orders WHERE order_id = %s", (order_id,))
-            order = cur.fetchone()
-
-            if not order:
-                return "Order not found"
-
-            # Get email snippets
             cur.execute("""
-                SELECT email_from, email_subject, email_snippet, email_date, snippet_type
-                FROM order_email_snippets
-                WHERE order_id = %s
-                ORDER BY email_date DESC
-                LIMIT 20
-            """, (order_id,))
-            snippets = cur.fetchall()
-
-            # Get events
-            cur.execute("""
-                SELECT event_type, event_data, created_at
-                FROM order_events
-                WHERE order_id = %s
-                ORDER BY created_at DESC
-                LIMIT 10
-            """, (order_id,))
-            events = cur.fetchall()
-
-    # Build context for AI
-    context_parts = []
-
-    # Order info
-    context_parts.append(f"ORDER #{order_id}")
-    context_parts.append(f"Customer: {order.get('company_name') or order.get('customer_name')}")
-    context_parts.append(f"Order Total: ${order.get('order_total', 0)}")
-    context_parts.append(f"Payment Received: {'Yes' if order.get('payment_received') else 'No'}")
-    if order.get('tracking'):
-        context_parts.append(f"Tracking: {order.get('tracking')}")
-    if order.get('pro_number'):
-        context_parts.append(f"PRO Number: {order.get('pro_number')}")
-    if order.get('comments'):
-        context_parts.append(f"Customer Comments: {order.get('comments')}")
-    if order.get('notes'):
-        context_parts.append(f"Internal Notes: {order.get('notes')}")
+                SELECT o.*,
+                       COALESCE((
+                           SELECT json_agg(e ORDER BY e.created_at DESC)
+                           FROM (
+                               SELECT event_type, created_at,
+                                      to_char(created_at, 'MM/DD HH24:MI') AS created_label
+                               FROM order_events
+                               WHERE order_id = o.order_id AND event_type <> ALL(%s)
+                               ORDER BY created_at DESC
+                               LIMIT 10
+                           ) e
+                       ), '[]') AS summary_events,
+                       COALESCE((
+                           SELECT json_agg(sn ORDER BY sn.email_date DESC NULLS FIRST)
+                           FROM (
+                               SELECT email_from, email_subject, email_snippet, email_date, snippet_type,
+                                      to_char(email_date, 'MM/DD') AS date_label
+                               FROM order_email_snippets
+                               WHERE order_id = o.order_id
+                               ORDER BY email_date DESC
+                               LIMIT 20
+                           ) sn
+                       ), '[]') AS summary_snippets
+                FROM orders o
+                WHERE o.order_id = %s
+            """, (list(SYNC_NOISE_EVENTS), order_id))
+            order = cur.fetchone()
 
-    # Warehouses
-    warehouses = [order.get(f'warehouse_{i}') for i in range(1, 5) if order.get(f'warehouse_{i}')]
+    if not order:
+        return "Order not found"
+    important_events = order.pop('summary_events')
+    snippets = order.pop('summary_snippets')
+
+    # Nothing notable yet - skip the Claude round trip. Anything past the payment
+    # stage (warehouse, BOL, shipping, completion) always goes to Claude
+    interesting = (
+        bool(important_events)
+        or any(s.get('email_snippet') for s in snippets)
+        or order.get('comments')
+        or order.get('notes')
+        or order.get('tracking')
+        or order.get('pro_number')
+        or order.get('sent_to_warehouse')
+        or order.get('warehouse_confirmed')
+        or order.get('bol_sent')
+        or order.get('is_complete')
+    )
+    if not interesting:
+        if order.get('payment_received'):
+            return "• Payment received, no customer emails or notes yet\n• Next action: Order from warehouse"
+        if order.get('payment_link_sent'):
+            return "• Payment link sent, no customer emails or notes yet\n• Next action: Wait for payment"
+        return "• New order, no customer emails or notes yet\n• Next action: Send payment link"
+
+    # Build context for AI - read each order field once
+    comments = order.get('comments')
+    notes = order.get('notes')
+    tracking = order.get('tracking')
+    pro_number = order.get('pro_number')
+    warehouses = [w for w in (order.get('warehouse_1'), order.get('warehouse_2'),
+                              order.get('warehouse_3'), order.get('warehouse_4')) if w]
+
+    context_parts = [
+        f"ORDER #{order_id}",
+        f"Customer: {order.get('company_name') or order.get('customer_name')}",
+        f"Order Total: ${order.get('order_total', 0)}",
+        f"Payment Received: {'Yes' if order.get('payment_received') else 'No'}",
+    ]
+    if tracking:
+        context_parts.append(f"Tracking: {tracking}")
+    if pro_number:
+        context_parts.append(f"PRO Number: {pro_number}")
+    if comments:
+        context_parts.append(f"Customer Comments: {comments}")
+    if notes:
+        context_parts.append(f"Internal Notes: {notes}")
     if warehouses:
         context_parts.append(f"Warehouses: {', '.join(warehouses)}")
 
     # Email snippets
     if snippets:
         context_parts.append("\nEMAIL COMMUNICATIONS:")
-        for s in snippets:
-            date_str = s['email_date'].strftime('%m/%d') if s.get('email_date') else ''
-            context_parts.append(f"- [{date_str}] From: {s.get('email_from', 'Unknown')}")
-            context_parts.append(f"  Subject: {s.get('email_subject', '')}")
-            if s.get('email_snippet'):
-                context_parts.append(f"  {s['email_snippet'][:300]}")
-
-    # Events (filter out sync noise)
-    if events:
-        important_events = [e for e in events if e.get('event_type') not in ('b2bwave_sync', 'auto_sync', 'status_check')]
-        if important_events:
-            context_parts.append("\nORDER EVENTS:")
-            for e in important_events:
-                date_str = e['created_at'].strftime('%m/%d %H:%M') if e.get('created_at') else ''
-                context_parts.append(f"- [{date_str}] {e.get('event_type')}")
+        context_parts.extend(
+            f"- [{s['date_label'] or ''}] From: {s.get('email_from', 'Unknown')}\n"
+            f"  Subject: {s.get('email_subject', '')}"
+            + (f"\n  {s['email_snippet'][:300]}" if s['email_snippet'] else '')
+            for s in snippets
+        )
+
+    # Events
+    if important_events:
+        context_parts.append("\nORDER EVENTS:")
+        context_parts.extend(
+            f"- [{e['created_label'] or ''}] {e['event_type']}"
+            for e in important_events
+        )
 
     context = "\n".join(context_parts)
 
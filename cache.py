@@ -0,0 +1,145 @@
+"""
+cache.py
+Read-through cache for hot order reads in CFC Order Backend.
+Uses Redis when REDIS_URL is set and the redis package is installed; otherwise
+falls back to a per-process in-memory TTL cache.
+"""
+
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+from config import REDIS_URL
+
+# In-memory fallback is cleared wholesale past this many entries
+LOCAL_CACHE_MAX_ENTRIES = 1000
+
+_redis = redis.Redis.from_url(REDIS_URL) if REDIS_AVAILABLE and REDIS_URL else None
+# True when entries are shared across workers, so one worker's delete covers all of them
+CACHE_SHARED = _redis is not None
+_local = {}
+_local_lock = threading.Lock()
+
+
+def cache_get(key: str) -> Optional[bytes]:
+    """Cached bytes for key, or None on a miss (or if Redis is unreachable)"""
+    if _redis is not None:
+        try:
+            return _redis.get(key)
+        except redis.RedisError:
+            return None
+
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires > time.monotonic():
+            return value
+        del _local[key]
+        return None
+
+
+def cache_set(key: str, value: bytes, ttl: int):
+    """Store value under key for ttl seconds"""
+    if _redis is not None:
+        try:
+            _redis.setex(key, ttl, value)
+        except redis.RedisError:
+            pass
+        return
+
+    with _local_lock:
+        if len(_local) >= LOCAL_CACHE_MAX_ENTRIES:
+            _local.clear()
+        _local[key] = (time.monotonic() + ttl, value)
+
+
+def cache_delete(*keys: str):
+    """Drop the given keys"""
+    if _redis is not None:
+        try:
+            _redis.delete(*keys)
+        except redis.RedisError:
+            pass
+        return
+
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+def cache_delete_prefix(prefix: str):
+    """Drop every key starting with prefix"""
+    if _redis is not None:
+        try:
+            keys = list(_redis.scan_iter(match=f"{prefix}*", count=500))
+            if keys:
+                _redis.delete(*keys)
+        except redis.RedisError:
+            pass
+        return
+
+    with _local_lock:
+        for key in [k for k in _local if k.startswith(prefix)]:
+            del _local[key]
+
+
+def cache_stream(key: str, ttl: int, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Pass a streamed response through, caching the full body once it completes"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache_set(key, b''.join(parts), ttl)
+
+
+# =============================================================================
+# ORDER CACHE KEYS
+# =============================================================================
+
+def order_cache_key(order_id: str) -> str:
+    return f"order:{order_id}"
+
+
+def orders_list_cache_key(status: Optional[str], include_complete: bool, limit: int) -> str:
+    return f"orders:{status}:{include_complete}:{limit}"
+
+
+def summary_cache_key(order_id: str) -> str:
+    return f"summary:{order_id}"
+
+
+def status_summary_cache_key() -> str:
+    # Under "orders:" so invalidate_order_cache drops it along with the order lists
+    return "orders:status-summary"
+
+
+TRUSTED_CUSTOMERS_CACHE_KEY = "trusted-customers"
+
+
+def checkout_snapshot_cache_key(order_id: str) -> str:
+    return f"checkout:{order_id}"
+
+
+def invalidate_order_cache(order_id: str = None):
+    """Drop a cached order (or all of them) and every cached order list"""
+    if order_id is None:
+        cache_delete_prefix("order:")
+    else:
+        cache_delete(order_cache_key(order_id))
+    cache_delete_prefix("orders:")
+
+
+def invalidate_orders(order_ids: Iterable[str]):
+    """Drop the given cached orders and every cached order list"""
+    keys = [order_cache_key(order_id) for order_id in order_ids]
+    if keys:
+        cache_delete(*keys)
+    cache_delete_prefix("orders:")
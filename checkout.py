@@ -4,8 +4,11 @@ B2BWave order checkout with R+L shipping quotes and Square payment
 """
 
 import os
+import re
 import json
 import base64
+import asyncio
+import functools
 import urllib.request
 import urllib.error
 import hmac
@@ -13,6 +16,8 @@ import hashlib
 from datetime import datetime
 from typing import Optional, Dict, Any
 
+import httpx
+
 # Config from environment
 B2BWAVE_URL = os.environ.get("B2BWAVE_URL", "").strip().rstrip('/')
 B2BWAVE_USERNAME = os.environ.get("B2BWAVE_USERNAME", "").strip()
@@ -159,6 +164,8 @@ SKU_WAREHOUSE_MAP = {
 
 # Oversized detection keywords
 OVERSIZED_KEYWORDS = ['PANTRY', 'OVEN', 'TALL', '96', 'BROOM', 'LINEN', 'UTILITY']
+# All keywords in one pattern, so a product name is scanned once
+_OVERSIZED_RE = re.compile('|'.join(re.escape(keyword) for keyword in OVERSIZED_KEYWORDS))
 
 
 def get_warehouse_for_sku(sku: str) -> Optional[str]:
@@ -173,8 +180,7 @@ def get_warehouse_for_sku(sku: str) -> Optional[str]:
 
 def is_oversized(product_name: str) -> bool:
     """Check if product is oversized based on name"""
-    name_upper = product_name.upper()
-    return any(keyword in name_upper for keyword in OVERSIZED_KEYWORDS)
+    return _OVERSIZED_RE.search(product_name.upper()) is not None
 
 
 def group_items_by_warehouse(line_items: list) -> Dict[str, list]:
@@ -273,21 +279,26 @@ def get_shipping_quote(origin_zip: str, dest_zip: str, weight: float, is_residen
 SMALL_PACKAGE_WEIGHT_LIMIT = 70  # lbs - orders under this use Shippo
 
 
+def _shippo_rates_request(origin_zip: str, dest_zip: str, weight: float, is_residential: bool) -> tuple:
+    """URL and query params for our backend's Shippo rates endpoint"""
+    shippo_url = os.environ.get("SHIPPO_API_URL", "").strip()
+    if not shippo_url:
+        # Use our backend's Shippo endpoint
+        shippo_url = os.environ.get("CFC_BACKEND_URL", "https://cfcorderbackend-sandbox.onrender.com").strip()
+    
+    params = {
+        'origin_zip': origin_zip,
+        'dest_zip': dest_zip,
+        'weight_lbs': weight,
+        'is_residential': 'true' if is_residential else 'false'
+    }
+    return f"{shippo_url}/shippo/rates", params
+
+
 def get_shippo_quote(origin_zip: str, dest_zip: str, weight: float, is_residential: bool = True) -> Dict:
     """Get small package shipping quote from Shippo API"""
     try:
-        shippo_url = os.environ.get("SHIPPO_API_URL", "").strip()
-        if not shippo_url:
-            # Use our backend's Shippo endpoint
-            shippo_url = os.environ.get("CFC_BACKEND_URL", "https://cfcorderbackend-sandbox.onrender.com").strip()
-        
-        url = f"{shippo_url}/shippo/rates"
-        params = {
-            'origin_zip': origin_zip,
-            'dest_zip': dest_zip,
-            'weight_lbs': weight,
-            'is_residential': 'true' if is_residential else 'false'
-        }
+        url, params = _shippo_rates_request(origin_zip, dest_zip, weight, is_residential)
         
         query_string = '&'.join(f"{k}={v}" for k, v in params.items())
         full_url = f"{url}?{query_string}"
@@ -302,6 +313,18 @@ def get_shippo_quote(origin_zip: str, dest_zip: str, weight: float, is_residenti
         return {'success': False, 'error': str(e)}
 
 
+async def aget_shippo_quote(client: httpx.AsyncClient, origin_zip: str, dest_zip: str,
+                            weight: float, is_residential: bool = True) -> Dict:
+    """get_shippo_quote on the shared async client"""
+    try:
+        url, params = _shippo_rates_request(origin_zip, dest_zip, weight, is_residential)
+        resp = await client.get(url, params=params)
+        resp.raise_for_status()
+        return resp.json()
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
 def select_shipping_method(weight: float, items: list) -> str:
     """
     Determine which shipping method to use based on weight and items.
@@ -321,26 +344,14 @@ def select_shipping_method(weight: float, items: list) -> str:
         return 'ltl'
 
 
-def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
+def _plan_order_shipments(order_data: dict, dest_address: dict) -> tuple:
     """
-    Calculate shipping for an entire order, grouped by warehouse.
-    Uses Shippo for small packages (<70 lbs) and R+L for LTL (70+ lbs).
-    
-    Weight Priority:
-    1. RTA database (SKU-level weights) - most accurate for split orders
-    2. B2BWave total_weight - good for single warehouse orders
-    3. Estimate at 30 lbs per item - fallback
+    Group an order's items by warehouse and work out each shipment's weight,
+    oversized flag and shipping method - everything but the carrier quote.
+    Looks SKU weights up in the RTA database, so this blocks on the DB.
     
-    Returns:
-        {
-            'shipments': [
-                {'warehouse': 'LI', 'items': [...], 'quote': {...}},
-                {'warehouse': 'ROC', 'items': [...], 'quote': {...}},
-            ],
-            'total_shipping': 250.00,
-            'total_items': 1500.00,
-            'grand_total': 1750.00
-        }
+    Returns (shipments, dest_zip, is_residential). Shipments that can't be
+    quoted (unknown warehouse) already carry their 'quote' and 'shipping_cost'.
     """
     line_items = order_data.get('line_items', []) or order_data.get('products', [])
     
@@ -365,7 +376,6 @@ def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
     dest_zip = dest_address.get('zip', '') or dest_address.get('postal_code', '')
     
     shipments = []
-    total_shipping = 0
     
     # Build SKU to RTA info lookup
     sku_to_rta = {}
@@ -416,38 +426,6 @@ def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
         # Check for oversized using RTA long pallet flag OR keyword detection
         oversized = has_long_pallet or any(is_oversized(item.get('name', '')) for item in items)
         
-        # Select shipping method based on weight (and future rules)
-        shipping_method = select_shipping_method(weight, items)
-        
-        # Get quote from appropriate carrier
-        if shipping_method == 'small_package':
-            # Use Shippo for small packages
-            quote = get_shippo_quote(
-                origin_zip=warehouse['zip'],
-                dest_zip=dest_zip,
-                weight=weight,
-                is_residential=is_residential
-            )
-            
-            shipping_cost = 0
-            if quote.get('success') and quote.get('cheapest'):
-                shipping_cost = quote['cheapest'].get('amount', 0)
-                # Add markup for small package (optional - adjust as needed)
-                # shipping_cost = shipping_cost * 1.1  # 10% markup
-        else:
-            # Use R+L for LTL freight
-            quote = get_shipping_quote(
-                origin_zip=warehouse['zip'],
-                dest_zip=dest_zip,
-                weight=weight,
-                is_residential=is_residential,
-                is_oversized=oversized
-            )
-            
-            shipping_cost = 0
-            if quote.get('success') and quote.get('quote'):
-                shipping_cost = quote['quote'].get('customer_price', 0)
-        
         shipments.append({
             'warehouse': warehouse_code,
             'warehouse_name': warehouse['name'],
@@ -455,12 +433,32 @@ def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
             'items': items,
             'weight': weight,
             'is_oversized': oversized,
-            'shipping_method': shipping_method,
-            'quote': quote,
-            'shipping_cost': shipping_cost
+            # Select shipping method based on weight (and future rules)
+            'shipping_method': select_shipping_method(weight, items),
         })
-        
-        total_shipping += shipping_cost
+    
+    return shipments, dest_zip, is_residential
+
+
+def _apply_shipment_quote(shipment: dict, quote: Dict):
+    """Attach a carrier quote to a planned shipment along with its shipping cost"""
+    shipping_cost = 0
+    if shipment['shipping_method'] == 'small_package':
+        if quote.get('success') and quote.get('cheapest'):
+            shipping_cost = quote['cheapest'].get('amount', 0)
+            # Add markup for small package (optional - adjust as needed)
+            # shipping_cost = shipping_cost * 1.1  # 10% markup
+    elif quote.get('success') and quote.get('quote'):
+        shipping_cost = quote['quote'].get('customer_price', 0)
+    
+    shipment['quote'] = quote
+    shipment['shipping_cost'] = shipping_cost
+
+
+def _order_shipping_totals(order_data: dict, shipments: list, dest_address: dict) -> Dict:
+    """Final calculate_order_shipping result from quoted shipments"""
+    line_items = order_data.get('line_items', []) or order_data.get('products', [])
+    total_shipping = sum(shipment['shipping_cost'] for shipment in shipments)
     
     # Calculate item total
     total_items = 0
@@ -478,76 +476,182 @@ def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
     }
 
 
+def calculate_order_shipping(order_data: dict, dest_address: dict) -> Dict:
+    """
+    Calculate shipping for an entire order, grouped by warehouse.
+    Uses Shippo for small packages (<70 lbs) and R+L for LTL (70+ lbs).
+    
+    Weight Priority:
+    1. RTA database (SKU-level weights) - most accurate for split orders
+    2. B2BWave total_weight - good for single warehouse orders
+    3. Estimate at 30 lbs per item - fallback
+    
+    Returns:
+        {
+            'shipments': [
+                {'warehouse': 'LI', 'items': [...], 'quote': {...}},
+                {'warehouse': 'ROC', 'items': [...], 'quote': {...}},
+            ],
+            'total_shipping': 250.00,
+            'total_items': 1500.00,
+            'grand_total': 1750.00
+        }
+    """
+    shipments, dest_zip, is_residential = _plan_order_shipments(order_data, dest_address)
+    
+    for shipment in shipments:
+        if 'quote' in shipment:
+            continue
+        
+        # Get quote from appropriate carrier
+        if shipment['shipping_method'] == 'small_package':
+            # Use Shippo for small packages
+            quote = get_shippo_quote(
+                origin_zip=shipment['origin_zip'],
+                dest_zip=dest_zip,
+                weight=shipment['weight'],
+                is_residential=is_residential
+            )
+        else:
+            # Use R+L for LTL freight
+            quote = get_shipping_quote(
+                origin_zip=shipment['origin_zip'],
+                dest_zip=dest_zip,
+                weight=shipment['weight'],
+                is_residential=is_residential,
+                is_oversized=shipment['is_oversized']
+            )
+        _apply_shipment_quote(shipment, quote)
+    
+    return _order_shipping_totals(order_data, shipments, dest_address)
+
+
+async def acalculate_order_shipping(client: httpx.AsyncClient, order_data: dict, dest_address: dict) -> Dict:
+    """
+    calculate_order_shipping for async endpoints: every warehouse is quoted at
+    once instead of one after another. Shippo goes over the shared client; the
+    RTA lookup and R+L (rl_carriers is blocking) run on worker threads.
+    """
+    shipments, dest_zip, is_residential = await asyncio.to_thread(_plan_order_shipments, order_data, dest_address)
+    
+    async def quote(shipment):
+        if shipment['shipping_method'] == 'small_package':
+            return await aget_shippo_quote(client, shipment['origin_zip'], dest_zip,
+                                           shipment['weight'], is_residential)
+        return await asyncio.to_thread(get_shipping_quote, shipment['origin_zip'], dest_zip,
+                                       shipment['weight'], is_residential, shipment['is_oversized'])
+    
+    pending = [shipment for shipment in shipments if 'quote' not in shipment]
+    quotes = await asyncio.gather(*(quote(shipment) for shipment in pending))
+    for shipment, shipment_quote in zip(pending, quotes):
+        _apply_shipment_quote(shipment, shipment_quote)
+    
+    return _order_shipping_totals(order_data, shipments, dest_address)
+
+
+# Shared by the async checkout endpoints (created at app startup, closed at shutdown)
+def new_http_client() -> httpx.AsyncClient:
+    """Keep-alive client for B2BWave, Shippo and Square calls"""
+    return httpx.AsyncClient(
+        timeout=30,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    )
+
+
+def _b2bwave_order_request(order_id: str) -> tuple:
+    """URL and auth header for looking up one B2BWave order"""
+    # Use list endpoint with filter (same as main.py)
+    url = f"{B2BWAVE_URL}/api/orders.json?id_eq={order_id}"
+    
+    # Basic auth
+    credentials = f"{B2BWAVE_USERNAME}:{B2BWAVE_API_KEY}"
+    encoded_credentials = base64.b64encode(credentials.encode()).decode()
+    return url, {'Authorization': f'Basic {encoded_credentials}'}
+
+
+def _normalize_b2bwave_order(data) -> Optional[Dict]:
+    """Checkout-flow order dict from a B2BWave orders.json response"""
+    # API returns a list of {order: {...}} objects
+    if not isinstance(data, list) or len(data) == 0:
+        return None
+    
+    # Extract the order from the nested structure
+    raw_order = data[0].get('order', data[0])
+    
+    # Normalize the data structure for our checkout flow
+    order_products = raw_order.get('order_products', [])
+    line_items = []
+    for op in order_products:
+        product = op.get('order_product', op)
+        line_items.append({
+            'sku': product.get('product_code', ''),
+            'name': product.get('product_name', ''),
+            'quantity': int(float(product.get('quantity', 1))),
+            'price': float(product.get('price', 0)),
+        })
+    
+    # Get total_weight from B2BWave (may be string like "8.0")
+    total_weight_raw = raw_order.get('total_weight', 0)
+    try:
+        total_weight = float(total_weight_raw) if total_weight_raw else 0
+    except (ValueError, TypeError):
+        total_weight = 0
+    
+    return {
+        'id': raw_order.get('id'),
+        'customer_name': raw_order.get('customer_name'),
+        'customer_email': raw_order.get('customer_email'),
+        'customer_phone': raw_order.get('customer_phone', ''),
+        'company_name': raw_order.get('customer_company'),
+        'line_items': line_items,
+        'subtotal': float(raw_order.get('gross_total', 0)),
+        'total_weight': total_weight,  # B2BWave's actual weight
+        'shipping_address': {
+            'address': raw_order.get('address', ''),
+            'address2': raw_order.get('address2', ''),
+            'city': raw_order.get('city', ''),
+            'state': raw_order.get('province', ''),
+            'zip': raw_order.get('postal_code', ''),
+            'country': raw_order.get('country', 'US'),
+        },
+        'comments': raw_order.get('comments_customer', ''),
+    }
+
+
 def fetch_b2bwave_order(order_id: str) -> Optional[Dict]:
     """Fetch order details from B2BWave API"""
     if not B2BWAVE_URL or not B2BWAVE_API_KEY:
         return None
     
     try:
-        # Use list endpoint with filter (same as main.py)
-        url = f"{B2BWAVE_URL}/api/orders.json?id_eq={order_id}"
-        
-        # Basic auth
-        credentials = f"{B2BWAVE_USERNAME}:{B2BWAVE_API_KEY}"
-        encoded_credentials = base64.b64encode(credentials.encode()).decode()
-        
-        req = urllib.request.Request(url)
-        req.add_header('Authorization', f'Basic {encoded_credentials}')
+        url, headers = _b2bwave_order_request(order_id)
+        req = urllib.request.Request(url, headers=headers)
         
         with urllib.request.urlopen(req, timeout=30) as resp:
-            data = json.loads(resp.read().decode())
-            # API returns a list of {order: {...}} objects
-            if isinstance(data, list) and len(data) > 0:
-                # Extract the order from the nested structure
-                raw_order = data[0].get('order', data[0])
-                
-                # Normalize the data structure for our checkout flow
-                order_products = raw_order.get('order_products', [])
-                line_items = []
-                for op in order_products:
-                    product = op.get('order_product', op)
-                    line_items.append({
-                        'sku': product.get('product_code', ''),
-                        'name': product.get('product_name', ''),
-                        'quantity': int(float(product.get('quantity', 1))),
-                        'price': float(product.get('price', 0)),
-                    })
-                
-                # Get total_weight from B2BWave (may be string like "8.0")
-                total_weight_raw = raw_order.get('total_weight', 0)
-                try:
-                    total_weight = float(total_weight_raw) if total_weight_raw else 0
-                except (ValueError, TypeError):
-                    total_weight = 0
-                
-                return {
-                    'id': raw_order.get('id'),
-                    'customer_name': raw_order.get('customer_name'),
-                    'customer_email': raw_order.get('customer_email'),
-                    'customer_phone': raw_order.get('customer_phone', ''),
-                    'company_name': raw_order.get('customer_company'),
-                    'line_items': line_items,
-                    'subtotal': float(raw_order.get('gross_total', 0)),
-                    'total_weight': total_weight,  # B2BWave's actual weight
-                    'shipping_address': {
-                        'address': raw_order.get('address', ''),
-                        'address2': raw_order.get('address2', ''),
-                        'city': raw_order.get('city', ''),
-                        'state': raw_order.get('province', ''),
-                        'zip': raw_order.get('postal_code', ''),
-                        'country': raw_order.get('country', 'US'),
-                    },
-                    'comments': raw_order.get('comments_customer', ''),
-                }
-            return None
+            return _normalize_b2bwave_order(json.loads(resp.read().decode()))
             
     except Exception as e:
         print(f"[B2BWAVE] Error fetching order {order_id}: {e}")
         return None
 
 
-def create_square_payment_link(amount_cents: int, order_id: str, customer_email: str) -> Optional[str]:
-    """Create a Square payment link for the order"""
+async def afetch_b2bwave_order(client: httpx.AsyncClient, order_id: str) -> Optional[Dict]:
+    """fetch_b2bwave_order on the shared async client"""
+    if not B2BWAVE_URL or not B2BWAVE_API_KEY:
+        return None
+    
+    try:
+        url, headers = _b2bwave_order_request(order_id)
+        resp = await client.get(url, headers=headers)
+        resp.raise_for_status()
+        return _normalize_b2bwave_order(resp.json())
+    except Exception as e:
+        print(f"[B2BWAVE] Error fetching order {order_id}: {e}")
+        return None
+
+
+def _square_payment_link_request(amount_cents: int, order_id: str, customer_email: str) -> Optional[tuple]:
+    """URL, payload and headers for creating a Square payment link, or None if Square isn't configured"""
     if not SQUARE_ACCESS_TOKEN:
         print("[SQUARE] No access token configured")
         return None
@@ -556,42 +660,52 @@ def create_square_payment_link(amount_cents: int, order_id: str, customer_email:
         print("[SQUARE] No location ID configured")
         return None
     
-    try:
-        # Square Checkout API
-        base_url = "https://connect.squareupsandbox.com" if SQUARE_ENVIRONMENT == "sandbox" else "https://connect.squareup.com"
-        url = f"{base_url}/v2/online-checkout/payment-links"
-        
-        payload = {
-            "idempotency_key": f"order-{order_id}-{datetime.now().timestamp()}",
-            "quick_pay": {
-                "name": f"CFC Order #{order_id}",
-                "price_money": {
-                    "amount": amount_cents,
-                    "currency": "USD"
-                },
-                "location_id": SQUARE_LOCATION_ID
+    # Square Checkout API
+    base_url = "https://connect.squareupsandbox.com" if SQUARE_ENVIRONMENT == "sandbox" else "https://connect.squareup.com"
+    url = f"{base_url}/v2/online-checkout/payment-links"
+    
+    payload = {
+        "idempotency_key": f"order-{order_id}-{datetime.now().timestamp()}",
+        "quick_pay": {
+            "name": f"CFC Order #{order_id}",
+            "price_money": {
+                "amount": amount_cents,
+                "currency": "USD"
             },
-            "pre_populated_data": {
-                "buyer_email": customer_email
-            } if customer_email else {}
+            "location_id": SQUARE_LOCATION_ID
+        },
+        "pre_populated_data": {
+            "buyer_email": customer_email
+        } if customer_email else {}
+    }
+    
+    # Only add redirect_url if CHECKOUT_BASE_URL is set
+    if CHECKOUT_BASE_URL:
+        payload["checkout_options"] = {
+            "redirect_url": f"{CHECKOUT_BASE_URL}/payment-complete?order={order_id}",
+            "ask_for_shipping_address": False
         }
+    
+    headers = {
+        'Authorization': f'Bearer {SQUARE_ACCESS_TOKEN}',
+        'Content-Type': 'application/json',
+        'Square-Version': '2024-01-18',
+    }
+    
+    print(f"[SQUARE] Creating payment link: {url}")
+    print(f"[SQUARE] Payload: {payload}")
+    return url, payload, headers
+
+
+def create_square_payment_link(amount_cents: int, order_id: str, customer_email: str) -> Optional[str]:
+    """Create a Square payment link for the order"""
+    try:
+        request = _square_payment_link_request(amount_cents, order_id, customer_email)
+        if request is None:
+            return None
+        url, payload, headers = request
         
-        # Only add redirect_url if CHECKOUT_BASE_URL is set
-        if CHECKOUT_BASE_URL:
-            payload["checkout_options"] = {
-                "redirect_url": f"{CHECKOUT_BASE_URL}/payment-complete?order={order_id}",
-                "ask_for_shipping_address": False
-            }
-        
-        data = json.dumps(payload).encode()
-        
-        print(f"[SQUARE] Creating payment link: {url}")
-        print(f"[SQUARE] Payload: {payload}")
-        
-        req = urllib.request.Request(url, data=data, method='POST')
-        req.add_header('Authorization', f'Bearer {SQUARE_ACCESS_TOKEN}')
-        req.add_header('Content-Type', 'application/json')
-        req.add_header('Square-Version', '2024-01-18')
+        req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers=headers, method='POST')
         
         with urllib.request.urlopen(req, timeout=30) as resp:
             result = json.loads(resp.read().decode())
@@ -607,14 +721,45 @@ def create_square_payment_link(amount_cents: int, order_id: str, customer_email:
         return None
 
 
-def generate_checkout_token(order_id: str) -> str:
-    """Generate a secure token for checkout link"""
+async def acreate_square_payment_link(client: httpx.AsyncClient, amount_cents: int, order_id: str,
+                                      customer_email: str) -> Optional[str]:
+    """create_square_payment_link on the shared async client"""
+    try:
+        request = _square_payment_link_request(amount_cents, order_id, customer_email)
+        if request is None:
+            return None
+        url, payload, headers = request
+        
+        resp = await client.post(url, json=payload, headers=headers)
+        if resp.is_error:
+            print(f"[SQUARE] HTTP Error {resp.status_code}: {resp.text}")
+            return None
+        result = resp.json()
+        print(f"[SQUARE] Response: {result}")
+        return result.get('payment_link', {}).get('url')
+    except Exception as e:
+        print(f"[SQUARE] Error creating payment link: {e}")
+        return None
+
+
+def _checkout_token(order_id: str, day: str) -> str:
     secret = os.environ.get("CHECKOUT_SECRET", "default-secret-change-me")
-    message = f"{order_id}-{datetime.now().strftime('%Y%m%d')}"
+    message = f"{order_id}-{day}"
     return hmac.new(secret.encode(), message.encode(), hashlib.sha256).hexdigest()[:16]
 
 
+def generate_checkout_token(order_id: str) -> str:
+    """Generate a secure token for checkout link"""
+    return _checkout_token(order_id, datetime.now().strftime('%Y%m%d'))
+
+
+# A checkout verifies the same token on every page load and API call. The day is
+# part of the key, so cached results lapse when the token does
+@functools.lru_cache(maxsize=4096)
+def _verify_checkout_token_for_day(order_id: str, token: str, day: str) -> bool:
+    return hmac.compare_digest(token, _checkout_token(order_id, day))
+
+
 def verify_checkout_token(order_id: str, token: str) -> bool:
     """Verify checkout token is valid"""
-    expected = generate_checkout_token(order_id)
-    return hmac.compare_digest(token, expected)
+    return _verify_checkout_token_for_day(order_id, token, datetime.now().strftime('%Y%m%d'))
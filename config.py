@@ -5,16 +5,70 @@ All environment variables and constants in one place.
 """
 
 import os
+from urllib.parse import parse_qs, urlsplit
 
 # =============================================================================
 # DATABASE CONFIG
 # =============================================================================
 
-DATABASE_URL = os.environ.get("DATABASE_URL", "").strip()
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-if DATABASE_URL and "sslmode" not in DATABASE_URL:
-    DATABASE_URL += ("&" if "?" in DATABASE_URL else "?") + "sslmode=require"
+def _normalize_database_url(url: str) -> str:
+    """
+    postgres:// -> postgresql://, and require SSL unless the URL sets sslmode or
+    connects over a Unix socket (no host, or host=/socket/dir), where SSL isn't
+    available and not needed
+    """
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    if url and "sslmode" not in url:
+        parsed = urlsplit(url)
+        socket_host = parse_qs(parsed.query).get("host", [""])[0]
+        if parsed.hostname and not socket_host.startswith("/"):
+            url += ("&" if "?" in url else "?") + "sslmode=require"
+    return url
+
+DATABASE_URL = _normalize_database_url(os.environ.get("DATABASE_URL", "").strip())
+
+# Set DB_PGBOUNCER=true when DATABASE_URL points at PgBouncer in transaction pool
+# mode: server-side PREPARE is then skipped, and session features (LISTEN) use
+# DATABASE_DIRECT_URL, which should point at Postgres itself
+DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"
+DATABASE_DIRECT_URL = _normalize_database_url(os.environ.get("DATABASE_DIRECT_URL", "").strip()) or DATABASE_URL
+
+# Connection pool size (connections are reused across requests and threads)
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", "4"))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", "32"))
+# When all DB_POOL_MAX connections are checked out, wait this long for one to be
+# returned before failing the request
+DB_POOL_TIMEOUT_SECONDS = int(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "30"))
+
+# Threads FastAPI runs plain `def` endpoints on. Sized to the pool so a burst of
+# blocking handlers queues for a thread instead of exhausting the pool
+REQUEST_THREADPOOL_SIZE = int(os.environ.get("REQUEST_THREADPOOL_SIZE", str(DB_POOL_MAX)))
+
+# order_status materialized view: refresh at most this often after orders change,
+# and at least this often regardless so days_open rolls over
+ORDER_STATUS_REFRESH_SECONDS = int(os.environ.get("ORDER_STATUS_REFRESH_SECONDS", "30"))
+ORDER_STATUS_MAX_AGE_MINUTES = int(os.environ.get("ORDER_STATUS_MAX_AGE_MINUTES", "60"))
+
+# Email snippets are queued and written together, at most this many rows or
+# this many seconds after the first queued row
+SNIPPET_BATCH_SIZE = 500
+SNIPPET_FLUSH_SECONDS = 2
+
+# =============================================================================
+# CACHE CONFIG
+# =============================================================================
+
+# Redis for the order read cache; without it each process caches in memory
+REDIS_URL = os.environ.get("REDIS_URL", "").strip()
+ORDER_CACHE_SECONDS = 300
+ORDERS_LIST_CACHE_SECONDS = 30
+STATUS_SUMMARY_CACHE_SECONDS = 10
+TRUSTED_CUSTOMERS_CACHE_SECONDS = 300
+# AI card summaries are reused for an hour unless regenerated with force=True
+SUMMARY_CACHE_SECONDS = 3600
+# Checkout page's B2BWave order + shipping quotes, reused by create-payment
+CHECKOUT_SNAPSHOT_CACHE_SECONDS = 300
 
 # =============================================================================
 # API CONFIGS
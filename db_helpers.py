@@ -3,29 +3,136 @@ db_helpers.py
 Database connection and common database operations for CFC Order Backend.
 """
 
+import functools
+import re
+import select
+import threading
+import time
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from contextlib import contextmanager
 from typing import Optional, List, Dict, Any
 
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DATABASE_DIRECT_URL, DB_PGBOUNCER, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT_SECONDS,
+    ORDER_STATUS_REFRESH_SECONDS, ORDER_STATUS_MAX_AGE_MINUTES
+)
+from cache import CACHE_SHARED, cache_delete_prefix, invalidate_order_cache, invalidate_orders
+
+# NUMERIC comes back as float instead of Decimal. Every consumer converts to float
+# anyway (JSON responses, shipping math), so skip building the Decimal at all.
+DEC2FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'DEC2FLOAT',
+    lambda value, cur: float(value) if value is not None else None
+)
+psycopg2.extensions.register_type(DEC2FLOAT)
 
 # =============================================================================
 # CONNECTION MANAGEMENT
 # =============================================================================
 
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers which server-side prepared statements it holds"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises PoolError as soon as it is exhausted; callers take a
+# slot first so a burst queues for a connection instead of failing
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Create the shared connection pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL,
+                    connection_factory=PooledConnection
+                )
+    return _pool
+
+
 @contextmanager
 def get_db():
-    """Get database connection with automatic commit/rollback"""
-    conn = psycopg2.connect(DATABASE_URL)
+    """Get pooled database connection with automatic commit/rollback"""
+    pool = get_pool()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+        raise PoolError(f"no database connection free after {DB_POOL_TIMEOUT_SECONDS}s")
     try:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            # Discard broken connections instead of handing them out again
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots.release()
+
+
+def get_db_conn():
+    """FastAPI dependency yielding a pooled connection: conn = Depends(get_db_conn)"""
+    with get_db() as conn:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
+
+
+def get_db_cursor():
+    """FastAPI dependency yielding a RealDictCursor on a pooled connection: cur = Depends(get_db_cursor)"""
+    with get_db() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            yield cur
+
+
+def execute_prepared(cur, name: str, statement: str, params: tuple):
+    """
+    Execute a server-side prepared statement, preparing it once per pooled connection
+    (see PooledConnection) so Postgres skips parse/plan on every later call.
+    statement is the PREPARE body: "(type, ...) AS <sql using $1..$n>".
+    Behind PgBouncer (DB_PGBOUNCER) the statement runs as a plain query instead,
+    since a transaction-pooled client can't rely on its PREPAREs.
+    """
+    if DB_PGBOUNCER:
+        cur.execute(_unprepared_query(statement), {f"p{i}": value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = cur.connection.prepared
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} {statement}")
+        prepared.add(name)
+    try:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type": a table behind a SELECT * changed
+        # (e.g. /init-db); forget this connection's statements so they are re-prepared
+        cur.connection.rollback()
+        cur.execute("DEALLOCATE ALL")
+        prepared.clear()
         raise
-    finally:
-        conn.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _unprepared_query(statement: str) -> str:
+    """Rewrite a PREPARE body as a psycopg2 query: $n becomes %(pn)s cast to its declared type"""
+    types, _, body = statement.partition(") AS")
+    types = [t.strip() for t in types.strip().lstrip("(").split(",")]
+    return re.sub(
+        r"\$(\d+)",
+        lambda m: f"%(p{m.group(1)})s::{types[int(m.group(1)) - 1]}",
+        body.replace("%", "%%")
+    )
 
 
 @contextmanager
@@ -37,6 +144,123 @@ def get_cursor(dict_cursor: bool = True):
             yield cur
 
 
+@contextmanager
+def advisory_lock(key: int, wait: bool = True):
+    """
+    Hold a session-level Postgres advisory lock for the duration of the block,
+    on a dedicated connection so it spans any number of pooled transactions.
+    Yields True once the lock is held, or False if wait=False and another
+    process holds it. Session locks don't survive PgBouncer, so this bypasses it.
+    """
+    conn = psycopg2.connect(DATABASE_DIRECT_URL)
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cur:
+            if wait:
+                cur.execute("SELECT pg_advisory_lock(%s)", (key,))
+                acquired = True
+            else:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+                acquired = cur.fetchone()[0]
+        yield acquired
+    finally:
+        # Closing the session releases the lock
+        conn.close()
+
+
+# pg_try_advisory_lock key held for life by the one process that runs scheduled jobs
+BACKGROUND_JOBS_LOCK_KEY = 4207310002
+
+_background_jobs_conn = None
+_background_jobs_claimed: Optional[bool] = None
+
+
+def claim_background_jobs() -> bool:
+    """
+    Decide once per process whether this worker runs the scheduled background jobs
+    (auto-sync, order_status REFRESH). The first process to take the advisory lock
+    keeps it on a dedicated connection until it exits, so with several uvicorn
+    workers exactly one runs them; the others get False.
+    """
+    global _background_jobs_conn, _background_jobs_claimed
+    if _background_jobs_claimed is None:
+        conn = psycopg2.connect(DATABASE_DIRECT_URL)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (BACKGROUND_JOBS_LOCK_KEY,))
+            _background_jobs_claimed = cur.fetchone()[0]
+        if _background_jobs_claimed:
+            _background_jobs_conn = conn
+        else:
+            conn.close()
+    return _background_jobs_claimed
+
+
+# =============================================================================
+# ORDER STATUS REFRESH
+# =============================================================================
+
+def run_order_status_refresher(refresh: bool = True):
+    """
+    Keep the order_status materialized view current. Listens for the
+    order_status_dirty notifications sent by the orders trigger and refreshes at
+    most every ORDER_STATUS_REFRESH_SECONDS while orders change, and at least
+    every ORDER_STATUS_MAX_AGE_MINUTES so days_open stays accurate. Each
+    notification drops the cached orders it names plus the order lists; cached
+    lists are dropped again after every refresh.
+    With refresh=False (workers that didn't claim_background_jobs) it only drops
+    this process's in-memory cache on notifications; with Redis it does nothing.
+    """
+    while True:
+        try:
+            # Dedicated autocommit connection: LISTEN needs to stay open and
+            # REFRESH ... CONCURRENTLY can't run inside a transaction. LISTEN is
+            # session state, so this bypasses PgBouncer
+            conn = psycopg2.connect(DATABASE_DIRECT_URL)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("LISTEN order_status_dirty")
+                dirty = False
+                last_refresh = time.monotonic()
+                while True:
+                    if select.select([conn], [], [], ORDER_STATUS_REFRESH_SECONDS)[0]:
+                        conn.poll()
+                        if conn.notifies:
+                            dirty = True
+                            # Payloads list the changed order_ids; an empty one means too many to list
+                            payloads = [n.payload for n in conn.notifies]
+                            conn.notifies.clear()
+                            # A shared cache needs only one worker (the refresher) to drop keys
+                            if refresh or not CACHE_SHARED:
+                                if all(payloads):
+                                    invalidate_orders({i for p in payloads for i in p.split(',')})
+                                else:
+                                    invalidate_order_cache()
+                    
+                    age = time.monotonic() - last_refresh
+                    if refresh and ((dirty and age >= ORDER_STATUS_REFRESH_SECONDS)
+                                    or age >= ORDER_STATUS_MAX_AGE_MINUTES * 60):
+                        with conn.cursor() as cur:
+                            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY order_status")
+                        # Single-order reads compute status inline; only lists read the view
+                        cache_delete_prefix("orders:")
+                        dirty = False
+                        last_refresh = time.monotonic()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"[ORDER-STATUS] Refresh error: {e}")
+            time.sleep(ORDER_STATUS_REFRESH_SECONDS)
+
+
+def start_order_status_refresher(refresh: bool = True):
+    """Start the order_status refresher in a background thread"""
+    thread = threading.Thread(target=run_order_status_refresher, args=(refresh,),
+                              daemon=True, name="order-status-refresh")
+    thread.start()
+    print(f"[ORDER-STATUS] {'Refresher' if refresh else 'Cache invalidation listener'} started")
+
 # =============================================================================
 # COMMON QUERIES
 # =============================================================================
@@ -230,18 +454,40 @@ def resolve_alert(alert_id: int) -> bool:
 # TRUSTED CUSTOMERS
 # =============================================================================
 
-def is_trusted_customer(customer_name: str, company_name: str = None) -> bool:
-    """Check if a customer is trusted"""
+# trusted_customers rarely changes: it is loaded whole and reused for up to
+# TRUSTED_CACHE_SECONDS, or until this process changes it (see invalidate_trusted_customers)
+TRUSTED_CACHE_SECONDS = 60
+_trusted_version = 0
+
+
+@functools.lru_cache(maxsize=1)
+def _load_trusted(time_bucket: int, version: int):
+    """(lowercased customer names, lowercased company names) as frozensets"""
     with get_db() as conn:
         with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 1 FROM trusted_customers 
-                WHERE LOWER(customer_name) = LOWER(%s)
-                   OR LOWER(company_name) = LOWER(%s)
-                   OR LOWER(company_name) = LOWER(%s)
-                LIMIT 1
-            """, (customer_name, customer_name, company_name or ''))
-            return cur.fetchone() is not None
+            cur.execute("SELECT LOWER(customer_name), LOWER(company_name) FROM trusted_customers")
+            rows = cur.fetchall()
+    return (
+        frozenset(r[0] for r in rows if r[0] is not None),
+        frozenset(r[1] for r in rows if r[1] is not None),
+    )
+
+
+def invalidate_trusted_customers():
+    """Make the next trusted lookup reload trusted_customers"""
+    global _trusted_version
+    _trusted_version += 1
+
+
+def is_trusted_customer(customer_name: str, company_name: str = None) -> bool:
+    """Check if a customer is trusted (name matches a trusted name or company, or company matches a trusted company)"""
+    names, companies = _load_trusted(int(time.time() // TRUSTED_CACHE_SECONDS), _trusted_version)
+    customer_lc = (customer_name or '').lower()
+    return (
+        customer_lc in names
+        or customer_lc in companies
+        or (bool(company_name) and company_name.lower() in companies)
+    )
 
 
 def get_trusted_customers() -> List[Dict]:
@@ -4,7 +4,9 @@ Database migration and schema update functions for CFC Order Backend.
 These are helper functions called by the migration endpoints in main.py.
 """
 
-from db_helpers import get_db
+from psycopg2 import sql
+
+from db_helpers import get_db, advisory_lock
 
 
 def create_pending_checkouts_table() -> dict:
@@ -52,8 +54,8 @@ def create_shipments_table() -> dict:
                     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
                 )
             """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_shipments_order ON order_shipments(order_id)")
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_shipments_id ON order_shipments(shipment_id)")
+        _create_index_concurrently(conn, 'idx_shipments_order', "order_shipments(order_id)")
+        _create_index_concurrently(conn, 'idx_shipments_id', "order_shipments(shipment_id)")
     return {"status": "ok", "message": "order_shipments table created"}
 
 
@@ -80,15 +82,11 @@ def add_rl_shipping_fields() -> dict:
                 ("tracking_number", "VARCHAR(100)")
             ]
             
-            for field_name, field_type in fields_to_add:
-                try:
-                    cur.execute(f"ALTER TABLE order_shipments ADD COLUMN {field_name} {field_type}")
-                except Exception as e:
-                    # Column might already exist
-                    conn.rollback()
-                    pass
-            
-            conn.commit()
+            # One ALTER (one round trip, one table lock); IF NOT EXISTS keeps it idempotent
+            cur.execute("ALTER TABLE order_shipments " + ", ".join(
+                f"ADD COLUMN IF NOT EXISTS {field_name} {field_type}"
+                for field_name, field_type in fields_to_add
+            ))
     return {"status": "ok", "message": "Shipping fields added to order_shipments"}
 
 
@@ -96,61 +94,122 @@ def add_ps_fields() -> dict:
     """Add Pirateship fields to order_shipments table"""
     with get_db() as conn:
         with conn.cursor() as cur:
-            try:
-                cur.execute("ALTER TABLE order_shipments ADD COLUMN ps_quote_url TEXT")
-                conn.commit()
-            except:
-                conn.rollback()
-            try:
-                cur.execute("ALTER TABLE order_shipments ADD COLUMN ps_quote_price DECIMAL(10,2)")
-                conn.commit()
-            except:
-                conn.rollback()
+            cur.execute("""
+                ALTER TABLE order_shipments
+                    ADD COLUMN IF NOT EXISTS ps_quote_url TEXT,
+                    ADD COLUMN IF NOT EXISTS ps_quote_price DECIMAL(10,2)
+            """)
     return {"status": "ok", "message": "PS fields added"}
 
 
+def _narrow_varchar_columns(cur, columns: list) -> list:
+    """
+    Return the (table, column, length) entries whose VARCHAR is still narrower than
+    length. Tables or columns that don't exist are left out.
+    """
+    cur.execute("""
+        SELECT c.table_name, c.column_name, w.length
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        JOIN unnest(%s::text[], %s::text[], %s::int[]) AS w(table_name, column_name, length)
+          ON w.table_name = c.table_name AND w.column_name = c.column_name
+        WHERE c.table_schema = 'public' AND t.table_type = 'BASE TABLE'
+          AND c.data_type = 'character varying' AND c.character_maximum_length < w.length
+    """, ([t for t, _, _ in columns], [c for _, c, _ in columns], [n for _, _, n in columns]))
+    return cur.fetchall()
+
+
+def _widen_varchar_columns(cur, columns: list) -> list:
+    """
+    Widen VARCHAR columns given as (table, column, length), one ALTER per table.
+    Widening a VARCHAR only updates the catalog (no table rewrite since PG 9.2), but
+    ALTER TABLE still takes an ACCESS EXCLUSIVE lock - so columns that are already
+    wide enough are skipped, and lock_timeout makes us fail fast instead of queueing
+    behind long reads and stalling every reader that arrives after us.
+    Returns "table.column" for each column altered.
+    """
+    by_table = {}
+    for table, column, length in columns:
+        by_table.setdefault(table, []).append((column, length))
+    if not by_table:
+        return []
+    
+    cur.execute("SET LOCAL lock_timeout = '5s'")
+    cur.execute(sql.SQL("; ").join(
+        sql.SQL("ALTER TABLE {} {}").format(sql.Identifier(table), sql.SQL(", ").join(
+            sql.SQL("ALTER COLUMN {} TYPE VARCHAR({})").format(sql.Identifier(column), sql.Literal(length))
+            for column, length in cols
+        ))
+        for table, cols in by_table.items()
+    ))
+    return [f"{table}.{column}" for table, column, _ in columns]
+
+
+def _create_index_concurrently(conn, name: str, definition: str):
+    """
+    CREATE INDEX CONCURRENTLY name ON definition, so writes to a live table keep
+    going while the index builds. CONCURRENTLY can't run inside a transaction, so
+    this commits first and runs in autocommit. A leftover INVALID index from an
+    interrupted build is dropped and rebuilt.
+    """
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+            row = cur.fetchone()
+            if row and row[0]:
+                cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+            cur.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {}").format(
+                sql.Identifier(name), sql.SQL(definition)
+            ))
+    finally:
+        conn.autocommit = False
+
+
+def _drop_index_concurrently(conn, name: str):
+    """DROP INDEX CONCURRENTLY IF EXISTS name, in autocommit like _create_index_concurrently"""
+    conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+    finally:
+        conn.autocommit = False
+
+
 def fix_shipment_columns() -> dict:
     """Fix column lengths in order_shipments table"""
     with get_db() as conn:
         with conn.cursor() as cur:
             try:
-                cur.execute("ALTER TABLE order_shipments ALTER COLUMN order_id TYPE VARCHAR(50)")
+                altered = _widen_varchar_columns(cur, _narrow_varchar_columns(cur, [
+                    ('order_shipments', 'order_id', 50),
+                    ('order_shipments', 'shipment_id', 100),
+                ]))
                 conn.commit()
             except Exception as e:
                 conn.rollback()
-            try:
-                cur.execute("ALTER TABLE order_shipments ALTER COLUMN shipment_id TYPE VARCHAR(100)")
-                conn.commit()
-            except Exception as e:
-                conn.rollback()
-    return {"status": "ok", "message": "Shipment columns fixed"}
+                return {"status": "error", "message": str(e)}
+    return {"status": "ok", "message": f"Shipment columns fixed: {altered or 'already wide enough'}"}
 
 
 def fix_sku_columns() -> dict:
     """Fix SKU column lengths in all tables"""
     with get_db() as conn:
         with conn.cursor() as cur:
+            # Legacy tables may not exist; only existing, still-narrow columns are altered
             try:
-                cur.execute("ALTER TABLE sku_warehouse_map ALTER COLUMN sku_prefix TYPE VARCHAR(100)")
-                conn.commit()
-            except:
-                conn.rollback()
-            try:
-                cur.execute("ALTER TABLE warehouse_mapping ALTER COLUMN sku_prefix TYPE VARCHAR(100)")
-                conn.commit()
-            except:
-                conn.rollback()
-            try:
-                cur.execute("ALTER TABLE order_items ALTER COLUMN sku_prefix TYPE VARCHAR(100)")
+                altered = _widen_varchar_columns(cur, _narrow_varchar_columns(cur, [
+                    (table, 'sku_prefix', 100)
+                    for table in ('sku_warehouse_map', 'warehouse_mapping', 'order_items', 'order_line_items')
+                ]))
                 conn.commit()
-            except:
-                conn.rollback()
-            try:
-                cur.execute("ALTER TABLE order_line_items ALTER COLUMN sku_prefix TYPE VARCHAR(100)")
-                conn.commit()
-            except:
+            except Exception as e:
                 conn.rollback()
-    return {"status": "ok", "message": "SKU columns fixed"}
+                return {"status": "error", "message": str(e)}
+    return {"status": "ok", "message": f"SKU columns fixed: {altered or 'already wide enough'}"}
 
 
 def fix_order_id_length() -> dict:
@@ -159,48 +218,64 @@ def fix_order_id_length() -> dict:
         with conn.cursor() as cur:
             results = []
             
-            # First, find and drop ALL views that might depend on orders
-            try:
-                cur.execute("""
-                    SELECT viewname FROM pg_views 
-                    WHERE schemaname = 'public'
-                """)
-                views = cur.fetchall()
-                for view in views:
-                    try:
-                        cur.execute(f"DROP VIEW IF EXISTS {view[0]} CASCADE")
-                        results.append(f"Dropped view: {view[0]}")
-                    except:
-                        pass
-            except Exception as e:
-                results.append(f"View lookup: {str(e)}")
+            # Nothing to do (and no views to drop) once every order_id is wide enough
+            tables = ['orders', 'order_status', 'order_line_items', 'order_events', 'order_shipments']
+            narrow = _narrow_varchar_columns(cur, [(t, 'order_id', 50) for t in tables])
+            if not narrow:
+                return {"status": "ok", "results": ["order_id already VARCHAR(50) or wider"]}
             
-            # Also drop any rules
+            # Snapshot ALL views and rules that might depend on orders (with their
+            # definitions, in creation order) so they can be restored after the ALTERs
+            cur.execute("""
+                SELECT kind, name, tablename, definition FROM (
+                    SELECT 'view' AS kind, c.relname AS name, NULL AS tablename,
+                           pg_get_viewdef(c.oid, true) AS definition, c.oid AS created
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = 'public' AND c.relkind = 'v'
+                    UNION ALL
+                    SELECT 'rule', r.rulename, c.relname, pg_get_ruledef(r.oid, true), r.oid
+                    FROM pg_rewrite r
+                    JOIN pg_class c ON c.oid = r.ev_class
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = 'public' AND r.rulename <> '_RETURN'
+                ) d
+                ORDER BY kind DESC, created
+            """)
+            dependents = cur.fetchall()
+            
+            # Drop them all in one round trip
+            drops = [
+                sql.SQL("DROP VIEW IF EXISTS {} CASCADE").format(sql.Identifier(name))
+                if kind == 'view' else
+                sql.SQL("DROP RULE IF EXISTS {} ON {} CASCADE").format(sql.Identifier(name), sql.Identifier(tablename))
+                for kind, name, tablename, _ in dependents
+            ]
+            if drops:
+                cur.execute(sql.SQL("; ").join(drops))
+                results.extend(f"Dropped {kind}: {name}" for kind, name, _, _ in dependents)
+            
+            # Now widen the narrow order_id columns in one round trip
             try:
-                cur.execute("""
-                    SELECT rulename, tablename FROM pg_rules 
-                    WHERE schemaname = 'public'
-                """)
-                rules = cur.fetchall()
-                for rule in rules:
-                    try:
-                        cur.execute(f"DROP RULE IF EXISTS {rule[0]} ON {rule[1]} CASCADE")
-                        results.append(f"Dropped rule: {rule[0]}")
-                    except:
-                        pass
+                results.extend(f"{t}: updated" for t in _widen_varchar_columns(cur, narrow))
             except Exception as e:
-                results.append(f"Rule lookup: {str(e)}")
-            
-            conn.commit()
+                conn.rollback()
+                return {"status": "error", "results": results + [str(e)]}
             
-            # Now alter order_id columns in all tables
-            tables = ['orders', 'order_status', 'order_line_items', 'order_events', 'order_shipments']
-            for table in tables:
+            # Restore the snapshot in the same transaction - views first, then rules
+            restores = [
+                sql.SQL("CREATE OR REPLACE VIEW {} AS {}").format(sql.Identifier(name), sql.SQL(definition.rstrip().rstrip(';')))
+                if kind == 'view' else
+                sql.SQL(definition.rstrip().rstrip(';'))
+                for kind, name, _, definition in dependents
+            ]
+            if restores:
                 try:
-                    cur.execute(f"ALTER TABLE {table} ALTER COLUMN order_id TYPE VARCHAR(50)")
-                    results.append(f"{table}: updated")
+                    cur.execute(sql.SQL("; ").join(restores))
+                    results.extend(f"Restored {kind}: {name}" for kind, name, _, _ in dependents)
                 except Exception as e:
-                    results.append(f"{table}: {str(e)}")
+                    conn.rollback()
+                    return {"status": "error", "results": results + [str(e)]}
             
             conn.commit()
     return {"status": "ok", "results": results}
@@ -210,6 +285,14 @@ def recreate_order_status_view() -> dict:
     """Recreate the order_status view after it was dropped"""
     with get_db() as conn:
         with conn.cursor() as cur:
+            # Already materialized (see materialize_order_status_view) - nothing to do
+            cur.execute("""
+                SELECT 1 FROM pg_matviews
+                WHERE schemaname = 'public' AND matviewname = 'order_status'
+            """)
+            if cur.fetchone():
+                return {"status": "ok", "message": "order_status is materialized, left as is"}
+            
             # First drop the old view
             cur.execute("DROP VIEW IF EXISTS order_status CASCADE")
             
@@ -253,3 +336,232 @@ def add_weight_column() -> dict:
                 if "already exists" in str(e):
                     return {"status": "ok", "message": "total_weight column already exists"}
                 return {"status": "error", "message": str(e)}
+
+
+def create_sync_state_table() -> dict:
+    """Create sync_state table holding incremental sync cursors"""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key VARCHAR(100) PRIMARY KEY,
+                    value TEXT,
+                    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                )
+            """)
+    return {"status": "ok", "message": "sync_state table created"}
+
+
+def add_unpaid_orders_index() -> dict:
+    """Partial index for matching incoming payments against unpaid orders"""
+    with get_db() as conn:
+        _create_index_concurrently(
+            conn, 'idx_orders_unpaid_date',
+            "orders(order_date DESC) WHERE NOT payment_received"
+        )
+    return {"status": "ok", "message": "idx_orders_unpaid_date created"}
+
+
+def add_open_orders_index() -> dict:
+    """Partial index for the default dashboard list (open orders, newest first)"""
+    with get_db() as conn:
+        _create_index_concurrently(
+            conn, 'idx_orders_open_date',
+            "orders(order_date DESC) WHERE NOT is_complete"
+        )
+    return {"status": "ok", "message": "idx_orders_open_date created"}
+
+
+def add_covering_indexes() -> dict:
+    """
+    Composite/partial indexes matching the line item, event, alert and payment
+    alert queries. The composite ones replace the single-column indexes they
+    start with, which are dropped once the new ones are built.
+    """
+    with get_db() as conn:
+        _create_index_concurrently(conn, 'idx_line_items_order_warehouse',
+                                   "order_line_items(order_id, warehouse)")
+        _create_index_concurrently(conn, 'idx_events_order_created',
+                                   "order_events(order_id, created_at DESC)")
+        _create_index_concurrently(conn, 'idx_alerts_open_created',
+                                   "order_alerts(created_at DESC) WHERE NOT is_resolved")
+        _create_index_concurrently(conn, 'idx_orders_trusted_unpaid',
+                                   "orders(sent_to_warehouse_at) "
+                                   "WHERE sent_to_warehouse AND NOT payment_received AND is_trusted_customer")
+        for old in ('idx_line_items_order', 'idx_events_order', 'idx_alerts_unresolved'):
+            _drop_index_concurrently(conn, old)
+    return {"status": "ok", "message": "Covering indexes created"}
+
+
+def materialize_order_status_view() -> dict:
+    """
+    Replace the order_status view with a materialized view indexed on order_id and
+    current_status. A statement trigger on orders sends NOTIFY order_status_dirty;
+    db_helpers.run_order_status_refresher coalesces those into concurrent refreshes.
+    """
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.relkind FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname = 'order_status'
+            """)
+            row = cur.fetchone()
+            if row and row[0] == 'v':
+                cur.execute("DROP VIEW order_status CASCADE")
+            
+            cur.execute("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS order_status AS
+                SELECT 
+                    order_id,
+                    CASE
+                        WHEN is_complete THEN 'complete'
+                        WHEN bol_sent AND NOT is_complete THEN 'awaiting_shipment'
+                        WHEN warehouse_confirmed AND NOT bol_sent THEN 'needs_bol'
+                        WHEN sent_to_warehouse AND NOT warehouse_confirmed THEN 'awaiting_warehouse'
+                        WHEN payment_received AND NOT sent_to_warehouse THEN 'needs_warehouse_order'
+                        WHEN payment_link_sent AND NOT payment_received THEN 'awaiting_payment'
+                        ELSE 'needs_payment_link'
+                    END as current_status,
+                    EXTRACT(DAY FROM NOW() - order_date)::INTEGER as days_open,
+                    payment_link_sent,
+                    payment_received,
+                    sent_to_warehouse,
+                    warehouse_confirmed,
+                    bol_sent,
+                    is_complete,
+                    updated_at
+                FROM orders;
+                
+                -- REFRESH ... CONCURRENTLY needs a unique index
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_order_status_order ON order_status(order_id);
+                CREATE INDEX IF NOT EXISTS idx_order_status_current ON order_status(current_status);
+                
+                CREATE OR REPLACE FUNCTION notify_order_status_dirty() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('order_status_dirty', '');
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql;
+                
+                DROP TRIGGER IF EXISTS orders_status_dirty ON orders;
+                CREATE TRIGGER orders_status_dirty
+                    AFTER INSERT OR UPDATE OR DELETE ON orders
+                    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+            """)
+    return {"status": "ok", "message": "order_status materialized view created"}
+
+
+def notify_changed_order_ids() -> dict:
+    """
+    Send the changed order_ids as the order_status_dirty payload (comma separated;
+    empty when past the NOTIFY size limit), so listeners drop just those cached
+    orders. Transition tables need one statement trigger per event.
+    """
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE OR REPLACE FUNCTION notify_order_status_dirty() RETURNS trigger AS $$
+                DECLARE
+                    ids TEXT;
+                BEGIN
+                    IF TG_OP = 'DELETE' THEN
+                        SELECT string_agg(DISTINCT order_id, ',') INTO ids FROM old_rows;
+                    ELSE
+                        SELECT string_agg(DISTINCT order_id, ',') INTO ids FROM new_rows;
+                    END IF;
+                    IF ids IS NULL THEN
+                        RETURN NULL;
+                    END IF;
+                    IF octet_length(ids) > 7000 THEN
+                        ids := '';
+                    END IF;
+                    PERFORM pg_notify('order_status_dirty', ids);
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql;
+                
+                DROP TRIGGER IF EXISTS orders_status_dirty ON orders;
+                DROP TRIGGER IF EXISTS orders_status_dirty_insert ON orders;
+                DROP TRIGGER IF EXISTS orders_status_dirty_update ON orders;
+                DROP TRIGGER IF EXISTS orders_status_dirty_delete ON orders;
+                CREATE TRIGGER orders_status_dirty_insert
+                    AFTER INSERT ON orders REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+                CREATE TRIGGER orders_status_dirty_update
+                    AFTER UPDATE ON orders REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+                CREATE TRIGGER orders_status_dirty_delete
+                    AFTER DELETE ON orders REFERENCING OLD TABLE AS old_rows
+                    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+            """)
+    return {"status": "ok", "message": "order_status_dirty now carries order ids"}
+
+
+# =============================================================================
+# STARTUP MIGRATION RUNNER
+# =============================================================================
+
+# Applied in order, once each; names are recorded in schema_migrations.
+# Every step is idempotent so a partially migrated database is safe to re-run.
+MIGRATIONS = [
+    ("001_pending_checkouts", create_pending_checkouts_table),
+    ("002_shipments", create_shipments_table),
+    ("003_rl_shipping_fields", add_rl_shipping_fields),
+    ("004_ps_fields", add_ps_fields),
+    ("005_fix_shipment_columns", fix_shipment_columns),
+    ("006_fix_sku_columns", fix_sku_columns),
+    ("007_fix_order_id_length", fix_order_id_length),
+    ("008_order_status_view", recreate_order_status_view),
+    ("009_weight_column", add_weight_column),
+    ("010_sync_state", create_sync_state_table),
+    ("011_unpaid_orders_index", add_unpaid_orders_index),
+    ("012_order_status_matview", materialize_order_status_view),
+    ("013_open_orders_index", add_open_orders_index),
+    ("014_covering_indexes", add_covering_indexes),
+    ("015_notify_changed_order_ids", notify_changed_order_ids),
+]
+
+
+# pg_advisory_lock key serializing the runner across worker processes
+MIGRATIONS_LOCK_KEY = 4207310001
+
+
+def run_migrations() -> dict:
+    """
+    Apply any migrations not yet recorded in schema_migrations. Holds an advisory
+    lock so concurrent workers run them one at a time; whoever waited re-reads
+    schema_migrations after getting the lock and skips what was already applied.
+    """
+    with advisory_lock(MIGRATIONS_LOCK_KEY):
+        return _run_pending_migrations()
+
+
+def _run_pending_migrations() -> dict:
+    """Apply pending migrations; the caller holds MIGRATIONS_LOCK_KEY"""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name VARCHAR(100) PRIMARY KEY,
+                    applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+                )
+            """)
+            cur.execute("SELECT name FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+    
+    results = []
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        result = migrate()
+        if result.get("status") != "ok":
+            # Stop so later migrations never run on top of a failed one
+            results.append({"migration": name, **result})
+            return {"status": "error", "results": results}
+        with get_db() as conn:
+            with conn.cursor() as cur:
+                cur.execute("INSERT INTO schema_migrations (name) VALUES (%s) ON CONFLICT DO NOTHING", (name,))
+        results.append({"migration": name, "status": "ok"})
+    
+    return {"status": "ok", "results": results}
@@ -12,28 +12,70 @@ from psycopg2.extras import RealDictCursor
 from db_helpers import get_db
 
 
+# Square payment link, matched case-insensitively without lowercasing the whole body
+SQUARE_LINK_RE = re.compile(r'square\.link', re.IGNORECASE)
+# R+L patterns, also used by main.py and gmail_sync.py
+# "RL Quote No: 9075654" or "Quote: 9075654" or "Quote #9075654"
+RL_QUOTE_RE = re.compile(r'(?:RL\s+)?Quote\s*(?:No|#)?[:\s]*(\d{6,10})', re.IGNORECASE)
+# "PRO 74408602-5" or "PRO# 74408602-5" or "Pro Number: 74408602-5"
+PRO_NUMBER_RE = re.compile(r'PRO\s*(?:#|Number)?[:\s]*([A-Z]{0,2}\d{8,10}(?:-\d)?)', re.IGNORECASE)
+# Square notification subject: "$4,913.99 payment received from Dylan Gentry"
+PAYMENT_AMOUNT_RE = re.compile(r'\$([\d,]+\.?\d*)\s+payment received', re.IGNORECASE)
+PAYMENT_NAME_RE = re.compile(r'payment received from (.+)$', re.IGNORECASE)
+
+
+# Newest unpaid order a payment covers (payment should be >= order total), preferring
+# a first-name match; orders with a different first name are skipped. Zero-total
+# orders never match. Served by idx_orders_unpaid_date. Shared with main.py's
+# /detect-payment-received, which locks and updates the match in the same statement.
+# Params: amount, pay_first (see payment_first_name)
+UNPAID_ORDER_MATCH_SQL = """
+    SELECT order_id, order_total, customer_name
+    FROM orders
+    WHERE NOT payment_received
+    AND order_total > 0
+    AND order_total <= %(amount)s
+    AND (
+        %(pay_first)s IS NULL
+        OR COALESCE(BTRIM(customer_name), '') = ''
+        OR LOWER(SPLIT_PART(BTRIM(customer_name), ' ', 1)) = %(pay_first)s
+    )
+    ORDER BY (LOWER(SPLIT_PART(BTRIM(customer_name), ' ', 1)) = %(pay_first)s) DESC NULLS LAST,
+             order_date DESC
+    LIMIT 1
+"""
+
+
+def payment_first_name(customer_name: Optional[str]) -> Optional[str]:
+    """Lowercased first name of a payer, as compared by UNPAID_ORDER_MATCH_SQL"""
+    return customer_name.split()[0].lower() if customer_name and customer_name.split() else None
+
+
 def detect_square_payment_link(email_body: str) -> bool:
     """Check if email contains a Square payment link"""
-    return 'square.link' in email_body.lower()
+    return SQUARE_LINK_RE.search(email_body) is not None
 
 
 def update_payment_link_sent(order_id: str) -> Dict:
     """Mark order as having payment link sent"""
     with get_db() as conn:
         with conn.cursor() as cur:
+            # Mark sent and log the event in one statement; no row means already marked
             cur.execute("""
-                UPDATE orders SET 
-                    payment_link_sent = TRUE,
-                    payment_link_sent_at = NOW(),
-                    updated_at = NOW()
-                WHERE order_id = %s AND NOT payment_link_sent
+                WITH u AS (
+                    UPDATE orders SET 
+                        payment_link_sent = TRUE,
+                        payment_link_sent_at = NOW(),
+                        updated_at = NOW()
+                    WHERE order_id = %s AND NOT payment_link_sent
+                    RETURNING order_id
+                )
+                INSERT INTO order_events (order_id, event_type, source)
+                SELECT order_id, 'payment_link_sent', 'email_detection' FROM u
+                RETURNING order_id
             """, (order_id,))
             
-            if cur.rowcount > 0:
-                cur.execute("""
-                    INSERT INTO order_events (order_id, event_type, source)
-                    VALUES (%s, 'payment_link_sent', 'email_detection')
-                """, (order_id,))
+            if cur.fetchone():
                 return {"status": "ok", "updated": True}
     
     return {"status": "ok", "updated": False, "message": "Already marked"}
@@ -47,14 +89,14 @@ def parse_payment_notification(email_subject: str) -> Tuple[Optional[float], Opt
     Returns: (payment_amount, customer_name) or (None, None) if not a payment notification
     """
     # Extract amount from subject
-    amount_match = re.search(r'\$([\d,]+\.?\d*)\s+payment received', email_subject, re.IGNORECASE)
+    amount_match = PAYMENT_AMOUNT_RE.search(email_subject)
     if not amount_match:
         return None, None
     
     payment_amount = float(amount_match.group(1).replace(',', ''))
     
     # Extract customer name
-    name_match = re.search(r'payment received from (.+)$', email_subject, re.IGNORECASE)
+    name_match = PAYMENT_NAME_RE.search(email_subject)
     customer_name = name_match.group(1).strip() if name_match else None
     
     return payment_amount, customer_name
@@ -68,35 +110,11 @@ def match_payment_to_order(payment_amount: float, customer_name: Optional[str] =
     """
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get recent unpaid orders
-            cur.execute("""
-                SELECT order_id, order_total, customer_name 
-                FROM orders 
-                WHERE NOT payment_received 
-                AND order_total IS NOT NULL
-                ORDER BY order_date DESC
-                LIMIT 50
-            """)
-            orders = cur.fetchall()
-            
-            matched_order = None
-            
-            # Try to match by amount (payment should be >= order total)
-            for order in orders:
-                if order['order_total'] and payment_amount >= float(order['order_total']):
-                    # Could be this order - check name similarity if we have it
-                    if customer_name and order['customer_name']:
-                        # Simple check - first name match
-                        pay_first = customer_name.split()[0].lower()
-                        order_first = order['customer_name'].split()[0].lower()
-                        if pay_first == order_first:
-                            matched_order = dict(order)
-                            break
-                    elif not matched_order:
-                        # Take first amount match if no name match
-                        matched_order = dict(order)
-            
-            return matched_order
+            cur.execute(UNPAID_ORDER_MATCH_SQL, {
+                'amount': payment_amount, 'pay_first': payment_first_name(customer_name)
+            })
+            row = cur.fetchone()
+            return dict(row) if row else None
 
 
 def record_payment_received(order_id: str, payment_amount: float, customer_name: Optional[str] = None) -> Dict:
@@ -144,7 +162,7 @@ def extract_rl_quote_number(email_body: str) -> Optional[str]:
     Extract R+L quote number from email body.
     Pattern: "RL Quote No: 9075654" or "Quote: 9075654" or "Quote #9075654"
     """
-    quote_match = re.search(r'(?:RL\s+)?Quote\s*(?:No|#)?[:\s]*(\d{6,10})', email_body, re.IGNORECASE)
+    quote_match = RL_QUOTE_RE.search(email_body)
     return quote_match.group(1) if quote_match else None
 
 
@@ -170,7 +188,7 @@ def extract_pro_number(email_body: str) -> Optional[str]:
     Extract R+L PRO number from email body.
     Pattern: "PRO 74408602-5" or "PRO# 74408602-5" or "Pro Number: 74408602-5"
     """
-    pro_match = re.search(r'PRO\s*(?:#|Number)?[:\s]*([A-Z]{0,2}\d{8,10}(?:-\d)?)', email_body, re.IGNORECASE)
+    pro_match = PRO_NUMBER_RE.search(email_body)
     return pro_match.group(1).upper() if pro_match else None
 
 
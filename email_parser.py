@@ -5,12 +5,53 @@ Handles parsing B2BWave order emails and extracting order data.
 """
 
 import re
+import functools
 from typing import Dict, List, Optional
 
 from psycopg2.extras import RealDictCursor
 from db_helpers import get_db
 
 
+# Single-line header fields, one search each so a match for one field
+# can never consume the text another field needs.
+_RE_ORDER_ID = re.compile(r'Order ID:\s*(\d{4,7})')
+_RE_NAME = re.compile(r'Name:\s*(.+?)(?:\n|$)')
+_RE_COMPANY = re.compile(r'Company:\s*(.+?)(?:\n|$)')
+_RE_PHONE = re.compile(r'Phone[:\s]+(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})')
+_RE_EMAIL = re.compile(r'Email:\s*([\w.-]+@[\w.-]+\.\w+)')
+_RE_TOTAL = re.compile(r'(?:^|\n)Total:\s*\$?([\d,]+\.?\d*)')
+
+# Street fallback when no numbered line precedes city/state/zip.
+_RE_STREET_FALLBACK = re.compile(
+    r'(\d+\s+(?:N\.?|S\.?|E\.?|W\.?|North|South|East|West)?\s*[A-Za-z0-9\s]+'
+    r'(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd|Way|Court|Ct|Place|Pl|Circle|Cir|Trail)[^\n]*)',
+    re.IGNORECASE
+)
+
+# Order ID in subject: "Order Legendary Home Improvements-(#5261)" / "Order #5261"
+_RE_SUBJECT_ORDER_ID = re.compile(r'\(#(\d{4,7})\)')
+_RE_SUBJECT_ORDER_NO = re.compile(r'Order\s*#?(\d{4,7})')
+_RE_COMMENTS = re.compile(r'Comments:\s*(.+?)(?:\n\n|\nTotal:|\nGross|$)', re.DOTALL)
+
+# City/state/zip, tried in order
+_RE_CSZ_PATTERNS = [
+    # Double-space separated: "Keystone Heights  FL  32656"
+    re.compile(r'([A-Za-z][A-Za-z\s]+?)\s{2,}([A-Z]{2})\s{2,}(\d{5}(?:-\d{4})?)'),
+    # Single space with comma: "Keystone Heights, FL 32656"
+    re.compile(r'([A-Za-z][A-Za-z\s]+?),\s*([A-Z]{2})\s+(\d{5}(?:-\d{4})?)'),
+    # Single space: "Keystone Heights FL 32656"
+    re.compile(r'([A-Za-z][A-Za-z\s]+?)\s+([A-Z]{2})\s+(\d{5}(?:-\d{4})?)'),
+]
+
+# Lines that start with a number (potential street addresses)
+_RE_NUMBERED_LINE = re.compile(r'^(\d+[^\n]+?)(?:\n|$)', re.MULTILINE)
+_RE_PHONE_LINE = re.compile(r'^\d{3}[-.\s]?\d{3}[-.\s]?\d{4}')
+
+# SKU codes like HSS-3VDB15, NSN-SM8, SHLS-B09
+_RE_SKU_PREFIX = re.compile(r'\b([A-Z]{2,5})-[A-Z0-9]+\b')
+_RE_NON_DIGIT = re.compile(r'\D')
+
+
 def parse_b2bwave_email(body: str, subject: str) -> dict:
     """
     Parse B2BWave order email and extract all fields.
@@ -35,46 +76,46 @@ def parse_b2bwave_email(body: str, subject: str) -> dict:
     clean_body = body.replace('\r\n', '\n').replace('\r', '\n')
     
     # Extract order ID from subject: "Order Legendary Home Improvements-(#5261)"
-    subject_match = re.search(r'\(#(\d{4,7})\)', subject)
+    subject_match = _RE_SUBJECT_ORDER_ID.search(subject)
     if subject_match:
         result['order_id'] = subject_match.group(1)
     
     # Also try from body
     if not result['order_id']:
-        order_id_match = re.search(r'Order ID:\s*(\d{4,7})', clean_body)
+        order_id_match = _RE_ORDER_ID.search(clean_body)
         if order_id_match:
             result['order_id'] = order_id_match.group(1)
     
     # Extract Name
-    name_match = re.search(r'Name:\s*(.+?)(?:\n|$)', clean_body)
+    name_match = _RE_NAME.search(clean_body)
     if name_match:
         result['customer_name'] = name_match.group(1).strip()
     
     # Extract Company
-    company_match = re.search(r'Company:\s*(.+?)(?:\n|$)', clean_body)
+    company_match = _RE_COMPANY.search(clean_body)
     if company_match:
         result['company_name'] = company_match.group(1).strip()
     
     # Extract Phone (format: "Phone 352-665-0280" or "Phone: 352-665-0280")
-    phone_match = re.search(r'Phone[:\s]+(\d{3}[-.\s]?\d{3}[-.\s]?\d{4})', clean_body)
+    phone_match = _RE_PHONE.search(clean_body)
     if phone_match:
         result['phone'] = phone_match.group(1).replace('.', '-').replace(' ', '-')
     
     # Extract Email
-    email_match = re.search(r'Email:\s*([\w.-]+@[\w.-]+\.\w+)', clean_body)
+    email_match = _RE_EMAIL.search(clean_body)
     if email_match:
         result['email'] = email_match.group(1).lower()
     
-    # Extract Comments
-    comments_match = re.search(r'Comments:\s*(.+?)(?:\n\n|\nTotal:|\nGross|$)', clean_body, re.DOTALL)
-    if comments_match:
-        result['comments'] = comments_match.group(1).strip()
-    
     # Extract Total
-    total_match = re.search(r'(?:^|\n)Total:\s*\$?([\d,]+\.?\d*)', clean_body)
+    total_match = _RE_TOTAL.search(clean_body)
     if total_match:
         result['order_total'] = float(total_match.group(1).replace(',', ''))
     
+    # Extract Comments
+    comments_match = _RE_COMMENTS.search(clean_body)
+    if comments_match:
+        result['comments'] = comments_match.group(1).strip()
+    
     # =========================================================================
     # IMPROVED ADDRESS PARSING
     # B2BWave format variations:
@@ -85,17 +126,8 @@ def parse_b2bwave_email(body: str, subject: str) -> dict:
     
     # First, find city/state/zip pattern anywhere in email
     # Pattern: City (words)  STATE (2 letters)  ZIP (5 digits)
-    csz_patterns = [
-        # Double-space separated: "Keystone Heights  FL  32656"
-        r'([A-Za-z][A-Za-z\s]+?)\s{2,}([A-Z]{2})\s{2,}(\d{5}(?:-\d{4})?)',
-        # Single space with comma: "Keystone Heights, FL 32656"
-        r'([A-Za-z][A-Za-z\s]+?),\s*([A-Z]{2})\s+(\d{5}(?:-\d{4})?)',
-        # Single space: "Keystone Heights FL 32656"
-        r'([A-Za-z][A-Za-z\s]+?)\s+([A-Z]{2})\s+(\d{5}(?:-\d{4})?)',
-    ]
-    
-    for pattern in csz_patterns:
-        csz_match = re.search(pattern, clean_body)
+    for pattern in _RE_CSZ_PATTERNS:
+        csz_match = pattern.search(clean_body)
         if csz_match:
             city = csz_match.group(1).strip()
             state = csz_match.group(2)
@@ -111,15 +143,14 @@ def parse_b2bwave_email(body: str, subject: str) -> dict:
     # Now find street address - look for line starting with number before the city/state/zip
     if result['city']:
         # Find all lines that start with a number (potential street addresses)
-        street_pattern = r'^(\d+[^\n]+?)(?:\n|$)'
-        street_matches = re.findall(street_pattern, clean_body, re.MULTILINE)
+        street_matches = _RE_NUMBERED_LINE.findall(clean_body)
         
         for street in street_matches:
             street = street.strip()
             # Skip if it's a phone number line or contains keywords
             if 'phone' in street.lower():
                 continue
-            if re.match(r'^\d{3}[-.\s]?\d{3}[-.\s]?\d{4}', street):
+            if _RE_PHONE_LINE.match(street):
                 continue  # This is a phone number
             if '$' in street:
                 continue  # This is a price line
@@ -130,13 +161,13 @@ def parse_b2bwave_email(body: str, subject: str) -> dict:
     # If we still don't have street, try alternative approach
     if not result['street']:
         # Look for common street patterns
-        street_match = re.search(r'(\d+\s+(?:N\.?|S\.?|E\.?|W\.?|North|South|East|West)?\s*[A-Za-z0-9\s]+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd|Way|Court|Ct|Place|Pl|Circle|Cir|Trail)[^\n]*)', clean_body, re.IGNORECASE)
+        street_match = _RE_STREET_FALLBACK.search(clean_body)
         if street_match:
             result['street'] = street_match.group(1).strip()
     
     # Extract SKU codes for warehouse mapping
     # Look for patterns like HSS-3VDB15, NSN-SM8, SHLS-B09
-    sku_pattern = re.findall(r'\b([A-Z]{2,5})-[A-Z0-9]+\b', clean_body)
+    sku_pattern = _RE_SKU_PREFIX.findall(clean_body)
     sku_prefixes = list(set(sku_pattern))
     result['sku_prefixes'] = sku_prefixes
     
@@ -148,30 +179,36 @@ def get_warehouses_for_skus(sku_prefixes: List[str]) -> List[str]:
     if not sku_prefixes:
         return []
     
-    warehouses = []
+    return list(_warehouses_for_prefixes(tuple(sorted({p.upper() for p in sku_prefixes}))))
+
+
+# warehouse_mapping rarely changes; clear_warehouse_cache() after editing it
+@functools.lru_cache(maxsize=2048)
+def _warehouses_for_prefixes(upper_prefixes: tuple) -> tuple:
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            placeholders = ','.join(['%s'] * len(sku_prefixes))
-            upper_prefixes = [p.upper() for p in sku_prefixes]
-            cur.execute(f"""
+            cur.execute("""
                 SELECT DISTINCT warehouse_name
                 FROM warehouse_mapping
-                WHERE UPPER(sku_prefix) IN ({placeholders})
-            """, upper_prefixes)
-            warehouses = [row['warehouse_name'] for row in cur.fetchall()]
-    
-    return warehouses
+                WHERE UPPER(sku_prefix) = ANY(%s)
+            """, (list(upper_prefixes),))
+            return tuple(row['warehouse_name'] for row in cur.fetchall())
+
+
+def clear_warehouse_cache():
+    """Forget cached SKU prefix -> warehouse lookups"""
+    _warehouses_for_prefixes.cache_clear()
 
 
 def extract_order_id_from_subject(subject: str) -> Optional[str]:
     """Extract order ID from email subject line"""
     # Pattern: "Order Legendary Home Improvements-(#5261)"
-    match = re.search(r'\(#(\d{4,7})\)', subject)
+    match = _RE_SUBJECT_ORDER_ID.search(subject)
     if match:
         return match.group(1)
     
     # Alternative pattern: "Order #5261"
-    match = re.search(r'Order\s*#?(\d{4,7})', subject)
+    match = _RE_SUBJECT_ORDER_NO.search(subject)
     if match:
         return match.group(1)
     
@@ -180,7 +217,7 @@ def extract_order_id_from_subject(subject: str) -> Optional[str]:
 
 def extract_sku_prefixes(text: str) -> List[str]:
     """Extract SKU prefixes from text (e.g., HSS, NSN, SHLS)"""
-    sku_pattern = re.findall(r'\b([A-Z]{2,5})-[A-Z0-9]+\b', text)
+    sku_pattern = _RE_SKU_PREFIX.findall(text)
     return list(set(sku_pattern))
 
 
@@ -190,7 +227,7 @@ def clean_phone_number(phone: str) -> str:
         return ""
     
     # Remove all non-digits
-    digits = re.sub(r'\D', '', phone)
+    digits = _RE_NON_DIGIT.sub('', phone)
     
     # Format as XXX-XXX-XXXX
     if len(digits) == 10:
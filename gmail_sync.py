@@ -11,6 +11,8 @@ import urllib.request
 import urllib.error
 from datetime import datetime, timezone, timedelta
 
+from detection import SQUARE_LINK_RE, RL_QUOTE_RE, PRO_NUMBER_RE
+
 # Gmail API Config - loaded from environment
 GMAIL_CLIENT_ID = os.environ.get("GMAIL_CLIENT_ID", "").strip()
 GMAIL_CLIENT_SECRET = os.environ.get("GMAIL_CLIENT_SECRET", "").strip()
@@ -20,6 +22,13 @@ GMAIL_REFRESH_TOKEN = os.environ.get("GMAIL_REFRESH_TOKEN", "").strip()
 SQUARE_PAYMENT_SENDER = "noreply@messaging.squareup.com"
 RL_CARRIERS_SENDER = "rlloads@rlcarriers.com"
 
+# Patterns used on every synced email, compiled once
+ORDER_REF_RE = re.compile(r'(?:order\s*#?\s*|#)(\d{4,5})\b', re.IGNORECASE)
+ORDER_NUMBER_RE = re.compile(r'\b(\d{4,5})\b')
+DOLLAR_AMOUNT_RE = re.compile(r'\$([\d,]+\.?\d*)')
+PAYMENT_FROM_RE = re.compile(r'payment received from\s+([^\n]+)', re.IGNORECASE)
+UPS_TRACKING_RE = re.compile(r'\b(1Z[A-Z0-9]{16})\b')
+
 # Cache access token
 _access_token = None
 _token_expires = None
@@ -125,12 +134,12 @@ def get_email_content(message_id):
 def extract_order_id(text):
     """Extract order ID from text (4-5 digit number)"""
     # Look for patterns like "order 5307" or "#5307" or "Order #5307"
-    match = re.search(r'(?:order\s*#?\s*|#)(\d{4,5})\b', text, re.IGNORECASE)
+    match = ORDER_REF_RE.search(text)
     if match:
         return match.group(1)
     
     # Try standalone 4-5 digit numbers (less reliable)
-    match = re.search(r'\b(\d{4,5})\b', text)
+    match = ORDER_NUMBER_RE.search(text)
     if match:
         return match.group(1)
     
@@ -138,7 +147,7 @@ def extract_order_id(text):
 
 def extract_payment_amount(text):
     """Extract dollar amount from text"""
-    match = re.search(r'\$([\d,]+\.?\d*)', text)
+    match = DOLLAR_AMOUNT_RE.search(text)
     if match:
         return float(match.group(1).replace(',', ''))
     return None
@@ -146,7 +155,7 @@ def extract_payment_amount(text):
 def extract_customer_name(text):
     """Extract customer name from Square payment email"""
     # Pattern: "$X payment received from Name"
-    match = re.search(r'payment received from\s+([^\n]+)', text, re.IGNORECASE)
+    match = PAYMENT_FROM_RE.search(text)
     if match:
         return match.group(1).strip()
     return None
@@ -190,7 +199,7 @@ def run_gmail_sync(db_conn, hours_back=2):
                 if 'cabinetsforcontractors' not in email['from'].lower() and 'william' not in email['from'].lower():
                     continue
                 
-                if 'square.link' not in email['body'].lower():
+                if not SQUARE_LINK_RE.search(email['body']):
                     continue
                 
                 order_id = extract_order_id(email['subject'] + ' ' + email['body'])
@@ -241,8 +250,7 @@ def run_gmail_sync(db_conn, hours_back=2):
                     continue
                 
                 # Look for quote number pattern
-                quote_match = re.search(r'(?:RL\s+)?Quote\s*(?:No|#)?[:\s]*(\d{6,10})', 
-                                       email['body'], re.IGNORECASE)
+                quote_match = RL_QUOTE_RE.search(email['body'])
                 if quote_match:
                     quote_no = quote_match.group(1)
                     order_id = extract_order_id(email['subject'] + ' ' + email['body'])
@@ -270,8 +278,7 @@ def run_gmail_sync(db_conn, hours_back=2):
                 text = email['subject'] + ' ' + email['body']
                 
                 # PRO number pattern
-                pro_match = re.search(r'PRO\s*(?:#|Number)?[:\s]*([A-Z]{0,2}\d{8,10}(?:-\d)?)', 
-                                     text, re.IGNORECASE)
+                pro_match = PRO_NUMBER_RE.search(text)
                 if pro_match:
                     pro_no = pro_match.group(1).upper()
                     order_id = extract_order_id(text)
@@ -281,7 +288,7 @@ def run_gmail_sync(db_conn, hours_back=2):
                         continue
                 
                 # UPS tracking (1Z...)
-                ups_match = re.search(r'\b(1Z[A-Z0-9]{16})\b', text)
+                ups_match = UPS_TRACKING_RE.search(text)
                 if ups_match:
                     order_id = extract_order_id(text)
                     if order_id:
@@ -7,23 +7,47 @@ Added comprehensive AI summary for order popup.
 import os
 import re
 import json
+import asyncio
+import functools
+import hashlib
+import itertools
 import base64
 import urllib.request
 import urllib.error
 import urllib.parse
 import threading
 import time
-from datetime import datetime, timezone, timedelta
-from decimal import Decimal
-from typing import Optional, List
+from datetime import date, datetime, timezone, timedelta
+from typing import Iterator, Optional, List
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, HTTPException
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, Json
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse, HTMLResponse, RedirectResponse
+from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 
+# orjson encodes responses in C (datetime included); stdlib json is the fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# RapidFuzz matches warehouse names that aren't spelled exactly like WAREHOUSE_ZIPS
+try:
+    from rapidfuzz import fuzz, process as rapidfuzz_process
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
 # =============================================================================
 # IMPORT HELPER MODULES
 # =============================================================================
@@ -33,15 +57,29 @@ from config import (
     DATABASE_URL, B2BWAVE_URL, B2BWAVE_USERNAME, B2BWAVE_API_KEY,
     ANTHROPIC_API_KEY, SHIPPO_API_KEY,
     AUTO_SYNC_INTERVAL_MINUTES, AUTO_SYNC_DAYS_BACK,
-    SUPPLIER_INFO, WAREHOUSE_ZIPS, OVERSIZED_KEYWORDS
+    ORDER_CACHE_SECONDS, ORDERS_LIST_CACHE_SECONDS, SUMMARY_CACHE_SECONDS,
+    CHECKOUT_SNAPSHOT_CACHE_SECONDS,
+    STATUS_SUMMARY_CACHE_SECONDS, TRUSTED_CUSTOMERS_CACHE_SECONDS,
+    REQUEST_THREADPOOL_SIZE, SUPPLIER_INFO, WAREHOUSE_ZIPS, OVERSIZED_KEYWORDS
 )
 
 # Database helpers
-from db_helpers import get_db
+from db_helpers import (
+    get_db, get_db_conn, get_db_cursor, execute_prepared, start_order_status_refresher, claim_background_jobs,
+    invalidate_trusted_customers, is_trusted_customer as db_is_trusted_customer
+)
+from snippet_queue import enqueue_snippet, start_snippet_writer, drain_snippets
+
+# Order read cache (Redis, or in-process fallback)
+from cache import (
+    CACHE_SHARED, TRUSTED_CUSTOMERS_CACHE_KEY, cache_get, cache_set, cache_delete, cache_stream,
+    order_cache_key, orders_list_cache_key, summary_cache_key, status_summary_cache_key,
+    checkout_snapshot_cache_key, invalidate_order_cache
+)
 
 # Email parsing
 try:
-    from email_parser import parse_b2bwave_email, get_warehouses_for_skus
+    from email_parser import parse_b2bwave_email, get_warehouses_for_skus, clear_warehouse_cache
     EMAIL_PARSER_LOADED = True
 except ImportError:
     EMAIL_PARSER_LOADED = False
@@ -53,7 +91,9 @@ try:
         detect_square_payment_link, extract_rl_quote_number, 
         extract_pro_number, parse_payment_notification,
         match_payment_to_order, record_payment_received,
-        record_rl_quote, record_pro_number
+        record_rl_quote, record_pro_number,
+        UNPAID_ORDER_MATCH_SQL, payment_first_name,
+        RL_QUOTE_RE, PRO_NUMBER_RE, SQUARE_LINK_RE, PAYMENT_AMOUNT_RE, PAYMENT_NAME_RE
     )
     DETECTION_MODULE_LOADED = True
 except ImportError:
@@ -70,17 +110,7 @@ except ImportError:
 
 # Database migrations
 try:
-    from db_migrations import (
-        create_pending_checkouts_table as _create_pending_checkouts,
-        create_shipments_table as _create_shipments,
-        add_rl_shipping_fields as _add_rl_fields,
-        add_ps_fields as _add_ps_fields,
-        fix_shipment_columns as _fix_shipment_columns,
-        fix_sku_columns as _fix_sku_columns,
-        fix_order_id_length as _fix_order_id_length,
-        recreate_order_status_view as _recreate_order_status_view,
-        add_weight_column as _add_weight_column
-    )
+    from db_migrations import run_migrations
     DB_MIGRATIONS_LOADED = True
 except ImportError:
     DB_MIGRATIONS_LOADED = False
@@ -89,8 +119,8 @@ except ImportError:
 # Sync service (B2BWave sync + auto-sync scheduler)
 try:
     from sync_service import (
-        b2bwave_api_request, sync_order_from_b2bwave,
-        start_auto_sync_thread, get_sync_status,
+        b2bwave_api_request, b2bwave_iter_orders, b2bwave_since_date, sync_order_from_b2bwave, sync_orders_stream,
+        start_auto_sync_thread, get_sync_status, enqueue_webhook_order,
         is_configured as b2bwave_is_configured
     )
     SYNC_SERVICE_LOADED = True
@@ -144,7 +174,11 @@ except ImportError:
 # FASTAPI APP
 # =============================================================================
 
-app = FastAPI(title="CFC Order Workflow", version="6.0.0")
+app = FastAPI(
+    title="CFC Order Workflow",
+    version="6.0.0",
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -153,6 +187,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Compress anything over ~500 bytes (checkout page, order lists) for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+# Checkout page shell (static/checkout.html), served straight from disk
+app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")), name="static")
 
 # Global for tracking last sync
 last_auto_sync = None
@@ -209,6 +248,39 @@ class CheckpointUpdate(BaseModel):
     source: Optional[str] = "api"
     payment_amount: Optional[float] = None
 
+class ShipmentUpdate(BaseModel):
+    status: Optional[str] = None
+    tracking: Optional[str] = None
+    pro_number: Optional[str] = None
+    weight: Optional[float] = None
+    ship_method: Optional[str] = None
+    bol_sent: Optional[bool] = None
+    # RL Carriers fields
+    origin_zip: Optional[str] = None
+    rl_quote_number: Optional[str] = None
+    rl_quote_price: Optional[float] = None
+    rl_customer_price: Optional[float] = None
+    rl_invoice_amount: Optional[float] = None
+    has_oversized: Optional[bool] = None
+    # Li Delivery fields
+    li_quote_price: Optional[float] = None
+    li_customer_price: Optional[float] = None
+    actual_cost: Optional[float] = None
+    quote_url: Optional[str] = None
+    ps_quote_url: Optional[str] = None
+    ps_quote_price: Optional[float] = None
+    tracking_number: Optional[str] = None
+    quote_price: Optional[float] = None
+    customer_price: Optional[float] = None
+
+# Shipment status -> timestamp column stamped when a shipment enters it
+SHIPMENT_STATUS_TIMESTAMPS = {
+    'at_warehouse': 'sent_to_warehouse_at',
+    'needs_bol': 'warehouse_confirmed_at',
+    'shipped': 'shipped_at',
+    'delivered': 'delivered_at',
+}
+
 class WarehouseMappingUpdate(BaseModel):
     sku_prefix: str
     warehouse_name: str
@@ -224,11 +296,21 @@ class WarehouseMappingUpdate(BaseModel):
 last_auto_sync = None
 auto_sync_running = False
 
+def runs_background_jobs() -> bool:
+    """True in the one worker process that runs auto-sync and the order_status refresh"""
+    if not DATABASE_URL:
+        return False
+    try:
+        return claim_background_jobs()
+    except Exception as e:
+        print(f"[STARTUP] Could not claim background jobs: {e}")
+        return False
+
 @app.on_event("startup")
 def start_auto_sync():
     """Start background sync thread on app startup"""
     if SYNC_SERVICE_LOADED:
-        start_auto_sync_thread(run_gmail_sync, run_square_sync)
+        start_auto_sync_thread(run_gmail_sync, run_square_sync, scheduled=runs_background_jobs())
     elif B2BWAVE_URL and B2BWAVE_USERNAME and B2BWAVE_API_KEY:
         print("[AUTO-SYNC] sync_service not loaded, auto-sync disabled")
     else:
@@ -238,15 +320,25 @@ def start_auto_sync():
 # ROUTES
 # =============================================================================
 
+# Root status payload only changes when a sync runs; cache it briefly
+ROOT_CACHE_SECONDS = 5
+_root_cache = {"t": 0.0, "v": None}
+
 @app.get("/")
-def root():
+def root(response: Response):
+    now = time.monotonic()
+    response.headers["Cache-Control"] = f"max-age={ROOT_CACHE_SECONDS}"
+    if _root_cache["v"] is not None and now - _root_cache["t"] < ROOT_CACHE_SECONDS:
+        response.headers["X-Cache"] = "HIT"
+        return _root_cache["v"]
+    
     sync_status = get_sync_status() if SYNC_SERVICE_LOADED else {
         "enabled": False,
         "interval_minutes": AUTO_SYNC_INTERVAL_MINUTES,
         "last_sync": None,
         "running": False
     }
-    return {
+    _root_cache["v"] = {
         "status": "ok", 
         "service": "CFC Order Workflow", 
         "version": "6.0.0",
@@ -258,102 +350,80 @@ def root():
             "enabled": square_configured()
         }
     }
+    _root_cache["t"] = now
+    response.headers["X-Cache"] = "MISS"
+    return _root_cache["v"]
+
+_HEALTH = {"status": "ok", "version": "6.0.0"}
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "version": "6.0.0"}
+    return _HEALTH
 
 # =============================================================================
-# DATABASE MIGRATION ENDPOINTS (logic in db_migrations.py)
+# DATABASE MIGRATIONS (applied at startup, see MIGRATIONS in db_migrations.py)
 # =============================================================================
 
-@app.post("/create-pending-checkouts-table")
-def create_pending_checkouts_table():
-    """Create pending_checkouts table for B2BWave checkout flow"""
-    if DB_MIGRATIONS_LOADED:
-        return _create_pending_checkouts()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/create-shipments-table")
-def create_shipments_table():
-    """Create order_shipments table"""
-    if DB_MIGRATIONS_LOADED:
-        return _create_shipments()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/add-rl-fields")
-def add_rl_shipping_fields():
-    """Add RL Carriers shipping fields"""
-    if DB_MIGRATIONS_LOADED:
-        return _add_rl_fields()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/add-ps-fields")
-def add_ps_fields():
-    """Add Pirateship fields"""
-    if DB_MIGRATIONS_LOADED:
-        return _add_ps_fields()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/fix-shipment-columns")
-def fix_shipment_columns():
-    """Fix column lengths in order_shipments"""
-    if DB_MIGRATIONS_LOADED:
-        return _fix_shipment_columns()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/fix-sku-columns")
-def fix_sku_columns():
-    """Fix SKU column lengths"""
-    if DB_MIGRATIONS_LOADED:
-        return _fix_sku_columns()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/fix-order-id-length")
-def fix_order_id_length():
-    """Increase order_id column length"""
-    if DB_MIGRATIONS_LOADED:
-        return _fix_order_id_length()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/recreate-order-status-view")
-def recreate_order_status_view():
-    """Recreate the order_status view"""
-    if DB_MIGRATIONS_LOADED:
-        return _recreate_order_status_view()
-    return {"status": "error", "message": "db_migrations module not loaded"}
-
-@app.post("/add-weight-column")
-def add_weight_column():
-    """Add total_weight column"""
-    if DB_MIGRATIONS_LOADED:
-        return _add_weight_column()
-    return {"status": "error", "message": "db_migrations module not loaded"}
+@app.on_event("startup")
+def apply_migrations():
+    """Apply pending schema migrations once at startup"""
+    if not DB_MIGRATIONS_LOADED:
+        return
+    try:
+        result = run_migrations()
+        print(f"[MIGRATIONS] {result}")
+    except Exception as e:
+        print(f"[MIGRATIONS] Error: {e}")
+
+@app.on_event("startup")
+def start_order_status_refresh():
+    """Keep the order_status materialized view refreshed as orders change"""
+    if DATABASE_URL:
+        refresh = runs_background_jobs()
+        # Other workers only listen to clear their own in-memory cache; Redis needs no listener
+        if refresh or not CACHE_SHARED:
+            start_order_status_refresher(refresh=refresh)
+
+@app.on_event("startup")
+def start_snippet_writer_thread():
+    """Write queued email snippets in batches"""
+    if DATABASE_URL:
+        start_snippet_writer()
+
+@app.on_event("shutdown")
+def flush_snippet_queue():
+    """Write queued email snippets before the process exits"""
+    if DATABASE_URL:
+        drain_snippets()
+
+@app.on_event("startup")
+async def size_request_threadpool():
+    """Match the threadpool that runs blocking `def` endpoints to the DB pool size"""
+    to_thread.current_default_thread_limiter().total_tokens = REQUEST_THREADPOOL_SIZE
 
 @app.get("/debug/orders-columns")
 def debug_orders_columns():
     """Check what columns exist in orders table"""
     with get_db() as conn:
         with conn.cursor() as cur:
+            # Table and view columns in one catalog query (pg_attribute, since
+            # information_schema.columns leaves out materialized views)
             cur.execute("""
-                SELECT column_name, data_type 
-                FROM information_schema.columns 
-                WHERE table_name = 'orders'
-                ORDER BY ordinal_position
-            """)
-            columns = cur.fetchall()
-            
-            # Check if view exists
-            cur.execute("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'order_status'
+                SELECT c.relname, a.attname
+                FROM pg_attribute a
+                JOIN pg_class c ON c.oid = a.attrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public' AND c.relname IN ('orders', 'order_status')
+                  AND a.attnum > 0 AND NOT a.attisdropped
+                ORDER BY c.relname, a.attnum
             """)
-            view_columns = cur.fetchall()
+            columns = {'orders': [], 'order_status': []}
+            for table_name, column_name in cur.fetchall():
+                columns[table_name].append(column_name)
             
             return {
-                "orders_columns": [c[0] for c in columns],
-                "view_columns": [c[0] for c in view_columns] if view_columns else "view does not exist"
+                "orders_columns": columns['orders'],
+                "view_columns": columns['order_status'] or "view does not exist"
             }
 
 @app.post("/init-db")
@@ -362,12 +432,22 @@ def init_db():
     with get_db() as conn:
         with conn.cursor() as cur:
             cur.execute(SCHEMA_SQL)
-    return {"status": "ok", "message": "Database schema initialized", "version": "5.6.1"}
+    migrations = run_migrations() if DB_MIGRATIONS_LOADED else None
+    return {"status": "ok", "message": "Database schema initialized", "version": "5.6.1", "migrations": migrations}
 
 # =============================================================================
 # B2BWAVE SYNC ENDPOINTS
 # =============================================================================
 
+# Manual syncs can take many seconds; they run on their own threads so they never
+# hold FastAPI's shared request threadpool while other endpoints are waiting
+_SYNC_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sync-endpoint")
+
+async def run_sync_job(func, *args, **kwargs):
+    """Run a blocking sync function on _SYNC_EXECUTOR without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_SYNC_EXECUTOR, functools.partial(func, *args, **kwargs))
+
 @app.get("/b2bwave/test")
 def test_b2bwave():
     """Test B2BWave API connection"""
@@ -398,33 +478,21 @@ def test_b2bwave():
         }
 
 @app.post("/b2bwave/sync")
-def sync_from_b2bwave(days_back: int = 14):
+async def sync_from_b2bwave(days_back: int = 14):
     """
     Sync orders from B2BWave API.
     Default: last 14 days of orders.
     """
     # Calculate date range
-    since_date = (datetime.now(timezone.utc) - timedelta(days=days_back)).strftime("%Y-%m-%d")
+    since_date = b2bwave_since_date(days_back)
     
+    # Write each chunk of pages while the next ones download instead of
+    # holding every order in memory first
     try:
-        data = b2bwave_api_request("orders", {"submitted_at_gteq": since_date})
+        synced, errors = await run_sync_job(sync_orders_stream, b2bwave_iter_orders(since_date))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"B2BWave API error: {str(e)}")
     
-    # Handle response format
-    orders_list = data if isinstance(data, list) else [data]
-    
-    synced = []
-    errors = []
-    
-    for order_data in orders_list:
-        try:
-            result = sync_order_from_b2bwave(order_data)
-            synced.append(result)
-        except Exception as e:
-            order_id = order_data.get('order', order_data).get('id', 'unknown')
-            errors.append({"order_id": order_id, "error": str(e)})
-    
     return {
         "status": "ok",
         "synced_count": len(synced),
@@ -434,7 +502,7 @@ def sync_from_b2bwave(days_back: int = 14):
     }
 
 @app.post("/gmail/sync")
-def sync_from_gmail(hours_back: int = 2):
+async def sync_from_gmail(hours_back: int = 2, conn=Depends(get_db_conn)):
     """
     Sync order status updates from Gmail.
     Scans for: payment links sent, payments received, RL quotes, tracking numbers.
@@ -444,15 +512,14 @@ def sync_from_gmail(hours_back: int = 2):
         raise HTTPException(status_code=400, detail="Gmail not configured. Set GMAIL_CLIENT_ID, GMAIL_CLIENT_SECRET, GMAIL_REFRESH_TOKEN environment variables.")
     
     try:
-        with get_db() as conn:
-            results = run_gmail_sync(conn, hours_back=hours_back)
+        results = await run_sync_job(run_gmail_sync, conn, hours_back=hours_back)
         return {"status": "ok", "results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gmail sync error: {str(e)}")
 
 
 @app.post("/square/sync")
-def sync_from_square(hours_back: int = 24):
+async def sync_from_square(hours_back: int = 24, conn=Depends(get_db_conn)):
     """
     Sync payments from Square API.
     Matches payments to orders by parsing order IDs from payment descriptions.
@@ -462,13 +529,56 @@ def sync_from_square(hours_back: int = 24):
         raise HTTPException(status_code=400, detail="Square not configured. Set SQUARE_ACCESS_TOKEN and SQUARE_LOCATION_ID environment variables.")
     
     try:
-        with get_db() as conn:
-            results = run_square_sync(conn, hours_back=hours_back)
+        results = await run_sync_job(run_square_sync, conn, hours_back=hours_back)
         return {"status": "ok", "results": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Square sync error: {str(e)}")
 
 
+def _sync_with_db(sync_func, hours_back: int):
+    """Run a Gmail/Square sync on its own pooled connection"""
+    with get_db() as conn:
+        return sync_func(conn, hours_back=hours_back)
+
+
+@app.post("/sync/all")
+async def sync_all(days_back: int = 14, gmail_hours_back: int = 2, square_hours_back: int = 24):
+    """
+    Run the B2BWave, Gmail and Square syncs at once (each on its own connection),
+    so the total takes as long as the slowest instead of the sum.
+    Sources that aren't configured are skipped; one failing doesn't stop the others.
+    """
+    jobs = {}
+    if SYNC_SERVICE_LOADED and b2bwave_is_configured():
+        since_date = b2bwave_since_date(days_back)
+        jobs["b2bwave"] = run_sync_job(sync_orders_stream, b2bwave_iter_orders(since_date))
+    if gmail_configured():
+        jobs["gmail"] = run_sync_job(_sync_with_db, run_gmail_sync, gmail_hours_back)
+    if square_configured():
+        jobs["square"] = run_sync_job(_sync_with_db, run_square_sync, square_hours_back)
+    
+    outcomes = dict(zip(jobs, await asyncio.gather(*jobs.values(), return_exceptions=True)))
+    
+    results = {}
+    for name in ("b2bwave", "gmail", "square"):
+        if name not in outcomes:
+            results[name] = {"status": "skipped", "reason": "not configured"}
+        elif isinstance(outcomes[name], Exception):
+            results[name] = {"status": "error", "error": str(outcomes[name])}
+        elif name == "b2bwave":
+            synced, errors = outcomes[name]
+            results[name] = {
+                "status": "ok",
+                "synced_count": len(synced),
+                "error_count": len(errors),
+                "errors": errors if errors else None
+            }
+        else:
+            results[name] = {"status": "ok", "results": outcomes[name]}
+    
+    return {"status": "ok", "results": results}
+
+
 @app.get("/square/status")
 def square_status():
     """Check Square API configuration status"""
@@ -1305,7 +1415,7 @@ def rl_get_order_shipments(order_id: str):
 try:
     from rta_database import (
         init_rta_table, get_sku_info, get_skus_info,
-        calculate_order_weight_and_flags, get_rta_stats
+        calculate_order_weight_and_flags, get_rta_stats, clear_rta_cache
     )
     RTA_DB_ENABLED = True
 except ImportError as e:
@@ -1339,6 +1449,18 @@ def rta_init_table():
     return result
 
 
+@app.post("/rta/cache/clear")
+def rta_clear_cache():
+    """Forget cached SKU and SKU prefix -> warehouse lookups (e.g. after editing rta_products by hand)"""
+    if not RTA_DB_ENABLED:
+        raise HTTPException(status_code=503, detail="RTA database module not loaded")
+    
+    clear_rta_cache()
+    if EMAIL_PARSER_LOADED:
+        clear_warehouse_cache()
+    return {"status": "ok", "message": "RTA caches cleared"}
+
+
 @app.get("/rta/sku/{sku}")
 def rta_get_sku(sku: str):
     """Look up a single SKU"""
@@ -1367,6 +1489,23 @@ def rta_calculate_weight(request: dict):
     return result
 
 
+@app.post("/webhook/b2bwave")
+def b2bwave_sync_webhook(payload: dict):
+    """
+    Webhook endpoint for B2BWave order created/updated events.
+    Queues the order for the background worker and returns immediately.
+    """
+    if not SYNC_SERVICE_LOADED:
+        return {"status": "error", "message": "sync_service module not loaded"}
+    
+    order = payload.get('order', payload)
+    order_id = order.get('id') or order.get('order_id')
+    if not order_id:
+        raise HTTPException(status_code=400, detail="Missing order_id")
+    
+    enqueue_webhook_order(str(order_id))
+    return {"status": "queued", "order_id": str(order_id)}
+
 @app.get("/b2bwave/order/{order_id}")
 def get_b2bwave_order(order_id: str):
     """Fetch a specific order from B2BWave and sync it"""
@@ -1393,6 +1532,76 @@ def get_b2bwave_order(order_id: str):
 # EMAIL PARSING ENDPOINT
 # =============================================================================
 
+# Prepared once per pooled connection, then EXECUTEd on every parsed email.
+# Params: sku_prefixes, order_id, customer_name, company_name, email, phone,
+# street, city, state, zip_code, order_date, order_total, comments,
+# email_thread_id, trusted_name, trusted_company, event_data
+_UPSERT_ORDER_FROM_EMAIL = """(
+    text[], varchar, varchar, varchar, varchar, varchar,
+    varchar, varchar, varchar, varchar, timestamptz, numeric, text,
+    varchar, text, text, jsonb
+) AS
+    WITH wh AS (
+        SELECT COALESCE(array_agg(DISTINCT warehouse_name), '{}') AS names
+        FROM warehouse_mapping
+        WHERE UPPER(sku_prefix) = ANY($1)
+    ),
+    up AS (
+        INSERT INTO orders (
+            order_id, customer_name, company_name, email, phone,
+            street, city, state, zip_code,
+            order_date, order_total, comments,
+            warehouse_1, warehouse_2, email_thread_id,
+            is_trusted_customer
+        )
+        SELECT
+            $2, $3, $4, $5, $6,
+            $7, $8, $9, $10,
+            $11, $12, $13,
+            wh.names[1], wh.names[2], $14,
+            EXISTS (
+                SELECT 1 FROM trusted_customers 
+                WHERE LOWER(customer_name) = LOWER($15)
+                OR (company_name IS NOT NULL AND LOWER(company_name) = LOWER($16))
+            )
+        FROM wh
+        ON CONFLICT (order_id) DO UPDATE SET
+            customer_name = COALESCE(EXCLUDED.customer_name, orders.customer_name),
+            company_name = COALESCE(EXCLUDED.company_name, orders.company_name),
+            email = COALESCE(EXCLUDED.email, orders.email),
+            phone = COALESCE(EXCLUDED.phone, orders.phone),
+            street = COALESCE(EXCLUDED.street, orders.street),
+            city = COALESCE(EXCLUDED.city, orders.city),
+            state = COALESCE(EXCLUDED.state, orders.state),
+            zip_code = COALESCE(EXCLUDED.zip_code, orders.zip_code),
+            order_total = COALESCE(EXCLUDED.order_total, orders.order_total),
+            comments = COALESCE(EXCLUDED.comments, orders.comments),
+            warehouse_1 = COALESCE(EXCLUDED.warehouse_1, orders.warehouse_1),
+            warehouse_2 = COALESCE(EXCLUDED.warehouse_2, orders.warehouse_2),
+            updated_at = NOW()
+        -- Re-parsing an unchanged email writes no new row version (and no WAL)
+        WHERE (EXCLUDED.customer_name IS NOT NULL AND EXCLUDED.customer_name IS DISTINCT FROM orders.customer_name)
+           OR (EXCLUDED.company_name IS NOT NULL AND EXCLUDED.company_name IS DISTINCT FROM orders.company_name)
+           OR (EXCLUDED.email IS NOT NULL AND EXCLUDED.email IS DISTINCT FROM orders.email)
+           OR (EXCLUDED.phone IS NOT NULL AND EXCLUDED.phone IS DISTINCT FROM orders.phone)
+           OR (EXCLUDED.street IS NOT NULL AND EXCLUDED.street IS DISTINCT FROM orders.street)
+           OR (EXCLUDED.city IS NOT NULL AND EXCLUDED.city IS DISTINCT FROM orders.city)
+           OR (EXCLUDED.state IS NOT NULL AND EXCLUDED.state IS DISTINCT FROM orders.state)
+           OR (EXCLUDED.zip_code IS NOT NULL AND EXCLUDED.zip_code IS DISTINCT FROM orders.zip_code)
+           OR (EXCLUDED.order_total IS NOT NULL AND EXCLUDED.order_total IS DISTINCT FROM orders.order_total)
+           OR (EXCLUDED.comments IS NOT NULL AND EXCLUDED.comments IS DISTINCT FROM orders.comments)
+           OR (EXCLUDED.warehouse_1 IS NOT NULL AND EXCLUDED.warehouse_1 IS DISTINCT FROM orders.warehouse_1)
+           OR (EXCLUDED.warehouse_2 IS NOT NULL AND EXCLUDED.warehouse_2 IS DISTINCT FROM orders.warehouse_2)
+        RETURNING order_id, (xmax = 0) AS inserted
+    ),
+    ev AS (
+        INSERT INTO order_events (order_id, event_type, event_data, source)
+        SELECT order_id, 'order_created', $17, 'email_parse'
+        FROM up WHERE inserted
+    )
+    SELECT COALESCE((SELECT inserted FROM up), false) AS inserted, wh.names AS warehouses FROM wh
+"""
+
 @app.post("/parse-email", response_model=ParseEmailResponse)
 def parse_email(request: ParseEmailRequest):
     """
@@ -1407,128 +1616,79 @@ def parse_email(request: ParseEmailRequest):
             message="Could not extract order ID from email"
         )
     
-    # Get warehouses from SKU prefixes
-    warehouses = get_warehouses_for_skus(parsed.get('sku_prefixes', []))
+    # Create or update order in one statement: warehouse lookup, trusted check,
+    # upsert (don't overwrite checkpoints) and the order_created event for new orders
+    order_date = request.email_date or datetime.now(timezone.utc).isoformat()
     
-    # Create or update order
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Check if order exists
-            cur.execute("SELECT order_id FROM orders WHERE order_id = %s", (parsed['order_id'],))
-            exists = cur.fetchone()
-            
-            if exists:
-                # Update existing order (don't overwrite checkpoints)
-                cur.execute("""
-                    UPDATE orders SET
-                        customer_name = COALESCE(%s, customer_name),
-                        company_name = COALESCE(%s, company_name),
-                        email = COALESCE(%s, email),
-                        phone = COALESCE(%s, phone),
-                        street = COALESCE(%s, street),
-                        city = COALESCE(%s, city),
-                        state = COALESCE(%s, state),
-                        zip_code = COALESCE(%s, zip_code),
-                        order_total = COALESCE(%s, order_total),
-                        comments = COALESCE(%s, comments),
-                        warehouse_1 = COALESCE(%s, warehouse_1),
-                        warehouse_2 = COALESCE(%s, warehouse_2),
-                        updated_at = NOW()
-                    WHERE order_id = %s
-                """, (
-                    parsed['customer_name'],
-                    parsed['company_name'],
-                    parsed['email'],
-                    parsed['phone'],
-                    parsed['street'],
-                    parsed['city'],
-                    parsed['state'],
-                    parsed['zip_code'],
-                    parsed['order_total'],
-                    parsed['comments'],
-                    warehouses[0] if len(warehouses) > 0 else None,
-                    warehouses[1] if len(warehouses) > 1 else None,
-                    parsed['order_id']
-                ))
-                
-                return ParseEmailResponse(
-                    status="updated",
-                    order_id=parsed['order_id'],
-                    parsed_data=parsed,
-                    warehouses=warehouses,
-                    message="Order updated"
-                )
-            else:
-                # Create new order
-                order_date = request.email_date or datetime.now(timezone.utc).isoformat()
-                
-                # Check if trusted customer
-                trusted = is_trusted_customer(conn, parsed['customer_name'] or '', parsed['company_name'] or '')
-                
-                cur.execute("""
-                    INSERT INTO orders (
-                        order_id, customer_name, company_name, email, phone,
-                        street, city, state, zip_code,
-                        order_date, order_total, comments,
-                        warehouse_1, warehouse_2, email_thread_id,
-                        is_trusted_customer
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    parsed['order_id'],
-                    parsed['customer_name'],
-                    parsed['company_name'],
-                    parsed['email'],
-                    parsed['phone'],
-                    parsed['street'],
-                    parsed['city'],
-                    parsed['state'],
-                    parsed['zip_code'],
-                    order_date,
-                    parsed['order_total'],
-                    parsed['comments'],
-                    warehouses[0] if len(warehouses) > 0 else None,
-                    warehouses[1] if len(warehouses) > 1 else None,
-                    request.email_thread_id,
-                    trusted
-                ))
-                
-                # Log event
-                cur.execute("""
-                    INSERT INTO order_events (order_id, event_type, event_data, source)
-                    VALUES (%s, 'order_created', %s, 'email_parse')
-                """, (parsed['order_id'], json.dumps(parsed)))
-                
-                return ParseEmailResponse(
-                    status="created",
-                    order_id=parsed['order_id'],
-                    parsed_data=parsed,
-                    warehouses=warehouses,
-                    message="Order created"
-                )
+            execute_prepared(cur, 'upsert_order_from_email', _UPSERT_ORDER_FROM_EMAIL, (
+                [p.upper() for p in parsed.get('sku_prefixes', [])],
+                parsed['order_id'],
+                parsed['customer_name'],
+                parsed['company_name'],
+                parsed['email'],
+                parsed['phone'],
+                parsed['street'],
+                parsed['city'],
+                parsed['state'],
+                parsed['zip_code'],
+                order_date,
+                parsed['order_total'],
+                parsed['comments'],
+                request.email_thread_id,
+                parsed['customer_name'] or '',
+                parsed['company_name'] or '',
+                Json(parsed),
+            ))
+            row = cur.fetchone()
+    
+    warehouses = row['warehouses'] or []
+    if row['inserted']:
+        return ParseEmailResponse(
+            status="created",
+            order_id=parsed['order_id'],
+            parsed_data=parsed,
+            warehouses=warehouses,
+            message="Order created"
+        )
+    return ParseEmailResponse(
+        status="updated",
+        order_id=parsed['order_id'],
+        parsed_data=parsed,
+        warehouses=warehouses,
+        message="Order updated"
+    )
 
 # =============================================================================
 # PAYMENT DETECTION ENDPOINTS
 # =============================================================================
 
+# Square link / notification patterns: SQUARE_LINK_RE, PAYMENT_AMOUNT_RE,
+# PAYMENT_NAME_RE (detection.py)
+
 @app.post("/detect-payment-link")
 def detect_payment_link(order_id: str, email_body: str):
     """Detect if email contains Square payment link"""
-    if 'square.link' in email_body.lower():
+    if SQUARE_LINK_RE.search(email_body):
         with get_db() as conn:
             with conn.cursor() as cur:
+                # Mark sent and log the event in one statement; no row means already marked
                 cur.execute("""
-                    UPDATE orders SET 
-                        payment_link_sent = TRUE,
-                        payment_link_sent_at = NOW(),
-                        updated_at = NOW()
-                    WHERE order_id = %s AND NOT payment_link_sent
+                    WITH u AS (
+                        UPDATE orders SET 
+                            payment_link_sent = TRUE,
+                            payment_link_sent_at = NOW(),
+                            updated_at = NOW()
+                        WHERE order_id = %s AND NOT payment_link_sent
+                        RETURNING order_id
+                    )
+                    INSERT INTO order_events (order_id, event_type, source)
+                    SELECT order_id, 'payment_link_sent', 'email_detection' FROM u
+                    RETURNING order_id
                 """, (order_id,))
                 
-                if cur.rowcount > 0:
-                    cur.execute("""
-                        INSERT INTO order_events (order_id, event_type, source)
-                        VALUES (%s, 'payment_link_sent', 'email_detection')
-                    """, (order_id,))
+                if cur.fetchone():
                     return {"status": "ok", "updated": True}
         
         return {"status": "ok", "updated": False, "message": "Already marked"}
@@ -1542,76 +1702,55 @@ def detect_payment_received(email_subject: str, email_body: str):
     Subject format: "$4,913.99 payment received from Dylan Gentry"
     """
     # Extract amount from subject
-    amount_match = re.search(r'\$([\d,]+\.?\d*)\s+payment received', email_subject, re.IGNORECASE)
+    amount_match = PAYMENT_AMOUNT_RE.search(email_subject)
     if not amount_match:
         return {"status": "ok", "updated": False, "message": "Not a payment notification"}
     
     payment_amount = float(amount_match.group(1).replace(',', ''))
     
     # Extract customer name
-    name_match = re.search(r'payment received from (.+)$', email_subject, re.IGNORECASE)
+    name_match = PAYMENT_NAME_RE.search(email_subject)
     customer_name = name_match.group(1).strip() if name_match else None
     
-    # Try to match to an order
+    # Match (UNPAID_ORDER_MATCH_SQL), mark paid and log the event in one statement
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # First try exact amount match on unpaid orders
-            cur.execute("""
-                SELECT order_id, order_total, customer_name 
-                FROM orders 
-                WHERE NOT payment_received 
-                AND order_total IS NOT NULL
-                ORDER BY order_date DESC
-                LIMIT 50
-            """)
-            orders = cur.fetchall()
-            
-            matched_order = None
-            
-            # Try to match by amount (payment should be >= order total)
-            for order in orders:
-                if order['order_total'] and payment_amount >= float(order['order_total']):
-                    # Could be this order - check name similarity if we have it
-                    if customer_name and order['customer_name']:
-                        # Simple check - first name match
-                        pay_first = customer_name.split()[0].lower()
-                        order_first = order['customer_name'].split()[0].lower()
-                        if pay_first == order_first:
-                            matched_order = order
-                            break
-                    elif not matched_order:
-                        # Take first amount match if no name match
-                        matched_order = order
-            
-            if matched_order:
-                order_total = float(matched_order['order_total']) if matched_order['order_total'] else 0
-                shipping_cost = payment_amount - order_total if order_total else None
-                
-                cur.execute("""
-                    UPDATE orders SET 
+            cur.execute(f"""
+                WITH m AS ({UNPAID_ORDER_MATCH_SQL}
+                    FOR UPDATE
+                ),
+                upd AS (
+                    UPDATE orders o SET 
                         payment_received = TRUE,
                         payment_received_at = NOW(),
-                        payment_amount = %s,
-                        shipping_cost = %s,
+                        payment_amount = %(amount)s,
+                        shipping_cost = %(amount)s - NULLIF(m.order_total, 0),
                         updated_at = NOW()
-                    WHERE order_id = %s
-                """, (payment_amount, shipping_cost, matched_order['order_id']))
-                
-                cur.execute("""
+                    FROM m
+                    WHERE o.order_id = m.order_id
+                    RETURNING o.order_id, o.shipping_cost
+                ),
+                ev AS (
                     INSERT INTO order_events (order_id, event_type, event_data, source)
-                    VALUES (%s, 'payment_received', %s, 'square_notification')
-                """, (matched_order['order_id'], json.dumps({
-                    'payment_amount': payment_amount,
-                    'shipping_cost': shipping_cost,
-                    'customer_name': customer_name
-                })))
-                
+                    SELECT order_id, 'payment_received', jsonb_build_object(
+                        'payment_amount', %(amount)s,
+                        'shipping_cost', shipping_cost,
+                        'customer_name', %(customer_name)s::text
+                    ), 'square_notification'
+                    FROM upd
+                )
+                SELECT order_id, shipping_cost FROM upd
+            """, {'amount': payment_amount, 'pay_first': payment_first_name(customer_name),
+                  'customer_name': customer_name})
+            matched_order = cur.fetchone()
+            
+            if matched_order:
                 return {
                     "status": "ok",
                     "updated": True,
                     "order_id": matched_order['order_id'],
                     "payment_amount": payment_amount,
-                    "shipping_cost": shipping_cost
+                    "shipping_cost": matched_order['shipping_cost']
                 }
             
             return {
@@ -1626,120 +1765,209 @@ def detect_payment_received(email_subject: str, email_body: str):
 # ORDER CRUD
 # =============================================================================
 
+# Rows fetched per round trip when streaming list responses
+STREAM_BATCH_SIZE = 500
+
+def _json_default(value):
+    """json.dumps fallback matching how FastAPI encodes DB values (NUMERIC is already float)"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+def dumps_json(obj) -> bytes:
+    """Encode obj as JSON bytes, with orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, default=_json_default).encode()
+
+def json_response(obj) -> Response:
+    """
+    Return obj as an already-encoded JSON response. FastAPI passes Response objects
+    straight through, skipping the jsonable_encoder walk it does on returned dicts.
+    """
+    return Response(dumps_json(obj), media_type="application/json")
+
+def cached_json_response(request: Request, blob: bytes, max_age: Optional[int] = None) -> Response:
+    """
+    Serve a JSON body with an ETag hashed from its bytes, or an empty 304 when the
+    client's If-None-Match already names it. max_age adds a Cache-Control header.
+    """
+    headers = {"ETag": f'"{hashlib.md5(blob).hexdigest()}"'}
+    if max_age is not None:
+        headers["Cache-Control"] = f"max-age={max_age}"
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(blob, media_type="application/json", headers=headers)
+
+def _rows_json_chunks(key: str, query: str, params: list):
+    """JSON body chunks for stream_rows_json; the first yield comes after the first fetch"""
+    with get_db() as conn:
+        with conn.cursor(name=f"stream_{key}", cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, params)
+            rows = cur.fetchmany(STREAM_BATCH_SIZE)
+            if len(rows) == STREAM_BATCH_SIZE:
+                # More batches to come: stream them while holding the connection
+                yield f'{{"status": "ok", "{key}": ['.encode() + b','.join(dumps_json(row) for row in rows)
+                count = len(rows)
+                while True:
+                    rows = cur.fetchmany(STREAM_BATCH_SIZE)
+                    if not rows:
+                        break
+                    yield b',' + b','.join(dumps_json(row) for row in rows)
+                    count += len(rows)
+                yield f'], "count": {count}}}'.encode()
+                return
+    
+    # The whole result fit in one batch; the connection is already back in the pool
+    yield (f'{{"status": "ok", "{key}": ['.encode() + b','.join(dumps_json(row) for row in rows)
+           + f'], "count": {len(rows)}}}'.encode())
+
+def stream_rows_json(key: str, query: str, params: list) -> Iterator[bytes]:
+    """
+    {"status": "ok", <key>: [rows...], "count": n} as JSON bytes, reading the
+    query through a server-side (named) cursor STREAM_BATCH_SIZE rows at a time.
+    The query and first fetch run before this returns, so a SQL error or pool
+    timeout is a 500 rather than a truncated 200 body. A result that fits in one
+    batch releases its connection before anything is sent; larger ones stream
+    with memory held at one batch.
+    """
+    chunks = _rows_json_chunks(key, query, params)
+    try:
+        first = next(chunks)
+    except Exception as e:
+        print(f"[STREAM] {key} query failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Could not load {key}")
+    return itertools.chain([first], chunks)
+
+def _order_status_columns(alias: str) -> str:
+    """
+    current_status / days_open computed from the live orders row <alias>, with the
+    same expressions as the order_status materialized view. That view is refreshed
+    asynchronously, so reads that return order rows compute these inline; it is only
+    used where a status filter or aggregate needs its index.
+    """
+    return f"""
+           CASE
+               WHEN {alias}.is_complete THEN 'complete'
+               WHEN {alias}.bol_sent AND NOT {alias}.is_complete THEN 'awaiting_shipment'
+               WHEN {alias}.warehouse_confirmed AND NOT {alias}.bol_sent THEN 'needs_bol'
+               WHEN {alias}.sent_to_warehouse AND NOT {alias}.warehouse_confirmed THEN 'awaiting_warehouse'
+               WHEN {alias}.payment_received AND NOT {alias}.sent_to_warehouse THEN 'needs_warehouse_order'
+               WHEN {alias}.payment_link_sent AND NOT {alias}.payment_received THEN 'awaiting_payment'
+               ELSE 'needs_payment_link'
+           END AS current_status,
+           EXTRACT(DAY FROM NOW() - {alias}.order_date)::INTEGER AS days_open"""
+
 @app.get("/orders")
 def list_orders(
+    request: Request,
     status: Optional[str] = None,
     include_complete: bool = False,
     limit: int = 200
 ):
-    """List orders with optional filters, including shipments"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            query = """
-                SELECT o.*, s.current_status, s.days_open
-                FROM orders o
-                JOIN order_status s ON o.order_id = s.order_id
-                WHERE 1=1
-            """
-            params = []
-            
-            if not include_complete:
-                query += " AND NOT o.is_complete"
-            
-            if status:
-                query += " AND s.current_status = %s"
-                params.append(status)
-            
-            query += " ORDER BY o.order_date DESC LIMIT %s"
-            params.append(limit)
-            
-            cur.execute(query, params)
-            orders = cur.fetchall()
-            
-            # Get shipments for all orders
-            order_ids = [o['order_id'] for o in orders]
-            shipments_by_order = {}
-            if order_ids:
-                cur.execute("""
-                    SELECT * FROM order_shipments 
-                    WHERE order_id = ANY(%s)
-                    ORDER BY warehouse
-                """, (order_ids,))
-                for ship in cur.fetchall():
-                    oid = ship['order_id']
-                    if oid not in shipments_by_order:
-                        shipments_by_order[oid] = []
-                    # Convert decimals
-                    if ship.get('weight'):
-                        ship['weight'] = float(ship['weight'])
-                    shipments_by_order[oid].append(dict(ship))
-            
-            # Convert decimals to floats for JSON and attach shipments
-            for order in orders:
-                for key in ['order_total', 'payment_amount', 'shipping_cost']:
-                    if order.get(key):
-                        order[key] = float(order[key])
-                order['shipments'] = shipments_by_order.get(order['order_id'], [])
-            
-            return {"status": "ok", "count": len(orders), "orders": orders}
+    """List orders with optional filters, including shipments (streamed, cached briefly)"""
+    cache_key = orders_list_cache_key(status, include_complete, limit)
+    blob = cache_get(cache_key)
+    if blob is not None:
+        return cached_json_response(request, blob)
+    
+    # Shipments come back pre-grouped as JSON, so one query covers the whole response
+    shipments = """
+        COALESCE((
+            SELECT json_agg(sh ORDER BY sh.warehouse)
+            FROM order_shipments sh
+            WHERE sh.order_id = o.order_id
+        ), '[]') AS shipments
+    """
+    if status is None:
+        # Newest orders first (idx_orders_open_date / idx_orders_date), with
+        # status computed from each row so new orders show up immediately
+        query = f"""
+            SELECT o.*, {_order_status_columns('o')}, {shipments}
+            FROM orders o
+            WHERE (%s OR NOT o.is_complete)
+            ORDER BY o.order_date DESC
+            LIMIT %s
+        """
+        params = [include_complete, limit]
+    else:
+        # The status filter has to apply before the LIMIT, so it uses the indexed
+        # order_status view; the returned status is still computed from the live row
+        query = f"""
+            SELECT o.*, {_order_status_columns('o')}, {shipments}
+            FROM orders o
+            JOIN order_status s ON o.order_id = s.order_id
+            WHERE (%s OR NOT o.is_complete)
+              AND s.current_status = %s
+            ORDER BY o.order_date DESC
+            LIMIT %s
+        """
+        params = [include_complete, status, limit]
+    return StreamingResponse(
+        cache_stream(cache_key, ORDERS_LIST_CACHE_SECONDS, stream_rows_json("orders", query, params)),
+        media_type="application/json"
+    )
+
+# Hot single-order reads, prepared once per pooled connection (see execute_prepared)
+_GET_ORDER = f"""(varchar) AS
+    SELECT o.*, {_order_status_columns('o')}
+    FROM orders o
+    WHERE o.order_id = $1
+"""
+_GET_ORDER_SHIPMENTS = """(varchar) AS
+    SELECT * FROM order_shipments 
+    WHERE order_id = $1 
+    ORDER BY warehouse
+"""
 
 @app.get("/orders/{order_id}")
-def get_order(order_id: str):
-    """Get single order details"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT o.*, s.current_status, s.days_open
-                FROM orders o
-                JOIN order_status s ON o.order_id = s.order_id
-                WHERE o.order_id = %s
-            """, (order_id,))
-            order = cur.fetchone()
-            
-            if not order:
-                raise HTTPException(status_code=404, detail="Order not found")
-            
-            # Convert decimals
-            for key in ['order_total', 'payment_amount', 'shipping_cost']:
-                if order.get(key):
-                    order[key] = float(order[key])
-            
-            return {"status": "ok", "order": order}
+def get_order(order_id: str, request: Request):
+    """Get single order details (read-through cached)"""
+    cache_key = order_cache_key(order_id)
+    blob = cache_get(cache_key)
+    if blob is None:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                execute_prepared(cur, 'get_order', _GET_ORDER, (order_id,))
+                order = cur.fetchone()
+        
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        
+        blob = dumps_json({"status": "ok", "order": order})
+        cache_set(cache_key, blob, ORDER_CACHE_SECONDS)
+    
+    return cached_json_response(request, blob)
 
-@app.post("/orders/{order_id}/generate-summary")
-def generate_summary_endpoint(order_id: str, force: bool = False):
-    """
-    Generate SHORT AI summary for order card display.
-    If force=False and summary exists and is less than 1 hour old, returns cached.
-    """
+def _load_fresh_summary(order_id: str) -> Optional[dict]:
+    """Summary saved in Postgres within the hour, or None; 404s if the order doesn't exist"""
     with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Check for existing recent summary
+        with conn.cursor() as cur:
             cur.execute("""
                 SELECT ai_summary, ai_summary_updated_at 
                 FROM orders 
                 WHERE order_id = %s
             """, (order_id,))
-            order = cur.fetchone()
-            
-            if not order:
-                raise HTTPException(status_code=404, detail="Order not found")
-            
-            # Return cached if recent and not forcing refresh
-            if not force and order.get('ai_summary') and order.get('ai_summary_updated_at'):
-                age = datetime.now(timezone.utc) - order['ai_summary_updated_at']
-                if age < timedelta(hours=1):
-                    return {
-                        "status": "ok", 
-                        "summary": order['ai_summary'],
-                        "cached": True,
-                        "updated_at": order['ai_summary_updated_at'].isoformat()
-                    }
-    
-    # Generate new SHORT summary
+            row = cur.fetchone()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    ai_summary, updated_at = row
+    if ai_summary and updated_at:
+        age = datetime.now(timezone.utc) - updated_at
+        if age < timedelta(hours=1):
+            cached = {"summary": ai_summary, "updated_at": updated_at.isoformat()}
+            # Keep it in the cache for the rest of the hour
+            cache_set(summary_cache_key(order_id), dumps_json(cached),
+                      max(1, SUMMARY_CACHE_SECONDS - int(age.total_seconds())))
+            return cached
+    return None
+
+def _generate_and_save_summary(order_id: str) -> dict:
+    """Call the AI, then save the summary with a single UPDATE (no connection is held during the call)"""
     summary = generate_order_summary(order_id)
     
-    # Save to database
     with get_db() as conn:
         with conn.cursor() as cur:
             cur.execute("""
@@ -1747,13 +1975,35 @@ def generate_summary_endpoint(order_id: str, force: bool = False):
                 SET ai_summary = %s, ai_summary_updated_at = NOW(), updated_at = NOW()
                 WHERE order_id = %s
             """, (summary, order_id))
+            if cur.rowcount == 0:
+                raise HTTPException(status_code=404, detail="Order not found")
+    invalidate_order_cache(order_id)
     
-    return {
-        "status": "ok",
-        "summary": summary,
-        "cached": False,
-        "updated_at": datetime.now(timezone.utc).isoformat()
-    }
+    fresh = {"summary": summary, "updated_at": datetime.now(timezone.utc).isoformat()}
+    cache_set(summary_cache_key(order_id), dumps_json(fresh), SUMMARY_CACHE_SECONDS)
+    return fresh
+
+@app.post("/orders/{order_id}/generate-summary")
+async def generate_summary_endpoint(order_id: str, force: bool = False):
+    """
+    Generate SHORT AI summary for order card display.
+    If force=False and summary exists and is less than 1 hour old, returns cached.
+    """
+    if not force:
+        # Hot path: a summary generated within the hour never touches Postgres
+        blob = cache_get(summary_cache_key(order_id))
+        if blob is not None:
+            return {"status": "ok", "cached": True, **(orjson.loads(blob) if ORJSON_AVAILABLE else json.loads(blob))}
+        
+        # A cache miss (restart, eviction, flush) falls back to the summary saved in
+        # Postgres before paying for a new one; this also 404s unknown orders
+        cached = await run_in_threadpool(_load_fresh_summary, order_id)
+        if cached is not None:
+            return {"status": "ok", "cached": True, **cached}
+    
+    # Generate new SHORT summary off the event loop
+    fresh = await run_in_threadpool(_generate_and_save_summary, order_id)
+    return {"status": "ok", "cached": False, **fresh}
 
 
 @app.post("/orders/{order_id}/comprehensive-summary")
@@ -1791,26 +2041,28 @@ def add_email_snippet(
     snippet_type: str = "general"
 ):
     """Add an email snippet for an order (called by Google Script)"""
+    # Parse date
+    parsed_date = None
+    if email_date:
+        try:
+            parsed_date = datetime.fromisoformat(email_date.replace('Z', '+00:00'))
+        except:
+            parsed_date = datetime.now(timezone.utc)
+    else:
+        parsed_date = datetime.now(timezone.utc)
+    
+    # Queued snippets can't report errors back, so unknown orders are refused up front
+    # and the Google Script can retry once the order has synced
     with get_db() as conn:
         with conn.cursor() as cur:
-            # Parse date
-            parsed_date = None
-            if email_date:
-                try:
-                    parsed_date = datetime.fromisoformat(email_date.replace('Z', '+00:00'))
-                except:
-                    parsed_date = datetime.now(timezone.utc)
-            else:
-                parsed_date = datetime.now(timezone.utc)
-            
-            cur.execute("""
-                INSERT INTO order_email_snippets 
-                (order_id, email_from, email_subject, email_snippet, email_date, snippet_type)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT DO NOTHING
-            """, (order_id, email_from, email_subject, email_snippet[:1000], parsed_date, snippet_type))
+            cur.execute("SELECT 1 FROM orders WHERE order_id = %s", (order_id,))
+            if not cur.fetchone():
+                raise HTTPException(status_code=404, detail="Order not found")
     
-    return {"status": "ok", "message": "Email snippet added"}
+    # Written in the next batch by the snippet writer thread
+    enqueue_snippet(order_id, email_from, email_subject, email_snippet[:1000], parsed_date, snippet_type)
+    
+    return {"status": "ok", "message": "Email snippet queued"}
 
 @app.get("/orders/{order_id}/supplier-sheet-data")
 def get_supplier_sheet_data(order_id: str):
@@ -1820,20 +2072,33 @@ def get_supplier_sheet_data(order_id: str):
     """
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get order details
+            # Order plus its line items grouped by warehouse (in first-seen order), in one query
             cur.execute("""
-                SELECT * FROM orders WHERE order_id = %s
+                SELECT o.customer_name, o.company_name, o.street, o.street2, o.city,
+                       o.state, o.zip_code, o.phone, o.email, o.comments,
+                       COALESCE((
+                           SELECT json_agg(json_build_object('warehouse', g.warehouse, 'items', g.items)
+                                           ORDER BY g.first_id)
+                           FROM (
+                               SELECT COALESCE(NULLIF(li.warehouse, ''), 'Unknown') AS warehouse,
+                                      MIN(li.id) AS first_id,
+                                      json_agg(json_build_object(
+                                          'quantity', COALESCE(NULLIF(li.quantity, 0), 1),
+                                          'product_code', COALESCE(li.sku, ''),
+                                          'product_name', COALESCE(li.product_name, '')
+                                      ) ORDER BY li.id) AS items
+                               FROM order_line_items li
+                               WHERE li.order_id = o.order_id
+                               GROUP BY 1
+                           ) g
+                       ), '[]') AS warehouses
+                FROM orders o
+                WHERE o.order_id = %s
             """, (order_id,))
             order = cur.fetchone()
             
             if not order:
                 raise HTTPException(status_code=404, detail="Order not found")
-            
-            # Get line items
-            cur.execute("""
-                SELECT * FROM order_line_items WHERE order_id = %s
-            """, (order_id,))
-            line_items = cur.fetchall()
     
     # Build customer info
     customer_name = order.get('customer_name') or ''
@@ -1858,31 +2123,23 @@ def get_supplier_sheet_data(order_id: str):
     
     comments = order.get('comments') or ''
     
-    # Group items by warehouse
+    # Attach supplier info to each warehouse group
     warehouses = {}
-    for item in line_items:
-        wh = item.get('warehouse') or 'Unknown'
-        if wh not in warehouses:
-            # Get supplier info
-            supplier_info = SUPPLIER_INFO.get(wh, {
-                'name': wh,
-                'address': '',
-                'contact': '',
-                'email': ''
-            })
-            warehouses[wh] = {
-                'supplier_name': supplier_info['name'],
-                'supplier_address': supplier_info['address'],
-                'supplier_contact': supplier_info['contact'],
-                'supplier_email': supplier_info['email'],
-                'items': []
-            }
-        
-        warehouses[wh]['items'].append({
-            'quantity': item.get('quantity') or 1,
-            'product_code': item.get('sku') or '',
-            'product_name': item.get('product_name') or ''
+    for group in order['warehouses']:
+        wh = group['warehouse']
+        supplier_info = SUPPLIER_INFO.get(wh, {
+            'name': wh,
+            'address': '',
+            'contact': '',
+            'email': ''
         })
+        warehouses[wh] = {
+            'supplier_name': supplier_info['name'],
+            'supplier_address': supplier_info['address'],
+            'supplier_contact': supplier_info['contact'],
+            'supplier_email': supplier_info['email'],
+            'items': group['items']
+        }
     
     return {
         "status": "ok",
@@ -1895,33 +2152,40 @@ def get_supplier_sheet_data(order_id: str):
         "warehouses": warehouses
     }
 
+# Status columns for a just-updated orders row "u"
+_UPDATED_ORDER_SELECT = f"""
+    SELECT u.*, {_order_status_columns('u')}
+    FROM u
+"""
+
+@functools.lru_cache(maxsize=256)
+def _update_order_statement(fields: tuple) -> sql.Composed:
+    """UPDATE orders statement for one set of OrderUpdate fields (identifiers quoted by psycopg2)"""
+    return sql.SQL(
+        "WITH u AS (UPDATE orders SET {assigns}, updated_at = NOW() WHERE order_id = %s RETURNING *)"
+    ).format(
+        assigns=sql.SQL(', ').join(
+            sql.SQL("{} = %s").format(sql.Identifier(field)) for field in fields
+        )
+    ) + sql.SQL(_UPDATED_ORDER_SELECT)
+
 @app.patch("/orders/{order_id}")
 def update_order(order_id: str, update: OrderUpdate):
-    """Update order fields"""
+    """Update order fields (fields sent as null are cleared); returns the updated order"""
+    data = update.dict(exclude_unset=True)
+    if not data:
+        raise HTTPException(status_code=400, detail="No fields to update")
+    
     with get_db() as conn:
-        with conn.cursor() as cur:
-            # Build dynamic update
-            fields = []
-            values = []
-            
-            for field, value in update.dict(exclude_unset=True).items():
-                if value is not None:
-                    fields.append(f"{field} = %s")
-                    values.append(value)
-            
-            if not fields:
-                raise HTTPException(status_code=400, detail="No fields to update")
-            
-            fields.append("updated_at = NOW()")
-            values.append(order_id)
-            
-            query = f"UPDATE orders SET {', '.join(fields)} WHERE order_id = %s"
-            cur.execute(query, values)
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(_update_order_statement(tuple(data)), [*data.values(), order_id])
+            order = cur.fetchone()
             
-            if cur.rowcount == 0:
+            if not order:
                 raise HTTPException(status_code=404, detail="Order not found")
-            
-            return {"status": "ok", "message": "Order updated"}
+    invalidate_order_cache(order_id)
+    
+    return {"status": "ok", "message": "Order updated", "order": order}
 
 @app.patch("/orders/{order_id}/checkpoint")
 def update_checkpoint(order_id: str, update: CheckpointUpdate):
@@ -1934,47 +2198,52 @@ def update_checkpoint(order_id: str, update: CheckpointUpdate):
     if update.checkpoint not in valid_checkpoints:
         raise HTTPException(status_code=400, detail=f"Invalid checkpoint. Must be one of: {valid_checkpoints}")
     
+    timestamp_field = f"{update.checkpoint}_at" if update.checkpoint != 'is_complete' else 'completed_at'
+    set_parts = [f"{update.checkpoint} = TRUE", f"{timestamp_field} = NOW()", "updated_at = NOW()"]
+    
+    # Handle payment amount if provided; shipping is what was paid over the order total
+    if update.checkpoint == 'payment_received' and update.payment_amount:
+        set_parts.append("payment_amount = %(payment_amount)s")
+        set_parts.append("""shipping_cost = CASE WHEN order_total <> 0
+                            THEN %(payment_amount)s - order_total ELSE shipping_cost END""")
+    
     with get_db() as conn:
         with conn.cursor() as cur:
-            timestamp_field = f"{update.checkpoint}_at" if update.checkpoint != 'is_complete' else 'completed_at'
-            
-            # Build update query
-            set_parts = [f"{update.checkpoint} = TRUE", f"{timestamp_field} = NOW()", "updated_at = NOW()"]
-            params = []
-            
-            # Handle payment amount if provided
-            if update.checkpoint == 'payment_received' and update.payment_amount:
-                set_parts.append("payment_amount = %s")
-                params.append(update.payment_amount)
-                
-                # Calculate shipping cost
-                cur.execute("SELECT order_total FROM orders WHERE order_id = %s", (order_id,))
-                row = cur.fetchone()
-                if row and row[0]:
-                    shipping = update.payment_amount - float(row[0])
-                    set_parts.append("shipping_cost = %s")
-                    params.append(shipping)
-            
-            params.append(order_id)
-            
-            query = f"UPDATE orders SET {', '.join(set_parts)} WHERE order_id = %s"
-            cur.execute(query, params)
-            
-            if cur.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Order not found")
-            
-            # Log event
-            cur.execute("""
+            # Update and log the event in one statement; no row back means no such order
+            cur.execute(f"""
+                WITH u AS (
+                    UPDATE orders SET {', '.join(set_parts)}
+                    WHERE order_id = %(order_id)s
+                    RETURNING order_id
+                )
                 INSERT INTO order_events (order_id, event_type, event_data, source)
-                VALUES (%s, %s, %s, %s)
-            """, (
-                order_id,
-                update.checkpoint,
-                json.dumps({'payment_amount': update.payment_amount} if update.payment_amount else {}),
-                update.source
-            ))
+                SELECT order_id, %(event_type)s, %(event_data)s::jsonb, %(source)s FROM u
+                RETURNING order_id
+            """, {
+                'order_id': order_id,
+                'payment_amount': update.payment_amount,
+                'event_type': update.checkpoint,
+                'event_data': Json({'payment_amount': update.payment_amount} if update.payment_amount else {}),
+                'source': update.source
+            })
             
-            return {"status": "ok", "checkpoint": update.checkpoint}
+            if cur.fetchone() is None:
+                raise HTTPException(status_code=404, detail="Order not found")
+    invalidate_order_cache(order_id)
+    
+    return {"status": "ok", "checkpoint": update.checkpoint}
+
+# Checkpoint values for each status, in the order of the set-status UPDATE:
+# (payment_link_sent, payment_received, sent_to_warehouse, warehouse_confirmed, bol_sent, is_complete)
+STATUS_TUPLES = {
+    'needs_payment_link':    (False, False, False, False, False, False),
+    'awaiting_payment':      (True, False, False, False, False, False),
+    'needs_warehouse_order': (True, True, False, False, False, False),
+    'awaiting_warehouse':    (True, True, True, False, False, False),
+    'needs_bol':             (True, True, True, True, False, False),
+    'awaiting_shipment':     (True, True, True, True, True, False),
+    'complete':              (True, True, True, True, True, True),
+}
 
 @app.patch("/orders/{order_id}/set-status")
 def set_order_status(order_id: str, status: str, source: str = "web_ui"):
@@ -1982,268 +2251,129 @@ def set_order_status(order_id: str, status: str, source: str = "web_ui"):
     Set order to a specific status by resetting all checkpoints and setting appropriate ones.
     This allows moving orders backwards in the workflow.
     """
-    # Map status to which checkpoints should be TRUE
-    status_checkpoints = {
-        'needs_payment_link': {},  # All false
-        'awaiting_payment': {'payment_link_sent': True},
-        'needs_warehouse_order': {'payment_link_sent': True, 'payment_received': True},
-        'awaiting_warehouse': {'payment_link_sent': True, 'payment_received': True, 'sent_to_warehouse': True},
-        'needs_bol': {'payment_link_sent': True, 'payment_received': True, 'sent_to_warehouse': True, 'warehouse_confirmed': True},
-        'awaiting_shipment': {'payment_link_sent': True, 'payment_received': True, 'sent_to_warehouse': True, 'warehouse_confirmed': True, 'bol_sent': True},
-        'complete': {'payment_link_sent': True, 'payment_received': True, 'sent_to_warehouse': True, 'warehouse_confirmed': True, 'bol_sent': True, 'is_complete': True}
-    }
-    
-    if status not in status_checkpoints:
+    if status not in STATUS_TUPLES:
         raise HTTPException(status_code=400, detail=f"Invalid status: {status}")
     
-    checkpoints = status_checkpoints[status]
-    
     with get_db() as conn:
-        with conn.cursor() as cur:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
             # Reset all checkpoints first, then set the ones we need
             cur.execute("""
-                UPDATE orders SET
-                    payment_link_sent = %s,
-                    payment_received = %s,
-                    sent_to_warehouse = %s,
-                    warehouse_confirmed = %s,
-                    bol_sent = %s,
-                    is_complete = %s,
-                    updated_at = NOW()
-                WHERE order_id = %s
-            """, (
-                checkpoints.get('payment_link_sent', False),
-                checkpoints.get('payment_received', False),
-                checkpoints.get('sent_to_warehouse', False),
-                checkpoints.get('warehouse_confirmed', False),
-                checkpoints.get('bol_sent', False),
-                checkpoints.get('is_complete', False),
-                order_id
-            ))
+                WITH u AS (
+                    UPDATE orders SET
+                        payment_link_sent = %s,
+                        payment_received = %s,
+                        sent_to_warehouse = %s,
+                        warehouse_confirmed = %s,
+                        bol_sent = %s,
+                        is_complete = %s,
+                        updated_at = NOW()
+                    WHERE order_id = %s
+                    RETURNING *
+                )
+            """ + _UPDATED_ORDER_SELECT, STATUS_TUPLES[status] + (order_id,))
+            order = cur.fetchone()
             
-            if cur.rowcount == 0:
+            if not order:
                 raise HTTPException(status_code=404, detail="Order not found")
             
             # Log event
             cur.execute("""
                 INSERT INTO order_events (order_id, event_type, event_data, source)
                 VALUES (%s, 'status_change', %s, %s)
-            """, (order_id, json.dumps({'new_status': status}), source))
-            
-            return {"status": "ok", "new_status": status}
+            """, (order_id, Json({'new_status': status}), source))
+    invalidate_order_cache(order_id)
+    
+    return {"status": "ok", "new_status": status, "order": order}
 
 # =============================================================================
 # SHIPMENT MANAGEMENT
 # =============================================================================
 
 @app.get("/orders/{order_id}/shipments")
-def get_order_shipments(order_id: str):
+def get_order_shipments(order_id: str, cur=Depends(get_db_cursor)):
     """Get all shipments for an order"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM order_shipments 
-                WHERE order_id = %s 
-                ORDER BY warehouse
-            """, (order_id,))
-            shipments = cur.fetchall()
-            return {"status": "ok", "shipments": shipments}
+    execute_prepared(cur, 'get_order_shipments', _GET_ORDER_SHIPMENTS, (order_id,))
+    return {"status": "ok", "shipments": cur.fetchall()}
 
 @app.get("/shipments")
 def list_all_shipments(include_complete: bool = False):
-    """List all shipments with order info"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            query = """
-                SELECT s.*, o.customer_name, o.company_name, o.order_date,
-                       o.street, o.street2, o.city, o.state, o.zip_code, o.phone,
-                       o.payment_received, o.order_total
-                FROM order_shipments s
-                JOIN orders o ON s.order_id = o.order_id
-                WHERE 1=1
-            """
-            if not include_complete:
-                query += " AND s.status != 'delivered'"
-            query += " ORDER BY o.order_date DESC, s.warehouse"
-            
-            cur.execute(query)
-            shipments = cur.fetchall()
-            
-            # Convert decimals
-            for s in shipments:
-                if s.get('order_total'):
-                    s['order_total'] = float(s['order_total'])
-                if s.get('weight'):
-                    s['weight'] = float(s['weight'])
-            
-            return {"status": "ok", "count": len(shipments), "shipments": shipments}
+    """List all shipments with order info (streamed)"""
+    query = """
+        SELECT s.*, o.customer_name, o.company_name, o.order_date,
+               o.street, o.street2, o.city, o.state, o.zip_code, o.phone,
+               o.payment_received, o.order_total
+        FROM order_shipments s
+        JOIN orders o ON s.order_id = o.order_id
+        WHERE 1=1
+    """
+    if not include_complete:
+        query += " AND s.status != 'delivered'"
+    query += " ORDER BY o.order_date DESC, s.warehouse"
+    
+    return StreamingResponse(stream_rows_json("shipments", query, []), media_type="application/json")
 
 @app.patch("/shipments/{shipment_id}")
-def update_shipment(shipment_id: str, 
-                    status: Optional[str] = None,
-                    tracking: Optional[str] = None,
-                    pro_number: Optional[str] = None,
-                    weight: Optional[float] = None,
-                    ship_method: Optional[str] = None,
-                    bol_sent: Optional[bool] = None,
-                    origin_zip: Optional[str] = None,
-                    rl_quote_number: Optional[str] = None,
-                    rl_quote_price: Optional[float] = None,
-                    rl_customer_price: Optional[float] = None,
-                    rl_invoice_amount: Optional[float] = None,
-                    has_oversized: Optional[bool] = None,
-                    li_quote_price: Optional[float] = None,
-                    li_customer_price: Optional[float] = None,
-                    actual_cost: Optional[float] = None,
-                    quote_url: Optional[str] = None,
-                    ps_quote_url: Optional[str] = None,
-                    ps_quote_price: Optional[float] = None,
-                    tracking_number: Optional[str] = None,
-                    quote_price: Optional[float] = None,
-                    customer_price: Optional[float] = None):
+def update_shipment(shipment_id: str, update: ShipmentUpdate = Depends()):
     """Update shipment fields"""
     
     valid_statuses = ['needs_order', 'at_warehouse', 'needs_bol', 'ready_ship', 'shipped', 'delivered']
-    if status and status not in valid_statuses:
+    if update.status and update.status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
     
     valid_methods = ['LTL', 'Pirateship', 'Pickup', 'BoxTruck', 'LiDelivery', None]
-    if ship_method and ship_method not in valid_methods:
+    if update.ship_method and update.ship_method not in valid_methods:
         raise HTTPException(status_code=400, detail=f"Invalid ship_method. Must be one of: {valid_methods}")
     
+    # Only the fields actually sent (column names come from the model, not the caller)
+    data = update.dict(exclude_none=True)
+    if not data:
+        return {"status": "ok", "message": "No updates provided"}
+    
+    updates = [f"{field} = %s" for field in data]
+    params = list(data.values())
+    if update.status in SHIPMENT_STATUS_TIMESTAMPS:
+        updates.append(f"{SHIPMENT_STATUS_TIMESTAMPS[update.status]} = NOW()")
+    if update.bol_sent:
+        updates.append("bol_sent_at = NOW()")
+    updates.append("updated_at = NOW()")
+    params.extend([shipment_id, shipment_id])
+    
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Build dynamic update
-            updates = []
-            params = []
-            
-            if status is not None:
-                updates.append("status = %s")
-                params.append(status)
-                # Set timestamp based on status
-                if status == 'at_warehouse':
-                    updates.append("sent_to_warehouse_at = NOW()")
-                elif status == 'needs_bol':
-                    updates.append("warehouse_confirmed_at = NOW()")
-                elif status == 'shipped':
-                    updates.append("shipped_at = NOW()")
-                elif status == 'delivered':
-                    updates.append("delivered_at = NOW()")
-            
-            if tracking is not None:
-                updates.append("tracking = %s")
-                params.append(tracking)
-            
-            if pro_number is not None:
-                updates.append("pro_number = %s")
-                params.append(pro_number)
-            
-            if weight is not None:
-                updates.append("weight = %s")
-                params.append(weight)
-            
-            if ship_method is not None:
-                updates.append("ship_method = %s")
-                params.append(ship_method)
-            
-            if bol_sent is not None:
-                updates.append("bol_sent = %s")
-                params.append(bol_sent)
-                if bol_sent:
-                    updates.append("bol_sent_at = NOW()")
-            
-            # RL Carriers fields
-            if origin_zip is not None:
-                updates.append("origin_zip = %s")
-                params.append(origin_zip)
-            
-            if rl_quote_number is not None:
-                updates.append("rl_quote_number = %s")
-                params.append(rl_quote_number)
-            
-            if rl_quote_price is not None:
-                updates.append("rl_quote_price = %s")
-                params.append(rl_quote_price)
-            
-            if rl_customer_price is not None:
-                updates.append("rl_customer_price = %s")
-                params.append(rl_customer_price)
-            
-            if rl_invoice_amount is not None:
-                updates.append("rl_invoice_amount = %s")
-                params.append(rl_invoice_amount)
-            
-            if has_oversized is not None:
-                updates.append("has_oversized = %s")
-                params.append(has_oversized)
-            
-            # Li Delivery fields
-            if li_quote_price is not None:
-                updates.append("li_quote_price = %s")
-                params.append(li_quote_price)
-            
-            if li_customer_price is not None:
-                updates.append("li_customer_price = %s")
-                params.append(li_customer_price)
-            
-            if actual_cost is not None:
-                updates.append("actual_cost = %s")
-                params.append(actual_cost)
-            
-            if quote_url is not None:
-                updates.append("quote_url = %s")
-                params.append(quote_url)
-
-            if ps_quote_url is not None:
-                updates.append("ps_quote_url = %s")
-                params.append(ps_quote_url)
-
-            if ps_quote_price is not None:
-                updates.append("ps_quote_price = %s")
-                params.append(ps_quote_price)
-            
-            if tracking_number is not None:
-                updates.append("tracking_number = %s")
-                params.append(tracking_number)
-            
-            if quote_price is not None:
-                updates.append("quote_price = %s")
-                params.append(quote_price)
-            
-            if customer_price is not None:
-                updates.append("customer_price = %s")
-                params.append(customer_price)
-            
-            if not updates:
-                return {"status": "ok", "message": "No updates provided"}
-            
-            updates.append("updated_at = NOW()")
-            params.append(shipment_id)
-            
-            query = f"UPDATE order_shipments SET {', '.join(updates)} WHERE shipment_id = %s RETURNING *"
-            cur.execute(query, params)
+            # Update the shipment and, if that leaves every shipment of the order
+            # delivered, mark the order complete - one statement. CTE parts don't see
+            # each other's writes, so the count takes this shipment's status from upd.
+            cur.execute(f"""
+                WITH upd AS (
+                    UPDATE order_shipments SET {', '.join(updates)}
+                    WHERE shipment_id = %s
+                    RETURNING *
+                ),
+                cnt AS (
+                    SELECT COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE status = 'delivered') AS delivered
+                    FROM (
+                        SELECT status FROM order_shipments
+                        WHERE order_id = (SELECT order_id FROM upd) AND shipment_id <> %s
+                        UNION ALL
+                        SELECT status FROM upd
+                    ) sh
+                ),
+                done AS (
+                    UPDATE orders SET is_complete = TRUE, completed_at = NOW(), updated_at = NOW()
+                    WHERE order_id = (SELECT order_id FROM upd)
+                      AND (SELECT total > 0 AND total = delivered FROM cnt)
+                    RETURNING order_id
+                )
+                SELECT * FROM upd
+            """, params)
             
             result = cur.fetchone()
             if not result:
                 raise HTTPException(status_code=404, detail="Shipment not found")
-            
-            # Check if all shipments for this order are delivered
-            cur.execute("""
-                SELECT COUNT(*) as total, 
-                       COUNT(*) FILTER (WHERE status = 'delivered') as delivered
-                FROM order_shipments 
-                WHERE order_id = %s
-            """, (result['order_id'],))
-            counts = cur.fetchone()
-            
-            # If all delivered, mark order complete
-            if counts['total'] > 0 and counts['total'] == counts['delivered']:
-                cur.execute("""
-                    UPDATE orders SET is_complete = TRUE, completed_at = NOW(), updated_at = NOW()
-                    WHERE order_id = %s
-                """, (result['order_id'],))
-            
-            return {"status": "ok", "shipment": dict(result)}
+    invalidate_order_cache(result['order_id'])
+    
+    return {"status": "ok", "shipment": dict(result)}
 
 # =============================================================================
 # WAREHOUSE MAPPING
@@ -2270,27 +2400,80 @@ def add_warehouse_mapping(mapping: WarehouseMappingUpdate):
                     warehouse_name = EXCLUDED.warehouse_name,
                     warehouse_code = EXCLUDED.warehouse_code
             """, (mapping.sku_prefix.upper(), mapping.warehouse_name, mapping.warehouse_code))
-            
-            return {"status": "ok", "message": "Mapping saved"}
+    
+    if EMAIL_PARSER_LOADED:
+        clear_warehouse_cache()
+    return {"status": "ok", "message": "Mapping saved"}
 
 # =============================================================================
 # STATUS SUMMARY
 # =============================================================================
 
+_WAREHOUSE_NORM_TABLE = str.maketrans('', '', ' &-')
+
+def _norm_warehouse(name: str) -> str:
+    """Warehouse name lowercased with spaces, '&' and '-' removed"""
+    return name.lower().translate(_WAREHOUSE_NORM_TABLE)
+
+# Normalized warehouse name -> origin zip, built once for the fuzzy fallback
+WAREHOUSE_ZIPS_NORM = {_norm_warehouse(name): zip_code for name, zip_code in WAREHOUSE_ZIPS.items()}
+WAREHOUSE_NAMES = list(WAREHOUSE_ZIPS)
+
+@functools.lru_cache(maxsize=512)
+def _resolve_origin_zip(warehouse: str) -> str:
+    """
+    Origin zip for a warehouse: exact name, then normalized name, then the closest
+    name by RapidFuzz (when installed), then substring match. Memoized per raw
+    warehouse string; WAREHOUSE_ZIPS only changes with a deploy.
+    """
+    origin_zip = WAREHOUSE_ZIPS.get(warehouse)
+    if origin_zip:
+        return origin_zip
+    
+    warehouse_norm = _norm_warehouse(warehouse)
+    origin_zip = WAREHOUSE_ZIPS_NORM.get(warehouse_norm)
+    if origin_zip:
+        return origin_zip
+    
+    if RAPIDFUZZ_AVAILABLE:
+        best = rapidfuzz_process.extractOne(warehouse, WAREHOUSE_NAMES, scorer=fuzz.WRatio, score_cutoff=75)
+        if best:
+            return WAREHOUSE_ZIPS[best[0]]
+    
+    for wh_norm, wh_zip in WAREHOUSE_ZIPS_NORM.items():
+        if warehouse_norm in wh_norm or wh_norm in warehouse_norm:
+            return wh_zip
+    return ''
+
+# LIKE patterns matching a product name (uppercased) that contains any oversized keyword
+OVERSIZED_PATTERNS = [f"%{keyword}%" for keyword in OVERSIZED_KEYWORDS]
+
 @app.get("/shipments/{shipment_id}/rl-quote-data")
 def get_rl_quote_data(shipment_id: str):
     """Get pre-populated data for RL Carriers quote"""
     try:
         with get_db() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Get shipment and order info
+                # Shipment, order info, this warehouse's oversized line items and the
+                # order's warehouse count in one round trip
                 cur.execute("""
                     SELECT s.*, o.customer_name, o.company_name, o.street, o.city, o.state, o.zip_code,
-                           o.phone, o.email, o.order_total, o.total_weight
+                           o.phone, o.email, o.order_total, o.total_weight,
+                           ARRAY(
+                               SELECT COALESCE(li.sku, '') || ': ' || li.product_name
+                               FROM order_line_items li
+                               WHERE li.order_id = s.order_id AND li.warehouse = s.warehouse
+                                 AND UPPER(li.product_name) LIKE ANY(%s)
+                           ) AS oversized_items,
+                           (
+                               SELECT COUNT(DISTINCT li.warehouse)
+                               FROM order_line_items li
+                               WHERE li.order_id = s.order_id AND li.warehouse IS NOT NULL
+                           ) AS warehouse_count
                     FROM order_shipments s
                     JOIN orders o ON s.order_id = o.order_id
                     WHERE s.shipment_id = %s
-                """, (shipment_id,))
+                """, (OVERSIZED_PATTERNS, shipment_id))
                 
                 shipment = cur.fetchone()
                 if not shipment:
@@ -2298,50 +2481,16 @@ def get_rl_quote_data(shipment_id: str):
                 
                 # Get warehouse zip
                 warehouse = shipment['warehouse']
-                origin_zip = WAREHOUSE_ZIPS.get(warehouse, '')
-                
-                # If warehouse not in our list, try fuzzy match
-                if not origin_zip:
-                    warehouse_lower = warehouse.lower().replace(' ', '').replace('&', '').replace('-', '')
-                    for wh_name, wh_zip in WAREHOUSE_ZIPS.items():
-                        wh_compare = wh_name.lower().replace(' ', '').replace('&', '').replace('-', '')
-                        if wh_compare == warehouse_lower or warehouse_lower in wh_compare or wh_compare in warehouse_lower:
-                            origin_zip = wh_zip
-                            break
+                origin_zip = _resolve_origin_zip(warehouse)
                 
-                # Get line items for this warehouse to check total weight and oversized
-                cur.execute("""
-                    SELECT sku, product_name, quantity
-                    FROM order_line_items
-                    WHERE order_id = %s AND warehouse = %s
-                """, (shipment['order_id'], warehouse))
-                line_items = cur.fetchall()
-                
-                # Calculate weight for this shipment's items
-                total_weight = 0
-                has_oversized = False
-                oversized_items = []
-                
-                for item in line_items:
-                    # Check for oversized keywords in product_name
-                    desc = (item.get('product_name') or '').upper()
-                    for keyword in OVERSIZED_KEYWORDS:
-                        if keyword in desc:
-                            has_oversized = True
-                            oversized_items.append(f"{item.get('sku')}: {item.get('product_name')}")
-                            break
+                oversized_items = shipment['oversized_items']
+                has_oversized = bool(oversized_items)
                 
                 # Check if single warehouse order
-                cur.execute("""
-                    SELECT COUNT(DISTINCT warehouse) as warehouse_count
-                    FROM order_line_items
-                    WHERE order_id = %s AND warehouse IS NOT NULL
-                """, (shipment['order_id'],))
-                wh_count = cur.fetchone()
-                is_single_warehouse = wh_count and wh_count['warehouse_count'] <= 1
+                is_single_warehouse = shipment['warehouse_count'] <= 1
                 
                 # Get order total weight directly from the joined query
-                order_weight = float(shipment['total_weight']) if shipment.get('total_weight') else 0
+                order_weight = shipment.get('total_weight') or 0
                 
                 # Clean ZIP code - strip to 5 digits
                 dest_zip = shipment.get('zip_code') or ''
@@ -2350,7 +2499,7 @@ def get_rl_quote_data(shipment_id: str):
                 dest_zip = dest_zip[:5]  # Take first 5 chars
                 
                 # Determine weight display
-                shipment_weight = float(shipment['weight']) if shipment.get('weight') else None
+                shipment_weight = shipment.get('weight') or None
                 needs_manual = False
                 weight_note = None
                 
@@ -2366,7 +2515,7 @@ def get_rl_quote_data(shipment_id: str):
                     needs_manual = True
                     weight_note = "No weight data available"
                 
-                return {
+                return json_response({
                     "status": "ok",
                     "shipment_id": shipment_id,
                     "order_id": shipment['order_id'],
@@ -2392,63 +2541,106 @@ def get_rl_quote_data(shipment_id: str):
                     },
                     "existing_quote": {
                         "quote_number": shipment.get('rl_quote_number'),
-                        "quote_price": float(shipment['rl_quote_price']) if shipment.get('rl_quote_price') else None,
-                        "customer_price": float(shipment['rl_customer_price']) if shipment.get('rl_customer_price') else None,
+                        "quote_price": shipment.get('rl_quote_price') or None,
+                        "customer_price": shipment.get('rl_customer_price') or None,
                         "quote_url": shipment.get('quote_url')
                     },
                     "rl_quote_url": "https://www.rlcarriers.com/freight/shipping/rate-quote"
-                }
+                })
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/orders/status/summary")
-def status_summary():
-    """Get count of orders by status"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT current_status, COUNT(*) as count
-                FROM order_status
-                GROUP BY current_status
-                ORDER BY 
-                    CASE current_status
-                        WHEN 'needs_payment_link' THEN 1
-                        WHEN 'awaiting_payment' THEN 2
-                        WHEN 'needs_warehouse_order' THEN 3
-                        WHEN 'awaiting_warehouse' THEN 4
-                        WHEN 'needs_bol' THEN 5
-                        WHEN 'awaiting_shipment' THEN 6
-                        WHEN 'complete' THEN 7
-                    END
-            """)
-            summary = cur.fetchall()
-            return {"status": "ok", "summary": summary}
+def status_summary(request: Request):
+    """Get count of orders by status (cached briefly, with ETag)"""
+    cache_key = status_summary_cache_key()
+    blob = cache_get(cache_key)
+    if blob is None:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT current_status, COUNT(*) as count
+                    FROM order_status
+                    GROUP BY current_status
+                    ORDER BY 
+                        CASE current_status
+                            WHEN 'needs_payment_link' THEN 1
+                            WHEN 'awaiting_payment' THEN 2
+                            WHEN 'needs_warehouse_order' THEN 3
+                            WHEN 'awaiting_warehouse' THEN 4
+                            WHEN 'needs_bol' THEN 5
+                            WHEN 'awaiting_shipment' THEN 6
+                            WHEN 'complete' THEN 7
+                        END
+                """)
+                summary = cur.fetchall()
+        blob = dumps_json({"status": "ok", "summary": summary})
+        cache_set(cache_key, blob, STATUS_SUMMARY_CACHE_SECONDS)
+    return cached_json_response(request, blob, STATUS_SUMMARY_CACHE_SECONDS)
+
+# Largest page the keyset-paginated endpoints (events, alerts) return
+MAX_PAGE_LIMIT = 500
+
+def next_page_cursor(rows: list, limit: int, id_key: str) -> Optional[dict]:
+    """Keyset cursor (before / before_id) for the page after rows, or None on the last page"""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return {"before": last['created_at'].isoformat(), "before_id": last[id_key]}
 
 @app.get("/orders/{order_id}/events")
-def get_order_events(order_id: str):
-    """Get event history for an order"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT * FROM order_events 
-                WHERE order_id = %s 
-                ORDER BY created_at DESC
-            """, (order_id,))
-            events = cur.fetchall()
-            return {"status": "ok", "events": events}
+def get_order_events(
+    order_id: str,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    cur=Depends(get_db_cursor)
+):
+    """Get event history for an order, newest first; pass next_cursor back for older events"""
+    # Postgres builds the events array as JSON text, so rows never become Python
+    # dicts; only the last row's keys come back separately for the cursor
+    cur.execute("""
+        SELECT COALESCE(json_agg(e ORDER BY e.created_at DESC, e.event_id DESC), '[]')::text AS events,
+               COUNT(*) AS count,
+               (array_agg(e.created_at ORDER BY e.created_at, e.event_id))[1] AS last_created_at,
+               (array_agg(e.event_id ORDER BY e.created_at, e.event_id))[1] AS last_event_id
+        FROM (
+            SELECT * FROM order_events 
+            WHERE order_id = %(order_id)s 
+              AND (%(before)s::timestamptz IS NULL
+                   OR (%(before_id)s::integer IS NULL AND created_at < %(before)s::timestamptz)
+                   OR (created_at, event_id) < (%(before)s::timestamptz, %(before_id)s::integer))
+            ORDER BY created_at DESC, event_id DESC
+            LIMIT %(limit)s
+        ) e
+    """, {'order_id': order_id, 'before': before, 'before_id': before_id, 'limit': limit})
+    page = cur.fetchone()
+    
+    next_cursor = None
+    if page['count'] >= limit:
+        next_cursor = {"before": page['last_created_at'].isoformat(), "before_id": page['last_event_id']}
+    return Response(
+        b'{"status": "ok", "events": ' + page['events'].encode()
+        + b', "next_cursor": ' + dumps_json(next_cursor) + b'}',
+        media_type="application/json"
+    )
 
 # =============================================================================
 # TRUSTED CUSTOMERS
 # =============================================================================
 
 @app.get("/trusted-customers")
-def list_trusted_customers():
-    """List all trusted customers"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM trusted_customers ORDER BY customer_name")
-            customers = cur.fetchall()
-            return {"status": "ok", "customers": customers}
+def list_trusted_customers(request: Request):
+    """List all trusted customers (cached until the list changes, with ETag)"""
+    blob = cache_get(TRUSTED_CUSTOMERS_CACHE_KEY)
+    if blob is None:
+        with get_db() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM trusted_customers ORDER BY customer_name")
+                customers = cur.fetchall()
+        blob = dumps_json({"status": "ok", "customers": customers})
+        cache_set(TRUSTED_CUSTOMERS_CACHE_KEY, blob, TRUSTED_CUSTOMERS_CACHE_SECONDS)
+    return cached_json_response(request, blob)
 
 @app.post("/trusted-customers")
 def add_trusted_customer(customer_name: str, company_name: Optional[str] = None, notes: Optional[str] = None):
@@ -2461,17 +2653,23 @@ def add_trusted_customer(customer_name: str, company_name: Optional[str] = None,
                 RETURNING id
             """, (customer_name, company_name, notes))
             new_id = cur.fetchone()[0]
-            return {"status": "ok", "id": new_id}
+    invalidate_trusted_customers()
+    cache_delete(TRUSTED_CUSTOMERS_CACHE_KEY)
+    return {"status": "ok", "id": new_id}
 
 @app.delete("/orders/{order_id}")
 def delete_order(order_id: str):
     """Delete an order and its shipments"""
     with get_db() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM order_shipments WHERE order_id = %s", (order_id,))
-            cur.execute("DELETE FROM order_line_items WHERE order_id = %s", (order_id,))
-            cur.execute("DELETE FROM orders WHERE order_id = %s", (order_id,))
-            conn.commit()
+            # One statement; the explicit child deletes cover databases whose
+            # older tables predate ON DELETE CASCADE
+            cur.execute("""
+                WITH s AS (DELETE FROM order_shipments WHERE order_id = %(order_id)s),
+                     l AS (DELETE FROM order_line_items WHERE order_id = %(order_id)s)
+                DELETE FROM orders WHERE order_id = %(order_id)s
+            """, {"order_id": order_id})
+    invalidate_order_cache(order_id)
     return {"status": "ok", "message": f"Order {order_id} deleted"}
 @app.delete("/trusted-customers/{customer_id}")
 def remove_trusted_customer(customer_id: int):
@@ -2479,39 +2677,40 @@ def remove_trusted_customer(customer_id: int):
     with get_db() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM trusted_customers WHERE id = %s", (customer_id,))
-            return {"status": "ok"}
+    invalidate_trusted_customers()
+    cache_delete(TRUSTED_CUSTOMERS_CACHE_KEY)
+    return {"status": "ok"}
 
 def is_trusted_customer(conn, customer_name: str, company_name: str = None) -> bool:
-    """Check if customer is in trusted list"""
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT 1 FROM trusted_customers 
-            WHERE LOWER(customer_name) = LOWER(%s)
-            OR (company_name IS NOT NULL AND LOWER(company_name) = LOWER(%s))
-        """, (customer_name, company_name or ''))
-        return cur.fetchone() is not None
+    """Check if customer is in trusted list (answered from the cached set; conn is unused)"""
+    return db_is_trusted_customer(customer_name, company_name)
 
 # =============================================================================
 # ALERTS
 # =============================================================================
 
 @app.get("/alerts")
-def list_alerts(include_resolved: bool = False):
-    """List order alerts"""
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            query = """
-                SELECT a.*, o.customer_name, o.company_name, o.order_total
-                FROM order_alerts a
-                JOIN orders o ON a.order_id = o.order_id
-            """
-            if not include_resolved:
-                query += " WHERE NOT a.is_resolved"
-            query += " ORDER BY a.created_at DESC"
-            
-            cur.execute(query)
-            alerts = cur.fetchall()
-            return {"status": "ok", "alerts": alerts}
+def list_alerts(
+    include_resolved: bool = False,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_LIMIT),
+    before: Optional[datetime] = None,
+    before_id: Optional[int] = None,
+    cur=Depends(get_db_cursor)
+):
+    """List order alerts, newest first; pass next_cursor back for older alerts"""
+    cur.execute("""
+        SELECT a.*, o.customer_name, o.company_name, o.order_total
+        FROM order_alerts a
+        JOIN orders o ON a.order_id = o.order_id
+        WHERE (%(include_resolved)s OR NOT a.is_resolved)
+          AND (%(before)s::timestamptz IS NULL
+               OR (%(before_id)s::integer IS NULL AND a.created_at < %(before)s::timestamptz)
+               OR (a.created_at, a.id) < (%(before)s::timestamptz, %(before_id)s::integer))
+        ORDER BY a.created_at DESC, a.id DESC
+        LIMIT %(limit)s
+    """, {'include_resolved': include_resolved, 'before': before, 'before_id': before_id, 'limit': limit})
+    alerts = cur.fetchall()
+    return json_response({"status": "ok", "alerts": alerts, "next_cursor": next_page_cursor(alerts, limit, 'id')})
 
 @app.post("/alerts")
 def create_alert(order_id: str, alert_type: str, alert_message: str):
@@ -2542,11 +2741,12 @@ def resolve_alert(alert_id: int):
 # RL QUOTE DETECTION
 # =============================================================================
 
+# Quote / PRO patterns: RL_QUOTE_RE, PRO_NUMBER_RE (detection.py)
+
 @app.post("/detect-rl-quote")
 def detect_rl_quote(order_id: str, email_body: str):
     """Detect R+L quote number from email"""
-    # Pattern: "RL Quote No: 9075654" or "Quote: 9075654" or "Quote #9075654"
-    quote_match = re.search(r'(?:RL\s+)?Quote\s*(?:No|#)?[:\s]*(\d{6,10})', email_body, re.IGNORECASE)
+    quote_match = RL_QUOTE_RE.search(email_body)
     
     if quote_match:
         quote_no = quote_match.group(1)
@@ -2560,7 +2760,7 @@ def detect_rl_quote(order_id: str, email_body: str):
                 cur.execute("""
                     INSERT INTO order_events (order_id, event_type, event_data, source)
                     VALUES (%s, 'rl_quote_captured', %s, 'email_detection')
-                """, (order_id, json.dumps({'quote_no': quote_no})))
+                """, (order_id, Json({'quote_no': quote_no})))
                 
                 return {"status": "ok", "quote_no": quote_no}
     
@@ -2569,8 +2769,7 @@ def detect_rl_quote(order_id: str, email_body: str):
 @app.post("/detect-pro-number")
 def detect_pro_number(order_id: str, email_body: str):
     """Detect R+L PRO number from email"""
-    # Pattern: "PRO 74408602-5" or "PRO# 74408602-5" or "Pro Number: 74408602-5"
-    pro_match = re.search(r'PRO\s*(?:#|Number)?[:\s]*([A-Z]{0,2}\d{8,10}(?:-\d)?)', email_body, re.IGNORECASE)
+    pro_match = PRO_NUMBER_RE.search(email_body)
     
     if pro_match:
         pro_no = pro_match.group(1).upper()
@@ -2584,7 +2783,7 @@ def detect_pro_number(order_id: str, email_body: str):
                 cur.execute("""
                     INSERT INTO order_events (order_id, event_type, event_data, source)
                     VALUES (%s, 'pro_number_captured', %s, 'email_detection')
-                """, (order_id, json.dumps({'pro_number': pro_no})))
+                """, (order_id, Json({'pro_number': pro_no})))
                 
                 return {"status": "ok", "pro_number": pro_no}
     
@@ -2600,14 +2799,15 @@ def check_payment_alerts():
     Check for trusted customers who shipped but haven't paid after 1 business day.
     Should be called periodically (e.g., daily at 9 AM).
     """
-    alerts_created = 0
-    
     with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Find orders: sent to warehouse, not paid, trusted customer, > 1 day old
+        with conn.cursor() as cur:
+            # Alert every order sent to warehouse, not paid, trusted customer, > 1 day
+            # old, that has no open alert yet - built entirely in Postgres
             cur.execute("""
-                SELECT o.order_id, o.customer_name, o.company_name, o.order_total,
-                       o.sent_to_warehouse_at
+                INSERT INTO order_alerts (order_id, alert_type, alert_message)
+                SELECT o.order_id, 'trusted_unpaid',
+                       concat('Trusted customer ', o.customer_name,
+                              ' - shipped but unpaid for 1+ day. Total: $', o.order_total)
                 FROM orders o
                 WHERE o.sent_to_warehouse = TRUE
                 AND o.payment_received = FALSE
@@ -2620,18 +2820,7 @@ def check_payment_alerts():
                     AND NOT a.is_resolved
                 )
             """)
-            
-            orders = cur.fetchall()
-            
-            for order in orders:
-                cur.execute("""
-                    INSERT INTO order_alerts (order_id, alert_type, alert_message)
-                    VALUES (%s, 'trusted_unpaid', %s)
-                """, (
-                    order['order_id'],
-                    f"Trusted customer {order['customer_name']} - shipped but unpaid for 1+ day. Total: ${order['order_total']}"
-                ))
-                alerts_created += 1
+            alerts_created = cur.rowcount
     
     return {"status": "ok", "alerts_created": alerts_created}
 
@@ -2644,7 +2833,8 @@ try:
     from checkout import (
         calculate_order_shipping, fetch_b2bwave_order, 
         create_square_payment_link, generate_checkout_token,
-        verify_checkout_token, WAREHOUSES
+        verify_checkout_token, WAREHOUSES,
+        new_http_client, afetch_b2bwave_order, acalculate_order_shipping, acreate_square_payment_link
     )
     CHECKOUT_ENABLED = True
 except ImportError as e:
@@ -2655,6 +2845,18 @@ CHECKOUT_BASE_URL = os.environ.get("CHECKOUT_BASE_URL", "").strip()
 GMAIL_SEND_ENABLED = os.environ.get("GMAIL_SEND_ENABLED", "false").lower() == "true"
 
 
+@app.on_event("startup")
+async def open_checkout_http_client():
+    """Keep-alive client the async checkout endpoints share for B2BWave, Shippo and Square"""
+    if CHECKOUT_ENABLED:
+        app.state.http = new_http_client()
+
+@app.on_event("shutdown")
+async def close_checkout_http_client():
+    if CHECKOUT_ENABLED:
+        await app.state.http.aclose()
+
+
 @app.get("/checkout-status")
 def checkout_status():
     """Debug endpoint to check checkout configuration"""
@@ -2783,8 +2985,23 @@ def debug_test_checkout(order_id: str):
         return {"status": "error", "error": str(e), "traceback": traceback.format_exc()}
 
 
+_UPSERT_PENDING_CHECKOUT = """(varchar, varchar, varchar) AS
+    INSERT INTO pending_checkouts (order_id, customer_email, checkout_token, created_at)
+    VALUES ($1, $2, $3, NOW())
+    ON CONFLICT (order_id) DO UPDATE SET 
+        customer_email = EXCLUDED.customer_email,
+        checkout_token = EXCLUDED.checkout_token,
+        created_at = NOW()
+"""
+
+def _save_pending_checkout(order_id: str, customer_email: Optional[str], token: str):
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            execute_prepared(cur, 'pending_upsert', _UPSERT_PENDING_CHECKOUT, (order_id, customer_email, token))
+
+
 @app.post("/webhook/b2bwave-order")
-def b2bwave_order_webhook(payload: dict):
+async def b2bwave_order_webhook(payload: dict, background_tasks: BackgroundTasks):
     """
     Webhook endpoint for B2BWave - triggered when order is placed.
     Calculates shipping and sends checkout email to customer.
@@ -2802,17 +3019,8 @@ def b2bwave_order_webhook(payload: dict):
     token = generate_checkout_token(str(order_id))
     checkout_url = f"{CHECKOUT_BASE_URL}/checkout?order={order_id}&token={token}"
     
-    # Store pending checkout in database
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO pending_checkouts (order_id, customer_email, checkout_token, created_at)
-                VALUES (%s, %s, %s, NOW())
-                ON CONFLICT (order_id) DO UPDATE SET 
-                    customer_email = EXCLUDED.customer_email,
-                    checkout_token = EXCLUDED.checkout_token,
-                    created_at = NOW()
-            """, (str(order_id), customer_email, token))
+    # Store pending checkout in database once the 2xx has gone back to B2BWave
+    background_tasks.add_task(_save_pending_checkout, str(order_id), customer_email, token)
     
     # TODO: Send email with checkout link
     # For now, just return the URL
@@ -2825,29 +3033,41 @@ def b2bwave_order_webhook(payload: dict):
     }
 
 
+# Checkout writes are prepared once per pooled connection (see execute_prepared)
+# Completes the checkout and marks the main order (if it exists) paid in one round trip
+_MARK_CHECKOUT_PAID = """(varchar, varchar) AS
+    WITH checkout AS (
+        UPDATE pending_checkouts 
+        SET payment_completed_at = NOW(), transaction_id = $1
+        WHERE order_id = $2
+    )
+    UPDATE orders 
+    SET payment_received = TRUE, 
+        payment_received_at = NOW(),
+        payment_method = 'Square Checkout',
+        updated_at = NOW()
+    WHERE order_id = $2
+"""
+_SAVE_PAYMENT_ATTEMPT = """(text, numeric, varchar) AS
+    UPDATE pending_checkouts 
+    SET payment_link = $1, payment_amount = $2, payment_initiated_at = NOW()
+    WHERE order_id = $3
+"""
+
+def _mark_checkout_paid(order: str, transactionId: Optional[str]):
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            execute_prepared(cur, 'mark_checkout_paid', _MARK_CHECKOUT_PAID, (transactionId, order))
+
+
 @app.get("/checkout/payment-complete")
-def payment_complete(order: str, transactionId: Optional[str] = None):
+async def payment_complete(order: str, transactionId: Optional[str] = None):
     """
     Payment completion callback from Square.
     """
-    # Mark checkout as complete
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE pending_checkouts 
-                SET payment_completed_at = NOW(), transaction_id = %s
-                WHERE order_id = %s
-            """, (transactionId, order))
-            
-            # Also update the main order if it exists
-            cur.execute("""
-                UPDATE orders 
-                SET payment_received = TRUE, 
-                    payment_received_at = NOW(),
-                    payment_method = 'Square Checkout',
-                    updated_at = NOW()
-                WHERE order_id = %s
-            """, (order,))
+    # Mark checkout as complete before answering, so a failed write surfaces as an error
+    await run_in_threadpool(_mark_checkout_paid, order, transactionId)
+    cache_delete(checkout_snapshot_cache_key(order))
     
     return {
         "status": "ok",
@@ -2856,8 +3076,38 @@ def payment_complete(order: str, transactionId: Optional[str] = None):
     }
 
 
+async def get_checkout_snapshot(order_id: str) -> tuple:
+    """
+    (order_data, shipping_result) for a checkout. The page's GET and the Pay
+    click's create-payment POST come seconds apart, so the B2BWave order and
+    shipping quotes are cached for CHECKOUT_SNAPSHOT_CACHE_SECONDS (until the
+    payment completes) instead of being fetched twice. order_data is None if
+    B2BWave doesn't have the order.
+    """
+    key = checkout_snapshot_cache_key(order_id)
+    blob = cache_get(key)
+    if blob is not None:
+        snapshot = orjson.loads(blob) if ORJSON_AVAILABLE else json.loads(blob)
+        return snapshot["order"], snapshot["shipping"]
+    
+    order_data = await afetch_b2bwave_order(app.state.http, order_id)
+    if not order_data:
+        return None, None
+    
+    # Extract shipping address
+    shipping_address = order_data.get('shipping_address') or order_data.get('delivery_address') or {}
+    
+    # Calculate shipping
+    shipping_result = await acalculate_order_shipping(app.state.http, order_data, shipping_address)
+    
+    # A failed carrier quote is retried on the next call rather than cached
+    if all(shipment['quote'].get('success') for shipment in shipping_result['shipments']):
+        cache_set(key, dumps_json({"order": order_data, "shipping": shipping_result}), CHECKOUT_SNAPSHOT_CACHE_SECONDS)
+    return order_data, shipping_result
+
+
 @app.get("/checkout/{order_id}")
-def get_checkout_data(order_id: str, token: str):
+async def get_checkout_data(order_id: str, token: str):
     """
     Get checkout page data - order details with shipping quotes.
     Called by the checkout frontend page.
@@ -2869,18 +3119,14 @@ def get_checkout_data(order_id: str, token: str):
     if not verify_checkout_token(order_id, token):
         raise HTTPException(status_code=403, detail="Invalid or expired checkout link")
     
-    # Fetch order from B2BWave
-    order_data = fetch_b2bwave_order(order_id)
+    # Fetch order from B2BWave and quote shipping
+    order_data, shipping_result = await get_checkout_snapshot(order_id)
     if not order_data:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Extract shipping address
-    shipping_address = order_data.get('shipping_address') or order_data.get('delivery_address') or {}
-    
-    # Calculate shipping
-    shipping_result = calculate_order_shipping(order_data, shipping_address)
-    
-    return {
+    # Encoded straight to bytes: the quote breakdown is plain JSON types, so the
+    # jsonable_encoder walk FastAPI does on returned dicts is skipped
+    return json_response({
         "status": "ok",
         "order_id": order_id,
         "order": {
@@ -2893,11 +3139,37 @@ def get_checkout_data(order_id: str, token: str):
         },
         "shipping": shipping_result,
         "payment_ready": shipping_result.get('grand_total', 0) > 0
-    }
+    })
+
+
+def _save_payment_attempt(order_id: str, payment_url: str, grand_total: float):
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            execute_prepared(cur, 'save_payment_attempt', _SAVE_PAYMENT_ATTEMPT, (payment_url, grand_total, order_id))
+
+
+async def _start_square_payment(order_id: str, order_data: dict, shipping_result: dict) -> tuple:
+    """Create the Square payment link for an already-quoted order and record the attempt; returns (payment_url, amount)"""
+    grand_total = shipping_result.get('grand_total', 0)
+    if grand_total <= 0:
+        raise HTTPException(status_code=400, detail="Invalid order total")
+    
+    # Create Square payment link
+    amount_cents = int(grand_total * 100)
+    customer_email = order_data.get('customer_email', '')
+    
+    payment_url = await acreate_square_payment_link(app.state.http, amount_cents, order_id, customer_email)
+    
+    if not payment_url:
+        raise HTTPException(status_code=500, detail="Failed to create payment link")
+    
+    # Store payment attempt
+    await run_in_threadpool(_save_payment_attempt, order_id, payment_url, grand_total)
+    return payment_url, grand_total
 
 
 @app.post("/checkout/{order_id}/create-payment")
-def create_checkout_payment(order_id: str, token: str):
+async def create_checkout_payment(order_id: str, token: str):
     """
     Create Square payment link for the order.
     Called after customer reviews shipping and clicks Pay.
@@ -2909,228 +3181,61 @@ def create_checkout_payment(order_id: str, token: str):
     if not verify_checkout_token(order_id, token):
         raise HTTPException(status_code=403, detail="Invalid checkout token")
     
-    # Get checkout data to calculate total
-    order_data = fetch_b2bwave_order(order_id)
+    # Get checkout data to calculate total (usually cached from the checkout page load)
+    order_data, shipping_result = await get_checkout_snapshot(order_id)
     if not order_data:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    shipping_address = order_data.get('shipping_address') or order_data.get('delivery_address') or {}
-    shipping_result = calculate_order_shipping(order_data, shipping_address)
+    payment_url, grand_total = await _start_square_payment(order_id, order_data, shipping_result)
     
-    grand_total = shipping_result.get('grand_total', 0)
-    if grand_total <= 0:
-        raise HTTPException(status_code=400, detail="Invalid order total")
-    
-    # Create Square payment link
-    amount_cents = int(grand_total * 100)
-    customer_email = order_data.get('customer_email', '')
+    return {
+        "status": "ok",
+        "payment_url": payment_url,
+        "amount": grand_total
+    }
+
+
+@app.post("/checkout/{order_id}/quote-and-pay")
+async def quote_and_pay(order_id: str, token: str):
+    """
+    Quote shipping and create the Square payment link in one call, for clients
+    that go straight to payment without showing the quote first. Returns the
+    same shipping breakdown as GET /checkout/{order_id} plus the payment URL.
+    """
+    if not CHECKOUT_ENABLED:
+        raise HTTPException(status_code=503, detail="Checkout not enabled")
     
-    payment_url = create_square_payment_link(amount_cents, order_id, customer_email)
+    if not verify_checkout_token(order_id, token):
+        raise HTTPException(status_code=403, detail="Invalid checkout token")
     
-    if not payment_url:
-        raise HTTPException(status_code=500, detail="Failed to create payment link")
+    order_data, shipping_result = await get_checkout_snapshot(order_id)
+    if not order_data:
+        raise HTTPException(status_code=404, detail="Order not found")
     
-    # Store payment attempt
-    with get_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE pending_checkouts 
-                SET payment_link = %s, payment_amount = %s, payment_initiated_at = NOW()
-                WHERE order_id = %s
-            """, (payment_url, grand_total, order_id))
+    payment_url, grand_total = await _start_square_payment(order_id, order_data, shipping_result)
     
-    return {
+    return json_response({
         "status": "ok",
+        "order_id": order_id,
+        "shipping": shipping_result,
         "payment_url": payment_url,
         "amount": grand_total
-    }
+    })
 
 
 @app.get("/checkout-ui/{order_id}")
 def checkout_ui(order_id: str, token: str):
     """
-    Serve the checkout page HTML.
-    This is a simple HTML page that calls the API endpoints.
+    Send the customer to the checkout page.
+    The page itself is static/checkout.html (served by StaticFiles, no Python per
+    load); it reads the order and token from its query string and the API calls
+    it makes verify the token again.
     """
     if not verify_checkout_token(order_id, token):
         return HTMLResponse(content="<h1>Invalid or expired checkout link</h1>", status_code=403)
     
-    html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Complete Your Order - CFC</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        * {{ box-sizing: border-box; margin: 0; padding: 0; }}
-        body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; background: #f5f5f5; padding: 20px; }}
-        .container {{ max-width: 800px; margin: 0 auto; background: white; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); padding: 30px; }}
-        h1 {{ color: #333; margin-bottom: 20px; }}
-        h2 {{ color: #555; font-size: 18px; margin: 20px 0 10px; border-bottom: 1px solid #eee; padding-bottom: 10px; }}
-        .loading {{ text-align: center; padding: 40px; color: #666; }}
-        .error {{ background: #fee; color: #c00; padding: 15px; border-radius: 4px; margin: 20px 0; }}
-        .item {{ display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #f0f0f0; }}
-        .item-name {{ flex: 1; }}
-        .item-qty {{ width: 60px; text-align: center; color: #666; }}
-        .item-price {{ width: 100px; text-align: right; font-weight: 500; }}
-        .shipment {{ background: #f9f9f9; padding: 15px; border-radius: 4px; margin: 10px 0; }}
-        .shipment-header {{ font-weight: 600; color: #333; margin-bottom: 10px; }}
-        .shipment-detail {{ font-size: 14px; color: #666; }}
-        .totals {{ margin-top: 20px; padding-top: 20px; border-top: 2px solid #333; }}
-        .total-row {{ display: flex; justify-content: space-between; padding: 8px 0; }}
-        .total-row.grand {{ font-size: 20px; font-weight: 700; color: #333; }}
-        .pay-button {{ display: block; width: 100%; background: #0066cc; color: white; padding: 15px; border: none; border-radius: 4px; font-size: 18px; cursor: pointer; margin-top: 20px; }}
-        .pay-button:hover {{ background: #0055aa; }}
-        .pay-button:disabled {{ background: #ccc; cursor: not-allowed; }}
-        .residential-note {{ background: #fff3cd; padding: 10px; border-radius: 4px; margin: 10px 0; font-size: 14px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Complete Your Order</h1>
-        <div id="content" class="loading">Loading order details...</div>
-    </div>
-    
-    <script>
-        const ORDER_ID = "{order_id}";
-        const TOKEN = "{token}";
-        const API_BASE = window.location.origin;
-        
-        async function loadCheckout() {{
-            try {{
-                const resp = await fetch(`${{API_BASE}}/checkout/${{ORDER_ID}}?token=${{TOKEN}}`);
-                const data = await resp.json();
-                
-                if (data.status !== 'ok') {{
-                    throw new Error(data.detail || 'Failed to load order');
-                }}
-                
-                renderCheckout(data);
-            }} catch (err) {{
-                document.getElementById('content').innerHTML = `<div class="error">Error: ${{err.message}}</div>`;
-            }}
-        }}
-        
-        function renderCheckout(data) {{
-            const order = data.order;
-            const shipping = data.shipping;
-            
-            let html = `
-                <h2>Order #${{ORDER_ID}}</h2>
-                <p style="color:#666; margin-bottom:20px;">
-                    ${{order.customer_name || ''}} ${{order.company_name ? '(' + order.company_name + ')' : ''}}
-                </p>
-                
-                <h2>Items</h2>
-            `;
-            
-            // Line items
-            (order.line_items || []).forEach(item => {{
-                const price = parseFloat(item.price || item.unit_price || 0);
-                const qty = parseInt(item.quantity || 1);
-                html += `
-                    <div class="item">
-                        <div class="item-name">${{item.name || item.product_name || item.sku}}</div>
-                        <div class="item-qty">x${{qty}}</div>
-                        <div class="item-price">$${{(price * qty).toFixed(2)}}</div>
-                    </div>
-                `;
-            }});
-            
-            // Shipping
-            html += `<h2>Shipping</h2>`;
-            
-            if (shipping.shipments && shipping.shipments.length > 0) {{
-                shipping.shipments.forEach(ship => {{
-                    const quoteOk = ship.quote && ship.quote.success;
-                    const methodLabel = ship.shipping_method === 'small_package' ? '📦 UPS/USPS' : '🚚 LTL Freight';
-                    const methodNote = ship.shipping_method === 'small_package' ? 
-                        (ship.quote && ship.quote.cheapest ? `via ${{ship.quote.cheapest.provider}} ${{ship.quote.cheapest.service}}` : '') :
-                        '(R+L Carriers)';
-                    html += `
-                        <div class="shipment">
-                            <div class="shipment-header">📦 From: ${{ship.warehouse_name}} (${{ship.origin_zip}})</div>
-                            <div class="shipment-detail">
-                                ${{ship.items.length}} item(s) · ${{ship.weight}} lbs
-                                ${{ship.is_oversized ? ' · <strong>Oversized</strong>' : ''}}
-                            </div>
-                            <div class="shipment-detail" style="margin-top:8px;">
-                                ${{quoteOk ? 
-                                    `<strong>Shipping: $${{ship.shipping_cost.toFixed(2)}}</strong> <span style="color:#666; font-size:0.9em;">${{methodLabel}} ${{methodNote}}</span>` : 
-                                    `<span style="color:#c00">Quote unavailable</span>`
-                                }}
-                            </div>
-                        </div>
-                    `;
-                }});
-                
-                // Show residential note only for LTL shipments
-                const hasLtl = shipping.shipments.some(s => s.shipping_method === 'ltl');
-                if (hasLtl) {{
-                    html += `<div class="residential-note">🏠 Residential delivery includes liftgate service</div>`;
-                }}
-            }}
-            
-            // Totals
-            html += `
-                <div class="totals">
-                    <div class="total-row">
-                        <span>Items Subtotal</span>
-                        <span>$${{shipping.total_items.toFixed(2)}}</span>
-                    </div>
-                    <div class="total-row">
-                        <span>Shipping</span>
-                        <span>$${{shipping.total_shipping.toFixed(2)}}</span>
-                    </div>
-                    <div class="total-row grand">
-                        <span>Total</span>
-                        <span>$${{shipping.grand_total.toFixed(2)}}</span>
-                    </div>
-                </div>
-                
-                <button class="pay-button" onclick="initiatePayment()" id="payBtn">
-                    Pay $${{shipping.grand_total.toFixed(2)}} with Card
-                </button>
-            `;
-            
-            document.getElementById('content').innerHTML = html;
-        }}
-        
-        async function initiatePayment() {{
-            const btn = document.getElementById('payBtn');
-            btn.disabled = true;
-            btn.textContent = 'Creating payment link...';
-            
-            try {{
-                const resp = await fetch(`${{API_BASE}}/checkout/${{ORDER_ID}}/create-payment?token=${{TOKEN}}`, {{
-                    method: 'POST'
-                }});
-                const data = await resp.json();
-                
-                if (data.payment_url) {{
-                    window.location.href = data.payment_url;
-                }} else {{
-                    throw new Error(data.detail || 'Failed to create payment');
-                }}
-            }} catch (err) {{
-                alert('Payment error: ' + err.message);
-                btn.disabled = false;
-                btn.textContent = 'Pay with Card';
-            }}
-        }}
-        
-        loadCheckout();
-    </script>
-</body>
-</html>
-    """
-    
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html)
-
-
-# Add HTMLResponse import at top of file
-from fastapi.responses import HTMLResponse
+    query = urllib.parse.urlencode({"order": order_id, "token": token})
+    return RedirectResponse(f"/static/checkout.html?{query}", status_code=302)
 
 
 # =============================================================================
@@ -3140,5 +3245,20 @@ from fastapi.responses import HTMLResponse
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 10000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # uvicorn[standard] installs uvloop and httptools, which loop/http "auto" pick
+    # up (and fall back from where they don't build, e.g. Windows). Each worker is
+    # a separate process with its own DB pool; migrations take an advisory lock and
+    # only the worker that claims background jobs runs auto-sync and the
+    # order_status refresh. More than one worker is opt-in via WEB_CONCURRENCY;
+    # size DB_POOL_MAX * workers to the database's connection limit
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="auto",
+        http="auto",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+    )
 
@@ -3,34 +3,13 @@ rta_database.py
 RTA Cabinet Database - SKU lookup for weights, dimensions, and shipping rules
 """
 
-import os
 import json
+import functools
 from typing import Optional, Dict, List
-from contextlib import contextmanager
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
-DATABASE_URL = os.environ.get("DATABASE_URL", "")
-
-# Fix Heroku-style postgres:// URLs
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-if DATABASE_URL and "sslmode" not in DATABASE_URL:
-    DATABASE_URL += ("&" if "?" in DATABASE_URL else "?") + "sslmode=require"
-
-
-@contextmanager
-def get_db():
-    """Database connection context manager"""
-    conn = psycopg2.connect(DATABASE_URL)
-    try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+# Borrow from the app's shared connection pool instead of connecting per lookup
+from db_helpers import get_db
 
 
 # =============================================================================
@@ -71,6 +50,7 @@ def init_rta_table():
     with get_db() as conn:
         with conn.cursor() as cur:
             cur.execute(CREATE_RTA_PRODUCTS_TABLE)
+    clear_rta_cache()
     return {"status": "ok", "message": "rta_products table created"}
 
 
@@ -198,6 +178,7 @@ def load_rta_data_from_excel(excel_path: str) -> Dict:
                     inserted += 1
                 except Exception as e:
                     errors.append(f"{row.get('product_sku')}: {str(e)}")
+    clear_rta_cache()
     
     return {
         "status": "ok",
@@ -214,6 +195,13 @@ def get_sku_info(sku: str) -> Optional[Dict]:
     """
     Look up a single SKU and return its info including weight and long pallet flag.
     """
+    info = _sku_info(sku)
+    return dict(info) if info else None
+
+
+# rta_products only changes when the spreadsheet is reloaded; clear_rta_cache() then
+@functools.lru_cache(maxsize=8192)
+def _sku_info(sku: str) -> Optional[Dict]:
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -226,6 +214,11 @@ def get_sku_info(sku: str) -> Optional[Dict]:
             return dict(row) if row else None
 
 
+def clear_rta_cache():
+    """Forget cached SKU lookups"""
+    _sku_info.cache_clear()
+
+
 def get_skus_info(skus: List[str]) -> Dict[str, Dict]:
     """
     Look up multiple SKUs and return their info.
@@ -315,10 +308,10 @@ def calculate_order_weight_and_flags(line_items: List[Dict]) -> Dict:
             ]
         }
     """
-    # Extract SKUs
-    skus = [item.get('sku', '') for item in line_items if item.get('sku')]
+    # Extract SKUs (once each; an order often repeats a SKU across lines)
+    skus = list({item['sku'] for item in line_items if item.get('sku')})
     
-    # Look up all SKUs
+    # Look up all SKUs in one query
     sku_info = get_skus_info(skus)
     
     total_weight = 0
@@ -5,10 +5,7 @@ Contains the full schema for initializing/resetting the database.
 """
 
 SCHEMA_SQL = """
--- Drop view first (depends on orders)
-DROP VIEW IF EXISTS order_status CASCADE;
-
--- Drop tables
+-- Drop tables (the order_status materialized view goes with orders via CASCADE)
 DROP TABLE IF EXISTS order_line_items CASCADE;
 DROP TABLE IF EXISTS order_events CASCADE;
 DROP TABLE IF EXISTS order_alerts CASCADE;
@@ -16,6 +13,15 @@ DROP TABLE IF EXISTS orders CASCADE;
 DROP TABLE IF EXISTS warehouse_mapping CASCADE;
 DROP TABLE IF EXISTS trusted_customers CASCADE;
 DROP TABLE IF EXISTS pending_checkouts CASCADE;
+DROP TABLE IF EXISTS sync_state CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
+
+-- Incremental sync cursors (e.g. last B2BWave updated_at seen)
+CREATE TABLE sync_state (
+    key VARCHAR(100) PRIMARY KEY,
+    value TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
 
 -- Pending checkouts for B2BWave orders awaiting payment
 CREATE TABLE pending_checkouts (
@@ -215,7 +221,7 @@ CREATE TABLE order_alerts (
 );
 
 CREATE INDEX idx_alerts_order ON order_alerts(order_id);
-CREATE INDEX idx_alerts_unresolved ON order_alerts(is_resolved) WHERE NOT is_resolved;
+CREATE INDEX idx_alerts_open_created ON order_alerts(created_at DESC) WHERE NOT is_resolved;
 
 CREATE TABLE order_line_items (
     id SERIAL PRIMARY KEY,
@@ -274,14 +280,18 @@ CREATE TABLE order_shipments (
 
 CREATE INDEX idx_orders_complete ON orders(is_complete);
 CREATE INDEX idx_orders_date ON orders(order_date DESC);
-CREATE INDEX idx_line_items_order ON order_line_items(order_id);
-CREATE INDEX idx_events_order ON order_events(order_id);
+CREATE INDEX idx_orders_unpaid_date ON orders(order_date DESC) WHERE NOT payment_received;
+CREATE INDEX idx_orders_open_date ON orders(order_date DESC) WHERE NOT is_complete;
+CREATE INDEX idx_orders_trusted_unpaid ON orders(sent_to_warehouse_at)
+    WHERE sent_to_warehouse AND NOT payment_received AND is_trusted_customer;
+CREATE INDEX idx_line_items_order_warehouse ON order_line_items(order_id, warehouse);
+CREATE INDEX idx_events_order_created ON order_events(order_id, created_at DESC);
 CREATE INDEX idx_email_snippets_order ON order_email_snippets(order_id);
 CREATE INDEX idx_shipments_order ON order_shipments(order_id);
 CREATE INDEX idx_shipments_id ON order_shipments(shipment_id);
 
--- View for current status
-CREATE OR REPLACE VIEW order_status AS
+-- Current status, materialized; refreshed by the app when orders_status_dirty fires
+CREATE MATERIALIZED VIEW order_status AS
 SELECT 
     order_id,
     CASE
@@ -293,6 +303,47 @@ SELECT
         WHEN payment_link_sent AND NOT payment_received THEN 'awaiting_payment'
         ELSE 'needs_payment_link'
     END as current_status,
-    EXTRACT(DAY FROM NOW() - order_date)::INTEGER as days_open
+    EXTRACT(DAY FROM NOW() - order_date)::INTEGER as days_open,
+    payment_link_sent,
+    payment_received,
+    sent_to_warehouse,
+    warehouse_confirmed,
+    bol_sent,
+    is_complete,
+    updated_at
 FROM orders;
+
+CREATE UNIQUE INDEX idx_order_status_order ON order_status(order_id);
+CREATE INDEX idx_order_status_current ON order_status(current_status);
+
+-- Payload: changed order_ids, comma separated ('' = too many to list)
+CREATE OR REPLACE FUNCTION notify_order_status_dirty() RETURNS trigger AS $$
+DECLARE
+    ids TEXT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT string_agg(DISTINCT order_id, ',') INTO ids FROM old_rows;
+    ELSE
+        SELECT string_agg(DISTINCT order_id, ',') INTO ids FROM new_rows;
+    END IF;
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    IF octet_length(ids) > 7000 THEN
+        ids := '';
+    END IF;
+    PERFORM pg_notify('order_status_dirty', ids);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER orders_status_dirty_insert
+    AFTER INSERT ON orders REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+CREATE TRIGGER orders_status_dirty_update
+    AFTER UPDATE ON orders REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
+CREATE TRIGGER orders_status_dirty_delete
+    AFTER DELETE ON orders REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_order_status_dirty();
 """
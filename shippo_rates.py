@@ -5,10 +5,11 @@ Shippo API integration for small package shipping rates (UPS, FedEx, USPS)
 
 import os
 import json
-import urllib.request
-import urllib.error
+import threading
 from typing import Optional, Dict, List, Any
 
+import httpx
+
 # Config from environment
 SHIPPO_API_KEY = os.environ.get("SHIPPO_API_KEY", "").strip()
 SHIPPO_API_URL = "https://api.goshippo.com"
@@ -23,31 +24,43 @@ DEFAULT_PARCEL = {
 }
 
 
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    """Shared keep-alive client so repeated Shippo calls skip the TCP/TLS handshake"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    base_url=SHIPPO_API_URL,
+                    headers={
+                        'Authorization': f'ShippoToken {SHIPPO_API_KEY}',
+                        'Content-Type': 'application/json'
+                    },
+                    timeout=30,
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                    # Retries connection failures only, never a request Shippo received
+                    transport=httpx.HTTPTransport(retries=3)
+                )
+    return _http_client
+
+
 def shippo_request(endpoint: str, method: str = "GET", data: dict = None) -> Optional[Dict]:
     """Make authenticated request to Shippo API"""
     if not SHIPPO_API_KEY:
         print("[SHIPPO] No API key configured")
         return None
     
-    url = f"{SHIPPO_API_URL}/{endpoint}"
-    
     try:
-        if data:
-            req_data = json.dumps(data).encode()
-            req = urllib.request.Request(url, data=req_data, method=method)
-        else:
-            req = urllib.request.Request(url, method=method)
-        
-        req.add_header('Authorization', f'ShippoToken {SHIPPO_API_KEY}')
-        req.add_header('Content-Type', 'application/json')
-        
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return json.loads(resp.read().decode())
+        resp = _get_http_client().request(method, f"/{endpoint}", content=json.dumps(data).encode() if data else None)
+        if resp.is_error:
+            print(f"[SHIPPO] HTTP Error {resp.status_code}: {resp.text}")
+            return None
+        return resp.json()
             
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode()
-        print(f"[SHIPPO] HTTP Error {e.code}: {error_body}")
-        return None
     except Exception as e:
         print(f"[SHIPPO] Error: {e}")
         return None
@@ -0,0 +1,112 @@
+"""
+snippet_queue.py
+Batched writer for email snippets posted by the Google Script.
+add-email-snippet queues rows for orders that exist; a background thread writes
+queued rows in one multi-row INSERT every SNIPPET_FLUSH_SECONDS or
+SNIPPET_BATCH_SIZE rows. The queue is drained on shutdown (drain_snippets).
+"""
+
+import queue
+import threading
+import time
+from typing import List, Tuple
+
+from psycopg2.extras import execute_values
+
+from config import SNIPPET_BATCH_SIZE, SNIPPET_FLUSH_SECONDS
+from db_helpers import get_db
+from cache import invalidate_order_cache
+
+# (order_id, email_from, email_subject, email_snippet, email_date, snippet_type)
+snippet_queue: "queue.Queue[Tuple]" = queue.Queue()
+
+_writer_started = False
+_writer_lock = threading.Lock()
+
+# Rows for orders that no longer exist are dropped instead of failing the batch
+_INSERT_SNIPPETS = """
+    INSERT INTO order_email_snippets
+    (order_id, email_from, email_subject, email_snippet, email_date, snippet_type)
+    SELECT v.order_id, v.email_from, v.email_subject, v.email_snippet, v.email_date, v.snippet_type
+    FROM (VALUES %s) AS v(order_id, email_from, email_subject, email_snippet, email_date, snippet_type)
+    JOIN orders o ON o.order_id = v.order_id
+    ON CONFLICT DO NOTHING
+"""
+_SNIPPET_TEMPLATE = "(%s::varchar, %s::varchar, %s::varchar, %s::text, %s::timestamptz, %s::varchar)"
+
+
+def enqueue_snippet(order_id: str, email_from: str, email_subject: str,
+                    email_snippet: str, email_date, snippet_type: str):
+    """Queue a snippet for the next batch write"""
+    snippet_queue.put((order_id, email_from, email_subject, email_snippet, email_date, snippet_type))
+
+
+def _write_snippets(rows: List[Tuple]):
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, _INSERT_SNIPPETS, rows,
+                           template=_SNIPPET_TEMPLATE, page_size=SNIPPET_BATCH_SIZE)
+            # Batches never exceed page_size, so rowcount covers the whole batch
+            if cur.rowcount < len(rows):
+                print(f"[SNIPPETS] Dropped {len(rows) - cur.rowcount} of {len(rows)} snippets "
+                      f"(order deleted after queueing)")
+
+
+def flush_snippets(rows: List[Tuple]):
+    """Write a batch of snippets; if the batch fails, retry row by row so one bad row doesn't drop the rest"""
+    try:
+        _write_snippets(rows)
+    except Exception as e:
+        print(f"[SNIPPETS] Batch of {len(rows)} failed ({e}), retrying individually")
+        for row in rows:
+            try:
+                _write_snippets([row])
+            except Exception as e:
+                print(f"[SNIPPETS] Dropped snippet for order {row[0]}: {e}")
+
+    for order_id in {row[0] for row in rows}:
+        invalidate_order_cache(order_id)
+
+
+def run_snippet_writer():
+    """Drain the snippet queue, writing up to SNIPPET_BATCH_SIZE rows per flush"""
+    while True:
+        rows = [snippet_queue.get()]
+        deadline = time.monotonic() + SNIPPET_FLUSH_SECONDS
+        while len(rows) < SNIPPET_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(snippet_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        flush_snippets(rows)
+        for _ in rows:
+            snippet_queue.task_done()
+
+
+def drain_snippets():
+    """Write everything still queued and wait for the writer's in-flight batch (shutdown hook)"""
+    rows = []
+    while True:
+        try:
+            rows.append(snippet_queue.get_nowait())
+        except queue.Empty:
+            break
+    if rows:
+        flush_snippets(rows)
+        for _ in rows:
+            snippet_queue.task_done()
+    snippet_queue.join()
+
+
+def start_snippet_writer():
+    """Start the snippet writer thread (once per process)"""
+    global _writer_started
+    with _writer_lock:
+        if _writer_started:
+            return
+        threading.Thread(target=run_snippet_writer, daemon=True).start()
+        _writer_started = True
@@ -7,45 +7,59 @@ order numbers from payment descriptions.
 import os
 import re
 import json
-import urllib.request
-import urllib.error
+import threading
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List, Dict, Tuple
 
+import httpx
+
 # Square API Config
 SQUARE_ACCESS_TOKEN = os.environ.get("SQUARE_ACCESS_TOKEN", "").strip()
 SQUARE_LOCATION_ID = os.environ.get("SQUARE_LOCATION_ID", "").strip()
 SQUARE_API_BASE = "https://connect.squareup.com/v2"
 
+# Order ids in payment descriptions (see extract_order_ids)
+_LEADING_ORDER_ID_RE = re.compile(r'^(\d{4,5})')
+_CFC_ORDER_ID_RE = re.compile(r'\b(5\d{3,4})\b')
+_ANY_ORDER_ID_RE = re.compile(r'\b(\d{4,5})\b')
+
 def square_configured() -> bool:
     """Check if Square API credentials are configured"""
     return bool(SQUARE_ACCESS_TOKEN and SQUARE_LOCATION_ID)
 
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+
+def _get_http_client() -> httpx.Client:
+    """Shared keep-alive client so repeated Square calls skip the TCP/TLS handshake"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    base_url=SQUARE_API_BASE,
+                    headers={
+                        "Authorization": f"Bearer {SQUARE_ACCESS_TOKEN}",
+                        "Content-Type": "application/json",
+                        "Square-Version": "2024-01-18"
+                    },
+                    timeout=30,
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                    # Retries connection failures only, never a request Square received
+                    transport=httpx.HTTPTransport(retries=3)
+                )
+    return _http_client
+
 def square_api_request(endpoint: str, params: dict = None) -> dict:
     """Make a request to Square API"""
     if not square_configured():
         raise Exception("Square API not configured")
     
-    url = f"{SQUARE_API_BASE}/{endpoint}"
-    if params:
-        query_string = "&".join(f"{k}={v}" for k, v in params.items() if v)
-        url = f"{url}?{query_string}"
-    
-    req = urllib.request.Request(
-        url,
-        headers={
-            "Authorization": f"Bearer {SQUARE_ACCESS_TOKEN}",
-            "Content-Type": "application/json",
-            "Square-Version": "2024-01-18"
-        }
-    )
-    
-    try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            return json.loads(response.read().decode())
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode() if e.fp else ""
-        raise Exception(f"Square API error {e.code}: {error_body}")
+    params = {k: v for k, v in params.items() if v} if params else None
+    response = _get_http_client().get(f"/{endpoint}", params=params)
+    if response.is_error:
+        raise Exception(f"Square API error {response.status_code}: {response.text}")
+    return response.json()
 
 def extract_order_ids(description: str) -> List[str]:
     """
@@ -64,17 +78,17 @@ def extract_order_ids(description: str) -> List[str]:
     order_ids = []
     
     # Pattern 1: Number at start followed by hyphen (e.g., "5299-Creative Spaces")
-    start_match = re.match(r'^(\d{4,5})', description)
+    start_match = _LEADING_ORDER_ID_RE.match(description)
     if start_match:
         order_ids.append(start_match.group(1))
     
     # Pattern 2: Find all 4-5 digit numbers starting with 5 (typical CFC order IDs)
-    matches = re.findall(r'\b(5\d{3,4})\b', description)
+    matches = _CFC_ORDER_ID_RE.findall(description)
     order_ids.extend(matches)
     
     # Pattern 3: Fallback - any 4-5 digit number
     if not order_ids:
-        matches = re.findall(r'\b(\d{4,5})\b', description)
+        matches = _ANY_ORDER_ID_RE.findall(description)
         order_ids.extend(matches)
     
     # Remove duplicates while preserving order
@@ -3,28 +3,45 @@ sync_service.py
 B2BWave order sync and auto-sync scheduler for CFC Order Backend.
 """
 
+import functools
 import json
-import base64
-import urllib.request
-import urllib.error
+import queue
 import threading
 import time
-from datetime import datetime, timezone, timedelta
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timezone, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
 
-from psycopg2.extras import RealDictCursor
+import httpx
+from psycopg2.extras import RealDictCursor, execute_values
+
+# orjson parses bytes directly and is much faster on large order lists
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 from config import (
     B2BWAVE_URL, B2BWAVE_USERNAME, B2BWAVE_API_KEY,
     AUTO_SYNC_INTERVAL_MINUTES, AUTO_SYNC_DAYS_BACK
 )
 from db_helpers import get_db
-from email_parser import get_warehouses_for_skus
 
 # Global state for auto-sync
 last_auto_sync = None
 auto_sync_running = False
 
+# Order IDs pushed by the B2BWave webhook, consumed by the webhook worker thread
+webhook_queue: "queue.Queue[str]" = queue.Queue()
+
+# sync_state key holding the max B2BWave updated_at seen by auto-sync
+B2BWAVE_CURSOR_KEY = 'last_b2bwave_updated_at'
+# sync_state key holding {order_id: failed attempts} for orders auto-sync retries by id
+B2BWAVE_RETRY_KEY = 'b2bwave_failed_orders'
+# Auto-sync cycles an order may fail before it is dropped from the retry list
+B2BWAVE_MAX_SYNC_ATTEMPTS = 5
+
 
 class B2BWaveAPIError(Exception):
     """Custom exception for B2BWave API errors"""
@@ -39,60 +56,118 @@ def is_configured() -> bool:
     return bool(B2BWAVE_URL and B2BWAVE_USERNAME and B2BWAVE_API_KEY)
 
 
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    """Shared keep-alive client so repeated B2BWave calls skip the TCP/TLS handshake"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    auth=(B2BWAVE_USERNAME, B2BWAVE_API_KEY),
+                    headers={"Content-Type": "application/json"},
+                    timeout=30,
+                    limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+                    # Retries connection failures only, never a request B2BWave received
+                    transport=httpx.HTTPTransport(retries=3)
+                )
+    return _http_client
+
+
 def b2bwave_api_request(endpoint: str, params: dict = None) -> dict:
     """Make authenticated request to B2BWave API"""
     if not is_configured():
         raise B2BWaveAPIError(500, "B2BWave API not configured")
     
     url = f"{B2BWAVE_URL}/api/{endpoint}.json"
-    if params:
-        query = "&".join(f"{k}={v}" for k, v in params.items())
-        url = f"{url}?{query}"
-    
-    # HTTP Basic Auth
-    credentials = base64.b64encode(f"{B2BWAVE_USERNAME}:{B2BWAVE_API_KEY}".encode()).decode()
-    
-    req = urllib.request.Request(url)
-    req.add_header("Authorization", f"Basic {credentials}")
-    req.add_header("Content-Type", "application/json")
     
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            return json.loads(response.read().decode())
-    except urllib.error.HTTPError as e:
-        raise B2BWaveAPIError(e.code, f"HTTP Error: {e.reason}")
-    except urllib.error.URLError as e:
+        response = _get_http_client().get(url, params=params)
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise B2BWaveAPIError(e.response.status_code, f"HTTP Error: {e.response.reason_phrase}")
+    except httpx.RequestError as e:
         raise B2BWaveAPIError(500, f"Connection error: {str(e)}")
+    
+    return orjson.loads(response.content) if ORJSON_AVAILABLE else json.loads(response.content)
 
 
-def sync_order_from_b2bwave(order_data: dict) -> dict:
+def b2bwave_since_date(days_back: int) -> str:
+    """submitted_at_gteq date for the last days_back days (YYYY-MM-DD, UTC)"""
+    return _since_date(datetime.now(timezone.utc).date(), days_back)
+
+
+@functools.lru_cache(maxsize=32)
+def _since_date(today: date, days_back: int) -> str:
+    return (today - timedelta(days=days_back)).isoformat()
+
+
+# Pages fetched concurrently once the first page shows the page size. B2BWave
+# doesn't report a page count, so pages past the end are fetched and dropped
+B2BWAVE_PAGE_CONCURRENCY = 4
+
+
+def b2bwave_iter_orders(since_date: str = None, updated_since: str = None) -> Iterator[dict]:
     """
-    Sync a single order from B2BWave API response to our database.
-    Returns the order_id and status.
+    Yield B2BWave orders submitted since since_date (or updated since updated_since),
+    one page at a time, in page order. After the first page, up to
+    B2BWAVE_PAGE_CONCURRENCY pages are downloaded concurrently.
+    Stops when a page comes back empty, shrinks, or repeats the previous page.
     """
-    order = order_data.get('order', order_data)
+    params = {"updated_at_gteq": updated_since} if updated_since else {"submitted_at_gteq": since_date}
+    page = 1
+    page_size = None
+    prev_first_id = None
     
-    order_id = str(order.get('id'))
+    def fetch(page_no: int):
+        return b2bwave_api_request("orders", {**params, "page": page_no})
     
-    # Extract customer info
-    customer_name = order.get('customer_name', '')
-    company_name = order.get('customer_company', '')
-    email = order.get('customer_email', '')
-    phone = order.get('customer_phone', '')
-    
-    # Extract address - B2BWave provides these as separate fields!
-    street = order.get('address', '')
-    street2 = order.get('address2', '')
-    city = order.get('city', '')
-    state = order.get('province', '')  # B2BWave calls it 'province'
-    zip_code = order.get('postal_code', '')
-    
-    # Comments
-    comments = order.get('comments_customer', '')
-    
-    # Totals
-    order_total = float(order.get('gross_total', 0) or 0)
-    total_weight = float(order.get('total_weight', 0) or 0)
+    executor = ThreadPoolExecutor(max_workers=B2BWAVE_PAGE_CONCURRENCY, thread_name_prefix="b2bwave-pages")
+    pending = {}
+    next_page = 1
+    try:
+        while True:
+            # Only page 1 until its size shows whether there can be more pages
+            window = B2BWAVE_PAGE_CONCURRENCY if page_size else 1
+            while next_page < page + window:
+                pending[next_page] = executor.submit(fetch, next_page)
+                next_page += 1
+            
+            data = pending.pop(page).result()
+            orders_list = data if isinstance(data, list) else [data] if data else []
+            if not orders_list:
+                return
+            
+            # Guard against an API that ignores the page param
+            first_id = orders_list[0].get('order', orders_list[0]).get('id')
+            if page > 1 and first_id == prev_first_id:
+                return
+            prev_first_id = first_id
+            
+            yield from orders_list
+            
+            if not isinstance(data, list):
+                return
+            if page_size is None:
+                page_size = len(orders_list)
+            elif len(orders_list) < page_size:
+                return
+            page += 1
+    finally:
+        for future in pending.values():
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def parse_b2bwave_order(order_data: dict) -> dict:
+    """
+    Turn a B2BWave API order into the row we store (no DB access).
+    Line items carry their own sku_prefix; sku_prefixes is the de-duplicated list.
+    """
+    order = order_data.get('order', order_data)
     
     # Order date
     submitted_at = order.get('submitted_at')
@@ -105,212 +180,599 @@ def sync_order_from_b2bwave(order_data: dict) -> dict:
         order_date = datetime.now(timezone.utc)
     
     # Extract line items and SKU prefixes
-    order_products = order.get('order_products', [])
     sku_prefixes = []
     line_items = []
     
-    for op in order_products:
+    for op in order.get('order_products', []):
         product = op.get('order_product', op)
         product_code = product.get('product_code', '')
-        product_name = product.get('product_name', '')
-        quantity = float(product.get('quantity', 0) or 0)
-        price = float(product.get('final_price', 0) or 0)
         
         # Extract SKU prefix
-        if '-' in product_code:
-            prefix = product_code.split('-')[0]
-            if prefix and prefix not in sku_prefixes:
-                sku_prefixes.append(prefix)
+        prefix = product_code.split('-')[0] if '-' in product_code else ''
+        if prefix and prefix not in sku_prefixes:
+            sku_prefixes.append(prefix)
         
         line_items.append({
             'sku': product_code,
-            'product_name': product_name,
-            'quantity': quantity,
-            'price': price
+            'sku_prefix': prefix,
+            'product_name': product.get('product_name', ''),
+            'quantity': float(product.get('quantity', 0) or 0),
+            'price': float(product.get('final_price', 0) or 0)
         })
     
-    # Get warehouses for SKU prefixes (up to 4)
-    warehouses = get_warehouses_for_skus(sku_prefixes)
-    warehouse_1 = warehouses[0] if len(warehouses) > 0 else None
-    warehouse_2 = warehouses[1] if len(warehouses) > 1 else None
-    warehouse_3 = warehouses[2] if len(warehouses) > 2 else None
-    warehouse_4 = warehouses[3] if len(warehouses) > 3 else None
-    
-    # Check if trusted customer
-    is_trusted = False
-    with get_db() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT id FROM trusted_customers 
-                WHERE LOWER(customer_name) = LOWER(%s) 
-                   OR LOWER(company_name) = LOWER(%s)
-                   OR LOWER(email) = LOWER(%s)
-            """, (customer_name, company_name, email))
-            if cur.fetchone():
-                is_trusted = True
+    return {
+        'order_id': str(order.get('id')),
+        'order_date': order_date,
+        # Customer info
+        'customer_name': order.get('customer_name', ''),
+        'company_name': order.get('customer_company', ''),
+        'email': order.get('customer_email', ''),
+        'phone': order.get('customer_phone', ''),
+        # Address - B2BWave provides these as separate fields!
+        'street': order.get('address', ''),
+        'street2': order.get('address2', ''),
+        'city': order.get('city', ''),
+        'state': order.get('province', ''),  # B2BWave calls it 'province'
+        'zip_code': order.get('postal_code', ''),
+        'comments': order.get('comments_customer', ''),
+        # Totals
+        'order_total': float(order.get('gross_total', 0) or 0),
+        'total_weight': float(order.get('total_weight', 0) or 0),
+        'sku_prefixes': sku_prefixes,
+        'line_items': line_items
+    }
+
+
+def _sync_result(row: dict, warehouses: List[str]) -> dict:
+    """Summary returned to callers for each synced order"""
+    return {
+        'order_id': row['order_id'],
+        'customer_name': row['customer_name'],
+        'company_name': row['company_name'],
+        'city': row['city'],
+        'state': row['state'],
+        'zip_code': row['zip_code'],
+        'warehouse_1': warehouses[0] if len(warehouses) > 0 else None,
+        'warehouse_2': warehouses[1] if len(warehouses) > 1 else None,
+        'warehouse_3': warehouses[2] if len(warehouses) > 2 else None,
+        'warehouse_4': warehouses[3] if len(warehouses) > 3 else None,
+        'line_items_count': len(row['line_items'])
+    }
+
+
+def _shipment_id(order_id: str, warehouse: str) -> str:
+    """Shipment id like "5307-Li" """
+    return f"{order_id}-{warehouse.replace(' & ', '-').replace(' ', '-')}"
+
+
+def sync_order_from_b2bwave(order_data: dict) -> dict:
+    """
+    Sync a single order from B2BWave API response to our database.
+    Returns the order_id and status.
+    """
+    row = parse_b2bwave_order(order_data)
+    line_items = row['line_items']
     
-    # Upsert order
+    # Everything below runs as ONE statement / one round trip:
+    # trusted check, warehouse lookup, order upsert, line item replace,
+    # sync event and shipment creation are chained as data-modifying CTEs.
+    # Line items are passed as parallel arrays and expanded with unnest().
     with get_db() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
-                INSERT INTO orders (
-                    order_id, order_date, customer_name, company_name,
-                    street, street2, city, state, zip_code, phone, email,
-                    comments, order_total, total_weight, warehouse_1, warehouse_2, warehouse_3, warehouse_4,
-                    is_trusted_customer
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                WITH trusted AS (
+                    SELECT EXISTS (
+                        SELECT 1 FROM trusted_customers 
+                        WHERE LOWER(customer_name) = LOWER(%(customer_name)s) 
+                           OR LOWER(company_name) = LOWER(%(company_name)s)
+                           OR LOWER(email) = LOWER(%(email)s)
+                    ) AS is_trusted
+                ),
+                wh AS (
+                    SELECT COALESCE(array_agg(DISTINCT warehouse_name), '{}') AS names
+                    FROM warehouse_mapping
+                    WHERE UPPER(sku_prefix) = ANY(%(sku_prefixes)s::text[])
+                ),
+                upsert AS (
+                    INSERT INTO orders (
+                        order_id, order_date, customer_name, company_name,
+                        street, street2, city, state, zip_code, phone, email,
+                        comments, order_total, total_weight, warehouse_1, warehouse_2, warehouse_3, warehouse_4,
+                        is_trusted_customer
+                    )
+                    SELECT
+                        %(order_id)s, %(order_date)s, %(customer_name)s, %(company_name)s,
+                        %(street)s, %(street2)s, %(city)s, %(state)s, %(zip_code)s, %(phone)s, %(email)s,
+                        %(comments)s, %(order_total)s, %(total_weight)s,
+                        wh.names[1], wh.names[2], wh.names[3], wh.names[4],
+                        trusted.is_trusted
+                    FROM wh, trusted
+                    ON CONFLICT (order_id) DO UPDATE SET
+                        customer_name = EXCLUDED.customer_name,
+                        company_name = EXCLUDED.company_name,
+                        street = EXCLUDED.street,
+                        street2 = EXCLUDED.street2,
+                        city = EXCLUDED.city,
+                        state = EXCLUDED.state,
+                        zip_code = EXCLUDED.zip_code,
+                        phone = EXCLUDED.phone,
+                        email = EXCLUDED.email,
+                        comments = EXCLUDED.comments,
+                        order_total = EXCLUDED.order_total,
+                        total_weight = EXCLUDED.total_weight,
+                        warehouse_1 = COALESCE(orders.warehouse_1, EXCLUDED.warehouse_1),
+                        warehouse_2 = COALESCE(orders.warehouse_2, EXCLUDED.warehouse_2),
+                        warehouse_3 = COALESCE(orders.warehouse_3, EXCLUDED.warehouse_3),
+                        warehouse_4 = COALESCE(orders.warehouse_4, EXCLUDED.warehouse_4),
+                        is_trusted_customer = EXCLUDED.is_trusted_customer,
+                        updated_at = NOW()
+                    RETURNING order_id
+                ),
+                -- Sees the pre-statement snapshot, so only the old rows are removed
+                del_items AS (
+                    DELETE FROM order_line_items WHERE order_id = %(order_id)s
+                ),
+                ins_items AS (
+                    INSERT INTO order_line_items (order_id, sku, sku_prefix, product_name, quantity, price, warehouse)
+                    SELECT %(order_id)s, i.sku, i.sku_prefix, i.product_name, i.quantity, i.price, wm.warehouse_name
+                    FROM unnest(
+                        %(skus)s::text[], %(item_prefixes)s::text[], %(product_names)s::text[],
+                        %(quantities)s::numeric[], %(prices)s::numeric[]
+                    ) AS i(sku, sku_prefix, product_name, quantity, price)
+                    LEFT JOIN warehouse_mapping wm
+                        ON i.sku_prefix <> '' AND UPPER(wm.sku_prefix) = UPPER(i.sku_prefix)
+                ),
+                ins_event AS (
+                    INSERT INTO order_events (order_id, event_type, event_data, source)
+                    VALUES (%(order_id)s, 'b2bwave_sync', %(event_data)s, 'api')
+                ),
+                -- Auto-create shipments for each warehouse, e.g. "5307-Li"
+                ins_shipments AS (
+                    INSERT INTO order_shipments (order_id, shipment_id, warehouse, status)
+                    SELECT %(order_id)s,
+                           %(order_id)s || '-' || REPLACE(REPLACE(w, ' & ', '-'), ' ', '-'),
+                           w, 'needs_order'
+                    FROM wh, unnest(wh.names[1:4]) AS w
+                    ON CONFLICT (shipment_id) DO NOTHING
                 )
-                ON CONFLICT (order_id) DO UPDATE SET
-                    customer_name = EXCLUDED.customer_name,
-                    company_name = EXCLUDED.company_name,
-                    street = EXCLUDED.street,
-                    street2 = EXCLUDED.street2,
-                    city = EXCLUDED.city,
-                    state = EXCLUDED.state,
-                    zip_code = EXCLUDED.zip_code,
-                    phone = EXCLUDED.phone,
-                    email = EXCLUDED.email,
-                    comments = EXCLUDED.comments,
-                    order_total = EXCLUDED.order_total,
-                    total_weight = EXCLUDED.total_weight,
-                    warehouse_1 = COALESCE(orders.warehouse_1, EXCLUDED.warehouse_1),
-                    warehouse_2 = COALESCE(orders.warehouse_2, EXCLUDED.warehouse_2),
-                    warehouse_3 = COALESCE(orders.warehouse_3, EXCLUDED.warehouse_3),
-                    warehouse_4 = COALESCE(orders.warehouse_4, EXCLUDED.warehouse_4),
-                    is_trusted_customer = EXCLUDED.is_trusted_customer,
-                    updated_at = NOW()
-                RETURNING order_id
-            """, (
+                SELECT wh.names[1:4] AS warehouses FROM wh
+            """, {
+                **{k: row[k] for k in (
+                    'order_id', 'order_date', 'customer_name', 'company_name',
+                    'street', 'street2', 'city', 'state', 'zip_code', 'phone', 'email',
+                    'comments', 'order_total', 'total_weight'
+                )},
+                'sku_prefixes': [p.upper() for p in row['sku_prefixes']],
+                'skus': [item['sku'] for item in line_items],
+                'item_prefixes': [item['sku_prefix'] for item in line_items],
+                'product_names': [item['product_name'] for item in line_items],
+                'quantities': [item['quantity'] for item in line_items],
+                'prices': [item['price'] for item in line_items],
+                'event_data': json.dumps({'sku_prefixes': row['sku_prefixes']})
+            })
+            warehouses = cur.fetchone()['warehouses'] or []
+    
+    return _sync_result(row, warehouses)
+
+
+def upsert_orders_bulk(conn, rows: List[dict]) -> List[dict]:
+    """
+    Write many parsed orders (see parse_b2bwave_order) with a fixed number of
+    statements: one execute_values per table instead of one round trip per order.
+    Same semantics as sync_order_from_b2bwave. Caller owns the transaction.
+    """
+    # Last occurrence wins - ON CONFLICT can't touch the same row twice in one statement
+    rows = list({row['order_id']: row for row in rows}.values())
+    if not rows:
+        return []
+    
+    with conn.cursor() as cur:
+        # Lookup tables are small - load once per batch instead of once per order/item
+        cur.execute("SELECT UPPER(sku_prefix), warehouse_name FROM warehouse_mapping")
+        prefix_to_wh = {}
+        for prefix, warehouse_name in cur.fetchall():
+            prefix_to_wh.setdefault(prefix, warehouse_name)
+        
+        cur.execute("""
+            SELECT LOWER(customer_name), LOWER(company_name), LOWER(email)
+            FROM trusted_customers
+        """)
+        trusted = cur.fetchall()
+        trusted_names = {t[0] for t in trusted if t[0] is not None}
+        trusted_companies = {t[1] for t in trusted if t[1] is not None}
+        trusted_emails = {t[2] for t in trusted if t[2] is not None}
+        
+        def is_trusted(row):
+            return (
+                (row['customer_name'] is not None and row['customer_name'].lower() in trusted_names)
+                or (row['company_name'] is not None and row['company_name'].lower() in trusted_companies)
+                or (row['email'] is not None and row['email'].lower() in trusted_emails)
+            )
+        
+        # Every writer touches orders rows in order_id order, so overlapping syncs
+        # (auto-sync, /b2bwave/sync, /sync/all, other workers) wait instead of deadlocking
+        order_values, item_values, event_values, shipment_values, results = [], [], [], [], {}
+        for row in sorted(rows, key=lambda row: row['order_id']):
+            # Distinct warehouses for the order's SKU prefixes (up to 4), same order as array_agg(DISTINCT)
+            warehouses = sorted({prefix_to_wh[p.upper()] for p in row['sku_prefixes'] if p.upper() in prefix_to_wh})[:4]
+            padded = warehouses + [None] * (4 - len(warehouses))
+            
+            order_values.append((
+                row['order_id'], row['order_date'], row['customer_name'], row['company_name'],
+                row['street'], row['street2'], row['city'], row['state'], row['zip_code'],
+                row['phone'], row['email'], row['comments'], row['order_total'], row['total_weight'],
+                *padded, is_trusted(row)
+            ))
+            item_values.extend(
+                (row['order_id'], item['sku'], item['sku_prefix'], item['product_name'],
+                 item['quantity'], item['price'],
+                 prefix_to_wh.get(item['sku_prefix'].upper()) if item['sku_prefix'] else None)
+                for item in row['line_items']
+            )
+            event_values.append((row['order_id'], json.dumps({'sku_prefixes': row['sku_prefixes']})))
+            shipment_values.extend((row['order_id'], _shipment_id(row['order_id'], wh), wh) for wh in warehouses)
+            results[row['order_id']] = _sync_result(row, warehouses)
+        
+        execute_values(cur, """
+            INSERT INTO orders (
                 order_id, order_date, customer_name, company_name,
                 street, street2, city, state, zip_code, phone, email,
                 comments, order_total, total_weight, warehouse_1, warehouse_2, warehouse_3, warehouse_4,
-                is_trusted
-            ))
-            result = cur.fetchone()
-            
-            # Delete existing line items and re-insert
-            cur.execute("DELETE FROM order_line_items WHERE order_id = %s", (order_id,))
-            
-            # Insert line items with warehouse info
-            for item in line_items:
-                sku = item.get('sku', '')
-                prefix = sku.split('-')[0] if '-' in sku else ''
-                # Look up warehouse for this item
-                item_warehouse = None
-                if prefix:
-                    cur.execute("SELECT warehouse_name FROM warehouse_mapping WHERE UPPER(sku_prefix) = UPPER(%s)", (prefix,))
-                    wh_row = cur.fetchone()
-                    if wh_row:
-                        item_warehouse = wh_row['warehouse_name']
-                
-                cur.execute("""
-                    INSERT INTO order_line_items (order_id, sku, sku_prefix, product_name, quantity, price, warehouse)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (order_id, sku, prefix, item.get('product_name'), item.get('quantity'), item.get('price'), item_warehouse))
-            
-            # Log sync event
+                is_trusted_customer
+            ) VALUES %s
+            ON CONFLICT (order_id) DO UPDATE SET
+                customer_name = EXCLUDED.customer_name,
+                company_name = EXCLUDED.company_name,
+                street = EXCLUDED.street,
+                street2 = EXCLUDED.street2,
+                city = EXCLUDED.city,
+                state = EXCLUDED.state,
+                zip_code = EXCLUDED.zip_code,
+                phone = EXCLUDED.phone,
+                email = EXCLUDED.email,
+                comments = EXCLUDED.comments,
+                order_total = EXCLUDED.order_total,
+                total_weight = EXCLUDED.total_weight,
+                warehouse_1 = COALESCE(orders.warehouse_1, EXCLUDED.warehouse_1),
+                warehouse_2 = COALESCE(orders.warehouse_2, EXCLUDED.warehouse_2),
+                warehouse_3 = COALESCE(orders.warehouse_3, EXCLUDED.warehouse_3),
+                warehouse_4 = COALESCE(orders.warehouse_4, EXCLUDED.warehouse_4),
+                is_trusted_customer = EXCLUDED.is_trusted_customer,
+                updated_at = NOW()
+        """, order_values, page_size=500)
+        
+        # Replace line items
+        cur.execute("DELETE FROM order_line_items WHERE order_id = ANY(%s)", ([row['order_id'] for row in rows],))
+        if item_values:
+            execute_values(cur, """
+                INSERT INTO order_line_items (order_id, sku, sku_prefix, product_name, quantity, price, warehouse)
+                VALUES %s
+            """, item_values, page_size=500)
+        
+        # Log sync events
+        execute_values(cur, """
+            INSERT INTO order_events (order_id, event_type, event_data, source)
+            VALUES %s
+        """, event_values, template="(%s, 'b2bwave_sync', %s, 'api')", page_size=500)
+        
+        # Auto-create shipments for each warehouse
+        if shipment_values:
+            execute_values(cur, """
+                INSERT INTO order_shipments (order_id, shipment_id, warehouse, status)
+                VALUES %s
+                ON CONFLICT (shipment_id) DO NOTHING
+            """, shipment_values, template="(%s, %s, %s, 'needs_order')", page_size=500)
+    
+    return [results[row['order_id']] for row in rows]
+
+
+# Bulk sync: orders per transaction and number of transactions written concurrently
+SYNC_BATCH_SIZE = 50
+SYNC_MAX_WORKERS = 4
+
+# Streamed sync: API orders buffered before handing a chunk to the writer
+SYNC_STREAM_CHUNK = 500
+
+
+def _write_batch(rows: List[dict]) -> tuple:
+    """
+    Write one batch in its own transaction; returns (results, errors).
+    If the batch fails, retry order by order so one bad order doesn't drop the rest.
+    """
+    try:
+        with get_db() as conn:
+            return upsert_orders_bulk(conn, rows), []
+    except Exception as e:
+        if len(rows) == 1:
+            return [], [{"order_id": rows[0]['order_id'], "error": str(e)}]
+        print(f"[SYNC] Batch of {len(rows)} failed ({e}), retrying individually")
+    
+    results, errors = [], []
+    for row in rows:
+        try:
+            with get_db() as conn:
+                results.extend(upsert_orders_bulk(conn, [row]))
+        except Exception as e:
+            errors.append({"order_id": row['order_id'], "error": str(e)})
+    return results, errors
+
+
+def sync_orders_bulk(orders_data: List[dict]) -> tuple:
+    """
+    Parse a list of B2BWave orders and bulk-write them in batches of SYNC_BATCH_SIZE,
+    up to SYNC_MAX_WORKERS batches at a time. Results keep the input order.
+    Returns (synced results, errors).
+    """
+    rows, errors = [], []
+    for order_data in orders_data:
+        try:
+            rows.append(parse_b2bwave_order(order_data))
+        except Exception as e:
+            order_id = order_data.get('order', order_data).get('id', 'unknown')
+            errors.append({"order_id": order_id, "error": str(e)})
+    
+    # De-duplicate up front so concurrent batches never touch the same order
+    rows = list({row['order_id']: row for row in rows}.values())
+    batches = [rows[i:i + SYNC_BATCH_SIZE] for i in range(0, len(rows), SYNC_BATCH_SIZE)]
+    
+    synced = []
+    if len(batches) == 1:
+        batch_results = [_write_batch(batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS, thread_name_prefix="b2bwave-sync") as executor:
+            batch_results = list(executor.map(_write_batch, batches))
+    for results, batch_errors in batch_results:
+        synced.extend(results)
+        errors.extend(batch_errors)
+    return synced, errors
+
+
+def sync_orders_stream(orders_iter: Iterable[dict]) -> tuple:
+    """
+    Bulk-sync orders from an iterator (e.g. b2bwave_iter_orders) SYNC_STREAM_CHUNK
+    at a time. Each chunk is written in the background while the next pages are
+    fetched, so at most two chunks of raw API orders are held in memory.
+    Returns (synced results, errors).
+    """
+    synced, errors = [], []
+
+    def collect(future):
+        results, chunk_errors = future.result()
+        synced.extend(results)
+        errors.extend(chunk_errors)
+
+    # One writer keeps chunks in order and never lets two chunks race on an order
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="b2bwave-stream") as writer:
+        pending = None
+        chunk = []
+        for order_data in orders_iter:
+            chunk.append(order_data)
+            if len(chunk) >= SYNC_STREAM_CHUNK:
+                if pending is not None:
+                    collect(pending)
+                pending = writer.submit(sync_orders_bulk, chunk)
+                chunk = []
+        if pending is not None:
+            collect(pending)
+        if chunk:
+            collect(writer.submit(sync_orders_bulk, chunk))
+    return synced, errors
+
+
+def get_sync_cursor(key: str) -> Optional[str]:
+    """Read a sync cursor from sync_state (None if unset)"""
+    with get_db() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT value FROM sync_state WHERE key = %s", (key,))
+            row = cur.fetchone()
+    return row[0] if row else None
+
+
+def set_sync_cursor(key: str, value: str):
+    """Persist a sync cursor to sync_state"""
+    with get_db() as conn:
+        with conn.cursor() as cur:
             cur.execute("""
-                INSERT INTO order_events (order_id, event_type, event_data, source)
-                VALUES (%s, 'b2bwave_sync', %s, 'api')
-            """, (order_id, json.dumps({'sku_prefixes': sku_prefixes})))
-            
-            # Auto-create shipments for each warehouse
-            warehouses_list = [w for w in [warehouse_1, warehouse_2, warehouse_3, warehouse_4] if w]
-            for wh in warehouses_list:
-                # Create shipment_id like "5307-Li"
-                wh_short = wh.replace(' & ', '-').replace(' ', '-')
-                shipment_id = f"{order_id}-{wh_short}"
-                
-                # Check if shipment already exists
-                cur.execute("SELECT id FROM order_shipments WHERE shipment_id = %s", (shipment_id,))
-                if not cur.fetchone():
-                    cur.execute("""
-                        INSERT INTO order_shipments (order_id, shipment_id, warehouse, status)
-                        VALUES (%s, %s, %s, 'needs_order')
-                    """, (order_id, shipment_id, wh))
+                INSERT INTO sync_state (key, value, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+            """, (key, value))
+
+
+def enqueue_webhook_order(order_id: str):
+    """Queue a B2BWave order for immediate sync by the webhook worker"""
+    webhook_queue.put(str(order_id))
+
+
+def run_webhook_worker():
+    """Sync orders pushed by the B2BWave webhook as they arrive"""
+    while True:
+        order_id = webhook_queue.get()
+        try:
+            data = b2bwave_api_request("orders", {"id_eq": order_id})
+            if data:
+                sync_order_from_b2bwave(data[0] if isinstance(data, list) else data)
+                print(f"[WEBHOOK] Synced order {order_id}")
+            else:
+                print(f"[WEBHOOK] Order {order_id} not found in B2BWave")
+        except Exception as e:
+            print(f"[WEBHOOK] Error syncing order {order_id}: {e}")
+        finally:
+            webhook_queue.task_done()
+
+
+def _parse_updated_at(value: Optional[str]) -> Optional[datetime]:
+    """Parse a B2BWave updated_at timestamp (None if missing or unparseable)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _retry_failed_orders(order_ids: List[str]) -> tuple:
+    """Fetch orders by id and bulk-write them; returns (results, errors)"""
+    orders_data, errors = [], []
+    for order_id in order_ids:
+        try:
+            data = b2bwave_api_request("orders", {"id_eq": order_id})
+        except Exception as e:
+            errors.append({"order_id": order_id, "error": str(e)})
+            continue
+        if data:
+            orders_data.append(data[0] if isinstance(data, list) else data)
+        else:
+            print(f"[AUTO-SYNC] Order {order_id} not found in B2BWave, dropping retry")
+    if not orders_data:
+        return [], errors
+    results, write_errors = sync_orders_bulk(orders_data)
+    return results, errors + write_errors
+
+
+def sync_b2bwave_incremental() -> int:
+    """
+    Sync B2BWave orders updated since the stored cursor (or the last
+    AUTO_SYNC_DAYS_BACK days if there is none). Returns the number synced.
+    """
+    global last_auto_sync
     
-    return {
-        'order_id': order_id,
-        'customer_name': customer_name,
-        'company_name': company_name,
-        'city': city,
-        'state': state,
-        'zip_code': zip_code,
-        'warehouse_1': warehouse_1,
-        'warehouse_2': warehouse_2,
-        'warehouse_3': warehouse_3,
-        'warehouse_4': warehouse_4,
-        'line_items_count': len(line_items)
-    }
+    # Only fetch orders updated since the last run; fall back to a date range
+    try:
+        cursor = get_sync_cursor(B2BWAVE_CURSOR_KEY)
+    except Exception as e:
+        print(f"[AUTO-SYNC] Could not read sync cursor: {e}")
+        cursor = None
+    since_date = b2bwave_since_date(AUTO_SYNC_DAYS_BACK)
+    
+    # Stream pages from B2BWave into the bulk writer, keeping only each order's updated_at
+    updated_at_by_id = {}
+    
+    def track_updated_at(orders_iter):
+        for order_data in orders_iter:
+            order = order_data.get('order', order_data)
+            if order.get('updated_at'):
+                updated_at_by_id[str(order.get('id'))] = str(order['updated_at'])
+            yield order_data
+    
+    results, errors = sync_orders_stream(track_updated_at(b2bwave_iter_orders(since_date, updated_since=cursor)))
+    
+    # Orders that failed in earlier cycles are retried by id, since the cursor has moved past them
+    try:
+        retry = json.loads(get_sync_cursor(B2BWAVE_RETRY_KEY) or '{}')
+        retry_loaded = True
+    except Exception as e:
+        print(f"[AUTO-SYNC] Could not read retry list: {e}")
+        retry, retry_loaded = {}, False
+    seen = {str(r['order_id']) for r in results} | {str(e['order_id']) for e in errors}
+    retry_results, retry_errors = _retry_failed_orders([order_id for order_id in retry if order_id not in seen])
+    results += retry_results
+    errors += retry_errors
+    
+    synced = len(results)
+    for error in errors:
+        print(f"[AUTO-SYNC] Error syncing order {error['order_id']}: {error['error']}")
+    
+    # Written orders leave the retry list; failed ones count an attempt until they hit the limit
+    new_retry = {}
+    for error in errors:
+        order_id = str(error['order_id'])
+        attempts = retry.get(order_id, 0) + 1
+        if attempts >= B2BWAVE_MAX_SYNC_ATTEMPTS:
+            print(f"[AUTO-SYNC] Giving up on order {order_id} after {attempts} failed attempts")
+        else:
+            new_retry[order_id] = attempts
+    retry_saved = retry_loaded
+    if retry_loaded and new_retry != retry:
+        try:
+            set_sync_cursor(B2BWAVE_RETRY_KEY, json.dumps(new_retry))
+        except Exception as e:
+            print(f"[AUTO-SYNC] Could not save retry list: {e}")
+            retry_saved = False
+    
+    # Failed orders are on the retry list, so the cursor moves past every order seen.
+    # If the list couldn't be kept, hold the cursor so this run's failures come back
+    max_updated_at, max_dt = cursor, _parse_updated_at(cursor)
+    for updated_at in (updated_at_by_id.values() if retry_saved or not errors else ()):
+        updated_dt = _parse_updated_at(updated_at)
+        if updated_dt is not None and (max_dt is None or updated_dt > max_dt):
+            max_updated_at, max_dt = updated_at, updated_dt
+    
+    if max_updated_at and max_updated_at != cursor:
+        try:
+            set_sync_cursor(B2BWAVE_CURSOR_KEY, max_updated_at)
+        except Exception as e:
+            print(f"[AUTO-SYNC] Could not save sync cursor: {e}")
+    
+    last_auto_sync = datetime.now(timezone.utc)
+    print(f"[AUTO-SYNC] Completed: {synced} orders synced")
+    return synced
+
+
+def _run_with_db(sync_func, hours_back: int):
+    """Run a Gmail/Square style sync function on its own connection"""
+    with get_db() as conn:
+        return sync_func(conn, hours_back=hours_back)
 
 
 def run_auto_sync(gmail_sync_func=None, square_sync_func=None):
     """
     Background sync from B2BWave - runs every 15 minutes.
+    B2BWave, Gmail and Square are independent and I/O bound, so they run concurrently.
     
     Args:
         gmail_sync_func: Optional function to run Gmail sync
         square_sync_func: Optional function to run Square sync
     """
-    global last_auto_sync, auto_sync_running
+    global auto_sync_running
     
-    while True:
-        time.sleep(AUTO_SYNC_INTERVAL_MINUTES * 60)  # Wait 15 min
-        
-        if not is_configured():
-            print("[AUTO-SYNC] B2BWave not configured, skipping")
-            continue
-        
-        try:
-            auto_sync_running = True
-            print(f"[AUTO-SYNC] Starting sync at {datetime.now()}")
-            
-            # Calculate date range
-            since_date = (datetime.now(timezone.utc) - timedelta(days=AUTO_SYNC_DAYS_BACK)).strftime("%Y-%m-%d")
-            
-            # Fetch from B2BWave
-            data = b2bwave_api_request("orders", {"submitted_at_gteq": since_date})
-            orders_list = data if isinstance(data, list) else [data]
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="auto-sync") as executor:
+        while True:
+            time.sleep(AUTO_SYNC_INTERVAL_MINUTES * 60)  # Wait 15 min
             
-            synced = 0
-            for order_data in orders_list:
-                try:
-                    sync_order_from_b2bwave(order_data)
-                    synced += 1
-                except Exception as e:
-                    print(f"[AUTO-SYNC] Error syncing order: {e}")
+            if not is_configured():
+                print("[AUTO-SYNC] B2BWave not configured, skipping")
+                continue
             
-            last_auto_sync = datetime.now(timezone.utc)
-            print(f"[AUTO-SYNC] Completed: {synced} orders synced")
-            
-            # Run Gmail email sync if provided
-            if gmail_sync_func:
-                try:
-                    with get_db() as conn:
-                        gmail_results = gmail_sync_func(conn, hours_back=2)
-                        print(f"[AUTO-SYNC] Gmail sync: {gmail_results}")
-                except Exception as e:
-                    print(f"[AUTO-SYNC] Gmail sync error: {e}")
-            
-            # Run Square payment sync if provided
-            if square_sync_func:
-                try:
-                    with get_db() as conn:
-                        square_results = square_sync_func(conn, hours_back=24)
-                        print(f"[AUTO-SYNC] Square sync: {square_results}")
-                except Exception as e:
-                    print(f"[AUTO-SYNC] Square sync error: {e}")
-            
-        except Exception as e:
-            print(f"[AUTO-SYNC] Error: {e}")
-        finally:
-            auto_sync_running = False
+            try:
+                auto_sync_running = True
+                print(f"[AUTO-SYNC] Starting sync at {datetime.now()}")
+                
+                futures = {executor.submit(sync_b2bwave_incremental): "B2BWave"}
+                # Run Gmail email sync if provided
+                if gmail_sync_func:
+                    futures[executor.submit(_run_with_db, gmail_sync_func, 2)] = "Gmail"
+                # Run Square payment sync if provided
+                if square_sync_func:
+                    futures[executor.submit(_run_with_db, square_sync_func, 24)] = "Square"
+                
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        result = future.result()
+                        if name != "B2BWave":
+                            print(f"[AUTO-SYNC] {name} sync: {result}")
+                    except Exception as e:
+                        print(f"[AUTO-SYNC] {name} sync error: {e}")
+                
+            except Exception as e:
+                print(f"[AUTO-SYNC] Error: {e}")
+            finally:
+                auto_sync_running = False
 
 
-def start_auto_sync_thread(gmail_sync_func=None, square_sync_func=None):
-    """Start background sync thread"""
+def start_auto_sync_thread(gmail_sync_func=None, square_sync_func=None, scheduled: bool = True):
+    """
+    Start the webhook worker and, if scheduled, the background sync thread.
+    Every process needs the webhook worker for its own webhook_queue; the
+    scheduled sync runs only in the worker that claimed background jobs.
+    """
     if is_configured():
+        threading.Thread(target=run_webhook_worker, daemon=True).start()
+        if not scheduled:
+            print("[AUTO-SYNC] Scheduled sync runs in another worker; webhook worker started")
+            return False
         thread = threading.Thread(
             target=run_auto_sync, 
             args=(gmail_sync_func, square_sync_func),
@@ -330,5 +792,6 @@ def get_sync_status() -> Dict:
         "configured": is_configured(),
         "last_sync": last_auto_sync.isoformat() if last_auto_sync else None,
         "running": auto_sync_running,
-        "interval_minutes": AUTO_SYNC_INTERVAL_MINUTES
+        "interval_minutes": AUTO_SYNC_INTERVAL_MINUTES,
+        "webhook_queue_size": webhook_queue.qsize()
     }
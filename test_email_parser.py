@@ -0,0 +1,24 @@
+"""
+Regression tests for B2BWave email header parsing.
+"""
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from email_parser import parse_b2bwave_email
+
+
+def test_blank_name_line_does_not_swallow_phone():
+    body = "Order ID: 5261\nName:\nPhone: 352-665-0280\nEmail: bob@example.com\n"
+    result = parse_b2bwave_email(body, "Order #5261")
+    assert result['phone'] == '352-665-0280'
+    assert result['email'] == 'bob@example.com'
+
+
+def test_same_line_fields_are_all_extracted():
+    body = "Name: Bob Email: bob@x.com Phone 352-665-0280\nTotal: $1,234.50\n"
+    result = parse_b2bwave_email(body, "Order #5261")
+    assert result['email'] == 'bob@x.com'
+    assert result['phone'] == '352-665-0280'
+    assert result['order_total'] == 1234.50